@@ -0,0 +1,331 @@
+"""
+Measure the build performance of cython_setuptools on synthetic projects
+
+A project of ``--extensions`` extensions is generated for each flavour (``setup.cfg`` read by
+``cython_setuptools.setup`` and ``pyproject.toml`` read by ``cython_setuptools.create_extensions``).
+Each extension has a .pyx cimporting the ``--pxds`` shared .pxd files, ``--sources`` C sources and a pkg-config
+dependency whose ``.pc`` file is generated in the project. For each flavour, the benchmark measures:
+
+- ``cold_build``: ``python setup.py build_ext --inplace`` in a fresh copy of the project
+- ``noop_build``: the same command again, nothing changed
+- ``edit_build``: the same command after editing one .pyx
+- ``config_parse``: reading the configuration into extensions (including pkg-config) with a warm pkg-config cache
+- ``config_parse_cold``: the same with an empty pkg-config cache
+
+The builds run in subprocesses using the cython_setuptools of this checkout, the results are written as JSON
+and can be compared with the results of another commit::
+
+    python benchmarks/build_benchmark.py --output before.json
+    git checkout my-branch
+    python benchmarks/build_benchmark.py --output after.json --compare before.json
+
+With ``--trace-dir``, the Chrome trace of each build is written in the directory (see ``cython_setuptools.trace``).
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+from cython_setuptools.common import RACY_MTIME_DELAY_NS, write_json  # noqa: E402
+
+FLAVOURS = ("setup.cfg", "pyproject.toml")
+SCENARIOS = ("cold_build", "noop_build", "edit_build", "config_parse", "config_parse_cold")
+PKG_CONFIG_PACKAGE = "benchdep"
+
+# The env variables of cython_setuptools that would share state with other builds or change the measured build
+_ISOLATED_ENV_VARS = (
+    "CYTHONIZE",
+    "DEBUG",
+    "PROFILE_CYTHON",
+    "CYTHON_SETUPTOOLS_CACHE_DIR",
+    "CYTHON_SETUPTOOLS_CACHE_SIZE",
+    "CYTHON_SETUPTOOLS_OBJECT_CACHE_DIR",
+    "CYTHON_SETUPTOOLS_MEMORY_HISTORY",
+    "CYTHON_SETUPTOOLS_TRACE",
+)
+
+_PYPROJECT_SETUP_PY = """\
+from setuptools import setup
+from cython_setuptools import build_ext, create_extensions
+
+setup(packages=[], ext_modules=create_extensions(__file__), cmdclass={"build_ext": build_ext})
+"""
+
+_SETUP_CFG_SETUP_PY = """\
+from cython_setuptools import setup
+
+setup(__file__)
+"""
+
+# Run in the project directory, prints the time spent creating the extensions from the configuration
+_CONFIG_PARSE_SCRIPTS = {
+    "setup.cfg": """\
+import time
+start = time.perf_counter()
+from cython_setuptools.vendor import create_cython_ext_modules, parse_setup_cfg
+with open("setup.cfg") as fp:
+    create_cython_ext_modules(parse_setup_cfg(fp, cythonize=True))
+print(time.perf_counter() - start)
+""",
+    "pyproject.toml": """\
+import time
+start = time.perf_counter()
+from cython_setuptools import create_extensions
+create_extensions("setup.py")
+print(time.perf_counter() - start)
+""",
+}
+
+
+def generate_project(project_dir: Path, flavour: str, extensions: int, sources: int, pxds: int):
+    """
+    Generate a synthetic project
+
+    Args:
+        project_dir: directory of the project, created if needed
+        flavour: ``"setup.cfg"`` or ``"pyproject.toml"``
+        extensions: number of extensions
+        sources: number of C sources of each extension, in addition to its .pyx
+        pxds: number of .pxd files cimported by every extension
+    """
+    (project_dir / "pkgconfig").mkdir(parents=True, exist_ok=True)
+    (project_dir / "include").mkdir(exist_ok=True)
+    (project_dir / "include" / "benchdep.h").write_text("#define BENCHDEP_VALUE 1\n")
+    (project_dir / "pkgconfig" / f"{PKG_CONFIG_PACKAGE}.pc").write_text(
+        "includedir=${pcfiledir}/../include\n"
+        "\n"
+        f"Name: {PKG_CONFIG_PACKAGE}\n"
+        "Description: Dependency of the benchmark extensions\n"
+        "Version: 1.0\n"
+        "Cflags: -I${includedir} -DBENCHDEP_ENABLED=1\n"
+        "Libs:\n"
+    )
+    for pxd in range(pxds):
+        (project_dir / f"bench_common_{pxd}.pxd").write_text(
+            f"cdef inline int common_{pxd}(int value):\n"
+            f"    return value * {pxd + 2} + 1\n"
+        )
+
+    ext_names = [f"bench_ext_{ext:03}" for ext in range(extensions)]
+    ext_sources = {}
+    for ext_name in ext_names:
+        c_names = [f"{ext_name}_src_{source:03}" for source in range(sources)]
+        for c_name in c_names:
+            (project_dir / f"{c_name}.c").write_text(
+                '#include "benchdep.h"\n'
+                "\n"
+                f"int {c_name}(int value) {{\n"
+                "    int i, total = 0;\n"
+                "    for (i = 0; i < value; i++) {\n"
+                "        total += (i ^ value) * BENCHDEP_VALUE;\n"
+                "    }\n"
+                "    return total;\n"
+                "}\n"
+            )
+        (project_dir / f"{ext_name}.pyx").write_text(_generate_pyx(c_names, pxds))
+        ext_sources[ext_name] = [f"{ext_name}.pyx"] + [f"{c_name}.c" for c_name in c_names]
+
+    if flavour == "setup.cfg":
+        (project_dir / "setup.py").write_text(_SETUP_CFG_SETUP_PY)
+        (project_dir / "setup.cfg").write_text(_generate_setup_cfg(ext_sources))
+    elif flavour == "pyproject.toml":
+        (project_dir / "setup.py").write_text(_PYPROJECT_SETUP_PY)
+        (project_dir / "pyproject.toml").write_text(_generate_pyproject(ext_sources))
+    else:
+        raise ValueError(f"Unknown flavour {flavour!r}, expected one of {FLAVOURS}")
+
+
+def run_benchmark(flavour: str, work_dir: Path, args: argparse.Namespace) -> dict[str, list[float]]:
+    """
+    Run every scenario ``args.repeat`` times on a project of the flavour
+
+    Returns:
+        The durations in seconds of each scenario
+    """
+    results = {scenario: [] for scenario in SCENARIOS}
+    for repeat in range(args.repeat):
+        project_dir = work_dir / f"{flavour}-{repeat}"
+        generate_project(project_dir, flavour, args.extensions, args.sources, args.pxds)
+        env = _get_env(work_dir / f"pkg_config-{flavour}-{repeat}.json")
+        trace_prefix = f"{flavour}-{repeat}"
+
+        results["cold_build"].append(_time_build(project_dir, env, args, f"{trace_prefix}-cold"))
+        _wait_racy_mtimes()
+        results["noop_build"].append(_time_build(project_dir, env, args, f"{trace_prefix}-noop"))
+        edited_pyx = project_dir / "bench_ext_000.pyx"
+        edited_pyx.write_text(edited_pyx.read_text() + f"\n\ndef edited_{repeat}():\n    return {repeat}\n")
+        results["edit_build"].append(_time_build(project_dir, env, args, f"{trace_prefix}-edit"))
+        _wait_racy_mtimes()
+
+        # The pyproject.toml is only parsed when the extensions recorded by the last build are not reused
+        (project_dir / ".cython_setuptools_extensions.json").unlink(missing_ok=True)
+        results["config_parse"].append(_time_config_parse(project_dir, flavour, env))
+        (project_dir / ".cython_setuptools_extensions.json").unlink(missing_ok=True)
+        Path(env["CYTHON_SETUPTOOLS_PKG_CONFIG_CACHE"]).unlink(missing_ok=True)
+        results["config_parse_cold"].append(_time_config_parse(project_dir, flavour, env))
+        if not args.keep:
+            shutil.rmtree(project_dir)
+    return results
+
+
+def compare(results: dict, baseline: dict) -> str:
+    """
+    Returns:
+        A table of the median durations of the results and of the baseline, with the relative change
+    """
+    lines = [f"{'flavour':<16}{'scenario':<20}{'baseline':>10}{'current':>10}{'change':>10}"]
+    for flavour, scenarios in results["results"].items():
+        for scenario, durations in scenarios.items():
+            baseline_durations = baseline["results"].get(flavour, {}).get(scenario)
+            if not baseline_durations:
+                continue
+            before, after = statistics.median(baseline_durations), statistics.median(durations)
+            change = (after - before) / before * 100 if before else 0.0
+            lines.append(f"{flavour:<16}{scenario:<20}{before:>10.3f}{after:>10.3f}{change:>+9.1f}%")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--extensions", type=int, default=20, help="number of extensions (default: %(default)s)")
+    parser.add_argument("--sources", type=int, default=4, help="number of C sources per extension (default: %(default)s)")
+    parser.add_argument("--pxds", type=int, default=4, help="number of shared .pxd files (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each scenario (default: %(default)s)")
+    parser.add_argument("--jobs", "-j", type=int, help="number of parallel build jobs passed to build_ext")
+    parser.add_argument("--flavour", choices=FLAVOURS, action="append", help="flavour to benchmark (default: all)")
+    parser.add_argument("--output", "-o", type=Path, default=Path("build_benchmark.json"), help="JSON file of the results")
+    parser.add_argument("--compare", type=Path, help="JSON results of a previous run to compare with")
+    parser.add_argument("--trace-dir", type=Path, help="directory where the Chrome trace of each build is written")
+    parser.add_argument("--work-dir", type=Path, help="directory of the generated projects (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated projects")
+    args = parser.parse_args(argv)
+    if args.trace_dir:
+        args.trace_dir = args.trace_dir.resolve()
+        args.trace_dir.mkdir(parents=True, exist_ok=True)
+
+    results = {
+        **_get_metadata(),
+        "parameters": {name: getattr(args, name) for name in ("extensions", "sources", "pxds", "repeat", "jobs")},
+        "results": {},
+    }
+    work_dir = args.work_dir.resolve() if args.work_dir else Path(tempfile.mkdtemp(prefix="cython_setuptools_bench_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        for flavour in args.flavour or FLAVOURS:
+            print(f"benchmarking the {flavour} flavour", file=sys.stderr)
+            results["results"][flavour] = run_benchmark(flavour, work_dir, args)
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    write_json(args.output, results)
+
+    for flavour, scenarios in results["results"].items():
+        for scenario, durations in scenarios.items():
+            print(f"{flavour:<16}{scenario:<20}{statistics.median(durations):>10.3f}s")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(results, json.load(f)))
+
+
+def _generate_pyx(c_names: list[str], pxds: int) -> str:
+    lines = ["# cython: language_level=3", ""]
+    lines += [f"from bench_common_{pxd} cimport common_{pxd}" for pxd in range(pxds)]
+    lines += ["", 'cdef extern from "benchdep.h":', "    int BENCHDEP_VALUE", ""]
+    for c_name in c_names:
+        lines += ["cdef extern from *:", f"    int {c_name}(int value)", ""]
+    lines += ["", "def run(int value):", "    cdef int total = BENCHDEP_VALUE"]
+    lines += [f"    total += common_{pxd}(value)" for pxd in range(pxds)]
+    lines += [f"    total += {c_name}(value)" for c_name in c_names]
+    lines += ["    return total", ""]
+    return "\n".join(lines)
+
+
+def _generate_setup_cfg(ext_sources: dict[str, list[str]]) -> str:
+    lines = ["[metadata]", "name = bench", "version = 1.0", ""]
+    for ext_name, sources in ext_sources.items():
+        lines += [f"[cython-module: {ext_name}]", f"sources = {sources[0]}"]
+        lines += [f"          {source}" for source in sources[1:]]
+        lines += [f"pkg_config_packages = {PKG_CONFIG_PACKAGE}", "pkg_config_dirs = pkgconfig", ""]
+    return "\n".join(lines)
+
+
+def _generate_pyproject(ext_sources: dict[str, list[str]]) -> str:
+    lines = ["[project]", 'name = "bench"', 'version = "1.0"', ""]
+    for ext_name, sources in ext_sources.items():
+        lines += [
+            f"[cython_extensions.{ext_name}]",
+            f"sources = {json.dumps(sources)}",
+            f'pkg_config_packages = ["{PKG_CONFIG_PACKAGE}"]',
+            'pkg_config_dirs = ["pkgconfig"]',
+            "",
+        ]
+    return "\n".join(lines)
+
+
+def _get_env(pkg_config_cache: Path) -> dict[str, str]:
+    env = {name: value for name, value in os.environ.items() if name not in _ISOLATED_ENV_VARS}
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPO_DIR), env.get("PYTHONPATH")]))
+    env["CYTHON_SETUPTOOLS_PKG_CONFIG_CACHE"] = str(pkg_config_cache)
+    return env
+
+
+def _time_build(project_dir: Path, env: dict[str, str], args: argparse.Namespace, trace_name: str) -> float:
+    cmd = [sys.executable, "setup.py", "build_ext", "--inplace"]
+    if args.jobs:
+        cmd += ["-j", str(args.jobs)]
+    if args.trace_dir:
+        env = {**env, "CYTHON_SETUPTOOLS_TRACE": str(args.trace_dir / f"{trace_name}.json")}
+    start = time.perf_counter()
+    _run(cmd, project_dir, env)
+    return time.perf_counter() - start
+
+
+def _time_config_parse(project_dir: Path, flavour: str, env: dict[str, str]) -> float:
+    # The duration is the last line, after the warnings
+    return float(_run([sys.executable, "-c", _CONFIG_PARSE_SCRIPTS[flavour]], project_dir, env).splitlines()[-1])
+
+
+def _run(cmd: list[str], cwd: Path, env: dict[str, str]) -> str:
+    process = subprocess.run(cmd, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if process.returncode:
+        raise RuntimeError(f"{' '.join(cmd)} failed in {cwd}:\n{process.stdout}")
+    return process.stdout
+
+
+def _wait_racy_mtimes():
+    # The build steps are not skipped while their inputs are too recent for their mtime to be trusted,
+    # like a developer rebuilding a few seconds after the last change
+    time.sleep(RACY_MTIME_DELAY_NS / 1e9)
+
+
+def _get_metadata() -> dict:
+    import Cython
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR, text=True))
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "cython": Cython.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,25 @@
+import importlib
+
 from ._version import __version__  # noqa
-from .extentions import create_extensions  # noqa
-from .vendor import setup  # noqa
+
+__all__ = ["__version__", "build_ext", "create_extensions", "setup"]
+
+# The public API is imported on first use: importing the package, eg: to read its version,
+# does not import Cython, pyserde or setuptools
+_LAZY_ATTRIBUTES = {
+    "build_ext": ".command",
+    "create_extensions": ".extentions",
+    "setup": ".vendor",
+}
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
@@ -0,0 +1,228 @@
+"""
+Bundling of several extensions into a single shared library
+
+The extensions sharing a ``bundle`` are replaced by one extension named after the bundle, compiling all their
+sources and a generated C stub, which is the module of the bundle itself. Its multi-phase initialization registers
+a ``sys.meta_path`` finder of the bundled modules: each one is then created by its own ``PyInit_<name>`` function,
+looked up in the already loaded shared library of the bundle, so importing them does not open another file.
+"""
+import glob
+import json
+import os
+
+from .common import BUILD_EXT_ATTRIBUTES
+
+# The names of the bundled modules are inserted in the stub
+_FINDER_CODE = '''\
+import sys
+from importlib.machinery import ExtensionFileLoader
+from importlib.util import spec_from_file_location
+
+
+class BundleFinder:
+    """Find the modules bundled in the shared library of this module"""
+
+    def __init__(self, bundle_path, names):
+        self.bundle_path = bundle_path
+        self.names = names
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname not in self.names:
+            return None
+        loader = ExtensionFileLoader(fullname, self.bundle_path)
+        return spec_from_file_location(fullname, self.bundle_path, loader=loader)
+
+    def invalidate_caches(self):
+        pass
+
+
+__bundled_modules__ = {names}
+# A reloaded bundle replaces its finder
+sys.meta_path[:] = [finder for finder in sys.meta_path if getattr(finder, "bundle_path", None) != __file__]
+sys.meta_path.insert(0, BundleFinder(__file__, frozenset(__bundled_modules__)))
+'''
+
+_STUB_TEMPLATE = """\
+/* Generated by cython_setuptools: module of the bundle {bundle}, registering its bundled modules */
+#include <Python.h>
+
+static const char finder_code[] =
+{finder_code};
+
+static int bundle_exec(PyObject *module)
+{{
+    PyObject *globals = PyModule_GetDict(module);
+    PyObject *code, *result;
+
+    if (PyDict_GetItemString(globals, "__builtins__") == NULL
+        && PyDict_SetItemString(globals, "__builtins__", PyEval_GetBuiltins()) < 0) {{
+        return -1;
+    }}
+    code = Py_CompileString(finder_code, "<bundle {bundle}>", Py_file_input);
+    if (code == NULL) {{
+        return -1;
+    }}
+    result = PyEval_EvalCode(code, globals, globals);
+    Py_DECREF(code);
+    if (result == NULL) {{
+        return -1;
+    }}
+    Py_DECREF(result);
+    return 0;
+}}
+
+static PyModuleDef_Slot bundle_slots[] = {{
+    {{Py_mod_exec, (void *)bundle_exec}},
+    {{0, NULL}}
+}};
+
+static struct PyModuleDef bundle_def = {{
+    PyModuleDef_HEAD_INIT, "{bundle}", NULL, 0, NULL, bundle_slots, NULL, NULL, NULL
+}};
+
+PyMODINIT_FUNC PyInit_{short_name}(void)
+{{
+    return PyModuleDef_Init(&bundle_def);
+}}
+"""
+
+# The options of the bundled extensions merged into the extension of the bundle
+_MERGED_LISTS = ("sources", "depends", "include_dirs", "library_dirs", "libraries")
+_MERGED_ARGS = ("extra_link_args",)
+# The options compiling the sources, which must be the same for all the bundled extensions
+_SHARED_OPTIONS = ("extra_compile_args", "define_macros", "undef_macros")
+
+
+def get_stub_path(bundle: str) -> str:
+    """
+    Returns:
+        The path of the C stub of a bundle, relative to the project, eg: ``pkg/_native.bundle.c`` for ``pkg._native``
+    """
+    return os.path.join(*bundle.split(".")) + ".bundle.c"
+
+
+def bundle_extensions(extensions: list, bundles: list[str | None]) -> list:
+    """
+    Replace the extensions of each bundle by the extension of the bundle and write its C stub
+
+    The sources of a bundle are compiled together, so its extensions must have the same ``extra_compile_args``,
+    ``define_macros`` and ``undef_macros``. Their other lists are concatenated without duplicates, as are the
+    ``extra_link_args`` that differ between extensions.
+
+    Args:
+        extensions: the extensions, with their generated .c/.cpp files or their .pyx as sources
+        bundles: the name of the bundle of each extension, None if it is not bundled
+
+    Returns:
+        The extensions, each bundle replacing its first extension
+
+    Raises:
+        ValueError: if two modules of a bundle have the same last name component, which names their init function,
+            or are compiled with different options
+    """
+    members: dict[str, list] = {}
+    for extension, bundle in zip(extensions, bundles):
+        if bundle is not None:
+            members.setdefault(bundle, []).append(extension)
+    bundled = []
+    for extension, bundle in zip(extensions, bundles):
+        if bundle is None:
+            bundled.append(extension)
+        elif members[bundle][0] is extension:
+            bundled.append(_create_bundle(bundle, members[bundle]))
+    return bundled
+
+
+def _create_bundle(bundle: str, extensions: list):
+    from setuptools.extension import Extension
+
+    short_names = {bundle.rpartition(".")[2]: bundle}
+    for extension in extensions:
+        short_name = extension.name.rpartition(".")[2]
+        if short_name in short_names:
+            raise ValueError(
+                f"{extension.name} and {short_names[short_name]} can not be bundled in {bundle}: "
+                f"they both define PyInit_{short_name}"
+            )
+        short_names[short_name] = extension.name
+        for name in _SHARED_OPTIONS:
+            if getattr(extension, name) != getattr(extensions[0], name):
+                raise ValueError(
+                    f"{extension.name} and {extensions[0].name} can not be bundled in {bundle}: they have different "
+                    f"{name} ({getattr(extension, name)} and {getattr(extensions[0], name)}), which would apply to "
+                    "the sources of both"
+                )
+    stub_path = get_stub_path(bundle)
+    _write_stub(stub_path, bundle, [extension.name for extension in extensions])
+
+    kwargs = {name: [] for name in _MERGED_LISTS + _MERGED_ARGS}
+    kwargs.update({name: list(getattr(extensions[0], name)) for name in _SHARED_OPTIONS})
+    merged_args = {name: [] for name in _MERGED_ARGS}
+    for extension in extensions:
+        for name in _MERGED_LISTS:
+            kwargs[name] += [value for value in getattr(extension, name) if value not in kwargs[name]]
+        for name in _MERGED_ARGS:
+            # The args are not deduplicated one by one, eg: "-framework A -framework B"
+            args = getattr(extension, name)
+            if args not in merged_args[name]:
+                merged_args[name].append(args)
+                kwargs[name] += args
+    kwargs["sources"].append(stub_path)
+    languages = {extension.language or "c" for extension in extensions}
+    bundle_extension = Extension(
+        name=bundle,
+        language="c++" if "c++" in languages else "c",
+        # The stub only uses the limited API
+        py_limited_api=all(getattr(extension, "py_limited_api", False) for extension in extensions),
+        # Only the init function of the module named like the library is exported by default (eg: on Windows)
+        export_symbols=[f"PyInit_{extension.name.rpartition('.')[2]}" for extension in extensions],
+        **kwargs,
+    )
+    _merge_build_ext_attributes(bundle_extension, extensions)
+    # The stub defines static functions that the sources may define too
+    bundle_extension.unity_exclude.append(glob.escape(stub_path))
+    return bundle_extension
+
+
+def _merge_build_ext_attributes(bundle_extension, extensions: list):
+    attributes = [
+        {key: getattr(extension, key, default) for key, default in BUILD_EXT_ATTRIBUTES.items()} for extension in extensions
+    ]
+    bundle_extension.precompiled_headers = list(dict.fromkeys(
+        header for extension_attributes in attributes for header in extension_attributes["precompiled_headers"]
+    ))
+    # The sources of the bundled extensions without unity build are excluded from the one of the bundle
+    unity_attributes = [extension_attributes for extension_attributes in attributes if extension_attributes["unity_build"]]
+    bundle_extension.unity_build = bool(unity_attributes)
+    bundle_extension.unity_batch_size = min(
+        (extension_attributes["unity_batch_size"] for extension_attributes in unity_attributes),
+        key=lambda batch_size: batch_size or float("inf"),
+        default=BUILD_EXT_ATTRIBUTES["unity_batch_size"],
+    )
+    bundle_extension.unity_exclude = list(dict.fromkeys([
+        *(pattern for extension_attributes in unity_attributes for pattern in extension_attributes["unity_exclude"]),
+        *(
+            glob.escape(source)
+            for extension, extension_attributes in zip(extensions, attributes)
+            if not extension_attributes["unity_build"]
+            for source in extension.sources
+        ),
+    ]))
+
+
+def _write_stub(path: str, bundle: str, module_names: list[str]):
+    finder_code = _FINDER_CODE.format(names=repr(tuple(module_names)))
+    content = _STUB_TEMPLATE.format(
+        bundle=bundle,
+        short_name=bundle.rpartition(".")[2],
+        finder_code="\n".join(json.dumps(line) for line in finder_code.splitlines(keepends=True)),
+    )
+    try:
+        with open(path, encoding="utf-8") as f:
+            if f.read() == content:  # Keep its mtime, so that it is not compiled again
+                return
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
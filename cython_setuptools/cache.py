@@ -0,0 +1,118 @@
+"""
+Content-addressed on-disk cache, used to share generated files between checkouts and CI jobs
+"""
+import os
+import shutil
+import tempfile
+import threading
+
+from .common import parse_size
+
+
+class FileCache:
+    """
+    A directory of files named after the digest of their inputs, bounded in size with a LRU eviction
+
+    The last access time of an entry is tracked with its mtime, which is updated on every hit.
+    """
+
+    def __init__(self, directory: os.PathLike, max_size: int | None = None):
+        """
+        Args:
+            directory: the cache directory, it is created if needed
+            max_size: maximum size of the cache in bytes, ``None`` means unbounded
+        """
+        self.directory = os.fspath(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def restore(self, key: str, destination: os.PathLike) -> bool:
+        """
+        Copy the entry ``key`` to ``destination``
+
+        Returns:
+            True if the entry exists
+        """
+        entry_path = self._entry_path(key)
+        try:
+            _atomic_copy(entry_path, destination)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        os.utime(entry_path)
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key: str, source: os.PathLike):
+        """
+        Copy ``source`` in the cache as the entry ``key``
+        """
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        _atomic_copy(source, entry_path)
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in ``max_size``
+        """
+        if self.max_size is None:
+            return
+        entries = []
+        total_size = 0
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:  # Evicted by a concurrent build
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+                total_size += stat.st_size
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key[2:])
+
+
+def get_file_cache(
+    cache_dir: str | None, cache_size: str | int | None, env_prefix: str = "CYTHON_SETUPTOOLS_CACHE"
+) -> FileCache | None:
+    """
+    Create the cache configured in the ``pyproject.toml`` or with the env variables
+
+    Args:
+        cache_dir: the cache directory, overrided by the env variable ``<env_prefix>_DIR``
+        cache_size: the maximum size of the cache (eg: "2G"), overrided by the env variable ``<env_prefix>_SIZE``
+        env_prefix: prefix of the env variables
+
+    Returns:
+        The cache or None if no cache directory is configured
+    """
+    cache_dir = os.environ.get(f"{env_prefix}_DIR", cache_dir)
+    cache_size = os.environ.get(f"{env_prefix}_SIZE", cache_size)
+    if not cache_dir:
+        return None
+    return FileCache(os.path.expanduser(cache_dir), None if cache_size is None else parse_size(cache_size))
+
+
+def _atomic_copy(source: os.PathLike, destination: os.PathLike):
+    directory = os.path.dirname(os.path.abspath(destination))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
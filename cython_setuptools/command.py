@@ -0,0 +1,754 @@
+"""
+``build_ext`` command compiling the translation units of all the extensions in parallel
+and reusing the object files compiled by previous builds
+
+Use it with ``setuptools.setup(cmdclass={"build_ext": build_ext})``, it is the default of ``cython_setuptools.setup``.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import contextlib
+import glob
+import hashlib
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import threading
+
+from setuptools.command.build_ext import build_ext as _build_ext
+from setuptools.extension import Library
+# Distutils is deprecated but for the moment this is the only way to reuse its compilation logic
+from setuptools._distutils import log
+from setuptools._distutils.dep_util import newer_group
+from setuptools._distutils.errors import DistutilsSetupError
+# The compilers catch the errors of the imported distutils module, which is not always setuptools' one
+from distutils.errors import DistutilsExecError
+
+from .cache import get_file_cache
+from .common import (
+    BUILD_EXT_ATTRIBUTES,
+    C_EXT,
+    CPP_EXT,
+    CYTHON_EXT,
+    DIGEST_SIZE,
+    convert_to_bool,
+    file_digest,
+    get_compiler_family,
+    get_jobs,
+    get_lto_archiver,
+    get_lto_mode,
+    parse_size,
+    read_json,
+    write_json,
+)
+from .ninja import NINJA_FILE_NAME, NinjaEdge, find_ninja, is_ninja_enabled, write_ninja_file
+from .pch import PCH_LANGUAGES, PrecompiledHeader, get_depfile_path, get_precompiled_header, read_depfile, write_header
+from .scheduler import JobServer, MemoryBudget, get_makeflags_jobs, spawn_and_measure
+from .stamp import get_key, read_stamp, write_stamp
+from .trace import get_tracer
+from .unity import get_unity_sources
+from ._version import __version__
+
+BUILD_STAMP_NAME = "build_stamp.json"
+# The configuration of the compiler created by distutils
+_COMPILER_CONFIG_VARS = ("CC", "CXX", "CFLAGS", "CCSHARED", "LDSHARED", "LDCXXSHARED", "AR", "ARFLAGS", "EXT_SUFFIX")
+_COMPILER_ENV_VARS = ("CC", "CXX", "CPP", "CFLAGS", "CPPFLAGS", "LDFLAGS", "LDSHARED", "AR", "ARFLAGS", "MACOSX_DEPLOYMENT_TARGET")
+
+
+class build_ext(_build_ext):
+    """
+    Build the extensions like setuptools does, but compile all the translation units of all the extensions
+    through a shared pool of jobs, and look for each compiled translation unit in a cache first
+
+    Each extension is linked as soon as its objects are ready.
+    The number of jobs is set with ``-j``, else with the ``CYTHON_SETUPTOOLS_JOBS`` env variable,
+    else with the ``-j`` of ``MAKEFLAGS``, and defaults to ``os.cpu_count()``.
+    When run from ``make``, the jobserver advertised in ``MAKEFLAGS`` also limits the concurrent jobs.
+
+    The peak memory of every compilation is measured (on POSIX platforms) and stored in a history file,
+    ``memory_history.json`` in the build temp directory or the ``CYTHON_SETUPTOOLS_MEMORY_HISTORY`` path.
+    With ``--memory-budget`` or the ``CYTHON_SETUPTOOLS_MEMORY_BUDGET`` env variable (eg: "12G"),
+    jobs are only started if the sum of their peak memory in the previous builds fits in the budget.
+
+    The cache key covers the preprocessed source, the compiler executable and all the compilation flags.
+    The cache is disabled by default, it is enabled with the ``--object-cache-dir`` option
+    or the ``CYTHON_SETUPTOOLS_OBJECT_CACHE_DIR`` env variable. Its maximum size is set with
+    ``--object-cache-size`` or ``CYTHON_SETUPTOOLS_OBJECT_CACHE_SIZE`` (eg: "10G").
+    Only compilers that can preprocess (eg: not msvc) use the cache.
+
+    After a successful build, a stamp recording the options, the compiler configuration, the extensions
+    and the signatures of their sources, ``depends`` and outputs is written in the build temp directory.
+    The next build is skipped, without even creating the compiler, if none of them changed.
+
+    With ``--ninja`` or the ``CYTHON_SETUPTOOLS_NINJA`` env variable, the extensions are built by ninja from a
+    ``build.ninja`` written in the build temp directory: .pyx are cythonized next to them, and the dependencies
+    reported by Cython and the compiler in depfiles decide what is rebuilt. The object cache and the memory budget
+    are not used by this backend, which requires the ninja executable and a Unix compiler (gcc, clang, ...).
+    Otherwise, and for the optional extensions, libraries and extensions needing a stub,
+    the default backend is used.
+
+    With ``--pgo`` or the ``CYTHON_SETUPTOOLS_PGO`` env variable, the extensions are built with profile-guided
+    optimization (gcc or clang): they are built with instrumentation, the training command of ``--pgo-command``
+    or of the ``[tool.cython_setuptools.pgo]`` table of the ``pyproject.toml`` is run with the built extensions
+    in its ``PYTHONPATH``, and the extensions are rebuilt using the recorded profiles (see ``cython_setuptools.pgo``).
+    Both builds compile everything and do not use the object cache.
+
+    The extensions compiled with link-time optimization (gcc or clang ``-flto``) must be linked with the same mode,
+    else the build fails before compiling anything. The static libraries built with them are archived by
+    ``gcc-ar`` or ``llvm-ar`` when installed, which index the symbols of the LTO objects.
+
+    The ``precompiled_headers`` attribute of an extension lists headers (eg: "numpy/arrayobject.h") precompiled once
+    for each distinct compilation command and language, in the ``pch`` directory of the build temp directory, and
+    included first by every translation unit of the extension (see ``cython_setuptools.pch``). The extensions with
+    identical flags share their precompiled headers. They are only supported by Unix compilers (gcc, clang, ...).
+
+    With the ``unity_build`` attribute of an extension, its C/C++ sources that are not generated by Cython nor matched
+    by its ``unity_exclude`` patterns are compiled in batches of ``unity_batch_size`` sources, each batch being
+    a translation unit written in the ``unity`` directory of the build temp directory (see ``cython_setuptools.unity``).
+    """
+
+    user_options = _build_ext.user_options + [
+        ("object-cache-dir=", None, "directory of the cache of compiled object files"),
+        ("object-cache-size=", None, "maximum size of the cache of compiled object files (eg: 10G)"),
+        ("memory-budget=", None, "maximum memory used by the concurrent jobs (eg: 12G)"),
+        ("ninja", None, "build the extensions with ninja"),
+        ("pgo", None, "build the extensions with profile-guided optimization"),
+        ("pgo-command=", None, "training command of the profile-guided optimization"),
+    ]
+    boolean_options = _build_ext.boolean_options + ["ninja", "pgo"]
+
+    def initialize_options(self):
+        super().initialize_options()
+        self.object_cache_dir = None
+        self.object_cache_size = None
+        self.memory_budget = None
+        self.ninja = False
+        self.pgo = False
+        self.pgo_command = None
+
+    def finalize_options(self):
+        super().finalize_options()
+        self._object_cache = get_file_cache(
+            self.object_cache_dir, self.object_cache_size, env_prefix="CYTHON_SETUPTOOLS_OBJECT_CACHE"
+        )
+        self.memory_budget = os.environ.get("CYTHON_SETUPTOOLS_MEMORY_BUDGET", self.memory_budget)
+        if self.memory_budget is not None:
+            self.memory_budget = parse_size(self.memory_budget)
+        self._job_memory = threading.local()
+        self.ninja = is_ninja_enabled(bool(self.ninja))
+        self.pgo = convert_to_bool(os.environ.get("CYTHON_SETUPTOOLS_PGO", bool(self.pgo)))
+        # extension name -> language -> precompiled header
+        self._precompiled_headers = {}
+
+    def run(self):
+        stamp_path = os.path.join(self.build_temp, BUILD_STAMP_NAME)
+        stamp_key = self._get_stamp_key()
+        if stamp_key is not None:
+            inputs, outputs = self._get_stamp_files()
+            if not self.force and read_stamp(stamp_path, stamp_key) == outputs:
+                log.info("skipping build_ext: nothing changed since the last build")
+                return
+        if self.pgo and not self.dry_run:
+            self._run_pgo()
+        else:
+            super().run()
+        if stamp_key is not None and all(os.path.exists(output) for output in outputs):
+            write_stamp(stamp_path, stamp_key, inputs, outputs, content=outputs)
+
+    def _run_pgo(self):
+        """
+        Build the extensions with instrumentation, run the training command and rebuild them with the profiles
+        """
+        from .pgo import get_pgo_flags, merge_profiles
+
+        training_command, profile_dir = self._get_pgo_config()
+        compiler_family = get_compiler_family()
+        profile_dirs = {ext.name: os.path.join(profile_dir, ext.name) for ext in self.extensions}
+        original_args = [(ext.extra_compile_args, ext.extra_link_args) for ext in self.extensions]
+        compiler, force, object_cache = self.compiler, self.force, self._object_cache
+        # The objects depend on the profiles, which are not part of the cache keys nor of the ninja commands
+        self.force, self._object_cache = True, None
+        try:
+            for phase in ("generate", "use"):
+                for ext, (extra_compile_args, extra_link_args) in zip(self.extensions, original_args):
+                    pgo_flags = get_pgo_flags(phase, profile_dirs[ext.name], compiler_family)
+                    ext.extra_compile_args = [*(extra_compile_args or []), *pgo_flags]
+                    ext.extra_link_args = [*(extra_link_args or []), *pgo_flags]
+                if phase == "generate":
+                    # Profiles of a previous version of the sources would not match
+                    for ext_profile_dir in profile_dirs.values():
+                        shutil.rmtree(ext_profile_dir, ignore_errors=True)
+                log.info("building the extensions for the %s phase of the profile-guided optimization", phase)
+                # distutils replaces the compiler option by the compiler it creates
+                self.compiler = compiler
+                with get_tracer().span("pgo", phase):
+                    super().run()
+                if phase == "generate":
+                    self._run_pgo_training(training_command)
+                    for ext_profile_dir in profile_dirs.values():
+                        merge_profiles(ext_profile_dir, compiler_family)
+        finally:
+            for ext, (extra_compile_args, extra_link_args) in zip(self.extensions, original_args):
+                ext.extra_compile_args, ext.extra_link_args = extra_compile_args, extra_link_args
+            self.force, self._object_cache = force, object_cache
+
+    def _get_pgo_config(self) -> tuple[list[str] | str, str]:
+        """
+        Returns:
+            The training command and the directory of the profiles
+        """
+        from .pyproject import CythonSetuptoolsConfig
+
+        config = CythonSetuptoolsConfig()
+        pyproject_path = os.path.join(self.distribution.src_root or os.curdir, "pyproject.toml")
+        if os.path.exists(pyproject_path):
+            from .pyproject import read_pyproject
+
+            config = read_pyproject(pyproject_path)[1]
+        training_command = shlex.split(self.pgo_command) if self.pgo_command else config.pgo.training_command
+        if not training_command:
+            raise DistutilsSetupError(
+                "profile-guided optimization needs a training command: "
+                "set --pgo-command or training_command in [tool.cython_setuptools.pgo] of the pyproject.toml"
+            )
+        return training_command, config.pgo.profile_dir or os.path.join(self.build_temp, "pgo")
+
+    def _run_pgo_training(self, training_command: list[str] | str):
+        env = os.environ.copy()
+        if not self.inplace:
+            env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.abspath(self.build_lib), env.get("PYTHONPATH")]))
+        shell = isinstance(training_command, str)
+        log.info("running the training of the profile-guided optimization: %s",
+                 training_command if shell else subprocess.list2cmdline(training_command))
+        with get_tracer().span("pgo", "training"):
+            exit_code = subprocess.run(training_command, shell=shell, env=env).returncode
+        if exit_code:
+            raise DistutilsExecError(f"the training command of the profile-guided optimization failed with exit code {exit_code}")
+
+    def _get_stamp_key(self) -> str | None:
+        """
+        Returns:
+            The key of the build stamp, None if the build can not be skipped based on a stamp
+        """
+        # The .pyx are cythonized by Cython's build_ext, which tracks their dependencies
+        if self.dry_run or not self.extensions or self.distribution.has_c_libraries() or any(
+            os.path.splitext(source)[1] == CYTHON_EXT for ext in self.extensions for source in ext.sources
+        ):
+            return None
+        option_names = [option[0].rstrip("=").replace("-", "_") for option in self.user_options]
+        return get_key({
+            "version": __version__,
+            "python": sys.version,
+            "executable": sys.executable,
+            "options": {name: getattr(self, name, None) for name in option_names if name != "force"},
+            "config_vars": {name: sysconfig.get_config_var(name) for name in _COMPILER_CONFIG_VARS},
+            "env": {name: os.environ.get(name) for name in _COMPILER_ENV_VARS},
+            "extensions": [vars(ext) for ext in self.extensions],
+        })
+
+    def _get_stamp_files(self) -> tuple[list[str], list[str]]:
+        """
+        Returns:
+            The inputs (sources and ``depends``) and the outputs of the extensions, in build_lib and in place
+        """
+        inputs = []
+        outputs = []
+        inplace = self.inplace
+        try:
+            for ext in self.extensions:
+                inputs += [*ext.sources, *ext.depends]
+                for self.inplace in sorted({0, inplace}):
+                    outputs.append(self.get_ext_fullpath(ext.name))
+        finally:
+            self.inplace = inplace
+        return inputs, outputs
+
+    def build_extensions(self):
+        if self._object_cache is not None and not getattr(self.compiler, "preprocessor", None):
+            log.info("object cache disabled: the compiler can not preprocess")
+            self._object_cache = None
+        self.check_extensions_list(self.extensions)
+        self._check_lto(self.extensions)
+        # The compilation commands are captured before the compiler spawns the measured jobs
+        self._prepare_precompiled_headers(self.extensions)
+        makeflags = os.environ.get("MAKEFLAGS")
+        jobs = self._get_jobs(makeflags)
+        jobserver = JobServer.from_makeflags(makeflags)
+        history_path = os.environ.get("CYTHON_SETUPTOOLS_MEMORY_HISTORY") or os.path.join(
+            self.build_temp, "memory_history.json"
+        )
+        memory_budget = MemoryBudget(self.memory_budget, read_json(history_path, {}), jobs)
+        extensions = self.extensions
+        if self._use_ninja():
+            extensions = [ext for ext in self.extensions if not self._is_ninja_supported(ext)]
+            self._build_extensions_with_ninja([ext for ext in self.extensions if self._is_ninja_supported(ext)], jobs)
+        if hasattr(os, "wait4"):
+            self.compiler.spawn = self._spawn_and_measure
+        try:
+            self._build_extensions_pooled(extensions, jobs, jobserver, memory_budget)
+        finally:
+            if jobserver is not None:
+                jobserver.close()
+            self.compiler.__dict__.pop("spawn", None)
+            write_json(history_path, memory_budget.history)
+        if self._object_cache is not None:
+            log.info("object cache: %d hits, %d misses", self._object_cache.hits, self._object_cache.misses)
+            self._object_cache.evict()
+
+    def build_extension(self, ext):
+        if not self._is_supported(ext):
+            super().build_extension(ext)
+            return
+        prepared = self._prepare_extension(ext)
+        if prepared is None:
+            return
+        sources, ext_path = prepared
+        self._prepare_precompiled_headers([ext])
+        precompiled_headers = [self._get_precompiled_header(ext, source) for source in sources]
+        for pch in {pch.output_path: pch for pch in precompiled_headers if pch is not None}.values():
+            self._precompile_header(pch)
+        objects = [self._compile_object(ext, source) for source in sources]
+        self._link_extension(ext, sources, objects, ext_path)
+
+    def _check_lto(self, extensions: list):
+        lto_modes = set()
+        for ext in extensions:
+            compile_mode = get_lto_mode(ext.extra_compile_args)
+            link_mode = get_lto_mode(ext.extra_link_args)
+            if compile_mode is not None and compile_mode != link_mode:
+                raise DistutilsSetupError(
+                    f"{ext.name} is compiled with {compile_mode} LTO but linked with {link_mode or 'no'} LTO, "
+                    "its extra_compile_args and extra_link_args must use the same -flto option"
+                )
+            lto_modes.add(compile_mode)
+        if lto_modes - {None}:
+            self._use_lto_archiver()
+
+    def _use_lto_archiver(self):
+        # setuptools archives the static libraries with its own compiler when the platform needs stubs
+        for compiler in (self.compiler, getattr(self, "shlib_compiler", None)):
+            if getattr(compiler, "archiver", None) is None:
+                continue
+            archiver = get_lto_archiver(compiler.compiler_so[0])
+            if archiver is None:
+                log.warn("no LTO archiver found for %s, static libraries may miss the symbols of LTO objects", compiler.compiler_so[0])
+                continue
+            compiler.set_executable("archiver", [archiver, *compiler.archiver[1:]])
+
+    def _prepare_precompiled_headers(self, extensions: list):
+        """
+        Compute the precompiled headers of each language of the translation units of the extensions
+        and write their generated headers
+        """
+        extensions = [ext for ext in extensions if getattr(ext, "precompiled_headers", None)]
+        if not extensions or self.dry_run:
+            return
+        if self.compiler.compiler_type != "unix":
+            log.warn("precompiled headers disabled: the %s compiler is not supported", self.compiler.compiler_type)
+            return
+        pch_dir = os.path.join(self.build_temp, "pch")
+        signature = _get_executable_signature(self.compiler.compiler_so)
+        for ext in extensions:
+            languages = set()
+            for source in self._get_sources(ext):
+                if os.path.splitext(source)[1] == CYTHON_EXT:
+                    source = self._get_cython_output(ext, source)
+                languages.add(self.compiler.detect_language([source]))
+            self._precompiled_headers[ext.name] = {}
+            for language in sorted(languages & PCH_LANGUAGES.keys()):
+                # The command compiling any translation unit of this language, which the precompiled header must match
+                source = "precompiled" + (C_EXT if language == "c" else CPP_EXT)
+                with self._capture_commands() as commands:
+                    (object_path,) = self.compiler.compile([source], **self._get_compile_kwargs(ext))
+                pch = get_precompiled_header(
+                    ext.precompiled_headers, commands[-1], source, object_path, language, pch_dir, signature
+                )
+                write_header(pch)
+                self._precompiled_headers[ext.name][language] = pch
+
+    def _get_precompiled_header(self, ext, source: str) -> PrecompiledHeader | None:
+        return self._precompiled_headers.get(ext.name, {}).get(self.compiler.detect_language([source]))
+
+    def _precompile_header(self, pch: PrecompiledHeader):
+        """
+        Precompile a header if it is outdated, the translation units parse its headers if it fails
+        """
+        dependencies = read_depfile(get_depfile_path(pch.output_path))
+        if not (self.force or dependencies is None or newer_group(dependencies, pch.output_path, "newer")):
+            log.debug("skipping precompiled header %s (up-to-date)", pch.header_path)
+            return
+        with get_tracer().span("precompile", pch.header_path):
+            try:
+                self.compiler.spawn(pch.command)
+            except DistutilsExecError as e:
+                # An outdated precompiled header would still be loaded
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(pch.output_path)
+                log.warn("can not precompile %s, its headers are parsed by each translation unit: %s", pch.header_path, e)
+
+    def _get_jobs(self, makeflags: str | None) -> int:
+        if self.parallel is True:
+            return os.cpu_count() or 1
+        if self.parallel:
+            return self.parallel
+        return get_jobs(get_makeflags_jobs(makeflags))
+
+    def _build_extensions_pooled(self, extensions: list, jobs: int, jobserver: JobServer | None, memory_budget: MemoryBudget):
+        # The build_extension of setuptools is not thread-safe: it swaps self.compiler to build the libraries and
+        # cythonizes the .pyx sources, so these extensions are built serially before the pool starts
+        for ext in extensions:
+            if not self._is_supported(ext):
+                with self._filter_build_errors(ext):
+                    super().build_extension(ext)
+        extensions = [ext for ext in extensions if self._is_supported(ext)]
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # future -> (extension, callback called with the result of the future)
+            futures = {}
+            failed = set()
+            # output path of a precompiled header -> the compilations waiting for it, None once it is precompiled
+            pch_waiters = {}
+
+            def submit(ext, on_done, key, function, *args):
+                future = executor.submit(self._run_job, jobserver, memory_budget, key, function, *args)
+                futures[future] = (ext, on_done)
+
+            def on_precompiled(pch: PrecompiledHeader):
+                waiters, pch_waiters[pch.output_path] = pch_waiters[pch.output_path], None
+                for submit_compilation in waiters:
+                    submit_compilation()
+
+            def submit_after_precompiled_header(pch: PrecompiledHeader | None, submit_compilation):
+                if pch is None or pch_waiters.get(pch.output_path, []) is None:
+                    submit_compilation()
+                    return
+                if pch.output_path not in pch_waiters:
+                    pch_waiters[pch.output_path] = []
+                    # Shared by extensions, it does not fail any of them
+                    submit(None, lambda _, pch=pch: on_precompiled(pch), f"pch:{pch.output_path}", self._precompile_header, pch)
+                pch_waiters[pch.output_path].append(submit_compilation)
+
+            def submit_compilations(ext, sources: list[str], ext_path: str):
+                objects = [None] * len(sources)
+
+                def on_compiled(index: int, object_path: str):
+                    objects[index] = object_path
+                    if all(objects):
+                        submit(ext, None, f"link:{ext.name}", self._link_extension, ext, sources, objects, ext_path)
+
+                if not sources:
+                    submit(ext, None, f"link:{ext.name}", self._link_extension, ext, sources, objects, ext_path)
+                for index, source in enumerate(sources):
+                    submit_after_precompiled_header(
+                        self._get_precompiled_header(ext, source),
+                        lambda index=index, source=source: submit(
+                            ext, lambda object_path: on_compiled(index, object_path),
+                            os.path.abspath(source), self._compile_object, ext, source
+                        ),
+                    )
+
+            for ext in extensions:
+                prepared = self._prepare_extension(ext)
+                if prepared is not None:
+                    submit_compilations(ext, *prepared)
+
+            try:
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        ext, on_done = futures.pop(future)
+                        if ext is not None and ext.name in failed:
+                            continue
+                        succeeded = False
+                        # Errors of optional extensions are only reported as warnings
+                        with contextlib.nullcontext() if ext is None else self._filter_build_errors(ext):
+                            result = future.result()
+                            succeeded = True
+                        if not succeeded:
+                            failed.add(ext.name)
+                        elif on_done is not None:
+                            on_done(result)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def _use_ninja(self) -> bool:
+        if not self.ninja or self.dry_run:
+            return False
+        if find_ninja() is None:
+            log.warn("ninja backend disabled: the ninja executable is not found")
+            return False
+        if self.compiler.compiler_type != "unix":
+            log.warn("ninja backend disabled: the %s compiler is not supported", self.compiler.compiler_type)
+            return False
+        return True
+
+    def _is_ninja_supported(self, ext) -> bool:
+        # The errors of optional extensions are only warnings, which a ninja build can not report per extension
+        ext._convert_pyx_sources_to_lang()
+        return not isinstance(ext, Library) and not getattr(ext, "_needs_stub", False) and not ext.optional
+
+    def _build_extensions_with_ninja(self, extensions: list, jobs: int):
+        if not extensions:
+            return
+        edges = []
+        for ext in extensions:
+            edges += self._get_ninja_edges(ext)
+        # The extensions sharing a precompiled header have the same edge precompiling it
+        edges = list({tuple(edge.outputs): edge for edge in edges}.values())
+        self.mkpath(self.build_temp)
+        if self.force:
+            # Ninja rebuilds the outputs whose command is not in its log
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.build_temp, ".ninja_log"))
+        ninja_path = os.path.join(self.build_temp, NINJA_FILE_NAME)
+        write_ninja_file(ninja_path, self.build_temp, edges)
+        with get_tracer().span("ninja", ninja_path):
+            self.spawn([find_ninja(), "-f", ninja_path, "-j", str(jobs)])
+
+    def _get_ninja_edges(self, ext) -> list[NinjaEdge]:
+        """
+        Returns:
+            The edges cythonizing, compiling and linking an extension,
+            with the commands the compiler would run to build it
+        """
+        edges = []
+        sources = []
+        pyx_sources = [source for source in self._get_sources(ext) if os.path.splitext(source)[1] == CYTHON_EXT]
+        for source in self._get_sources(ext):
+            if source in pyx_sources:
+                output = self._get_cython_output(ext, source)
+                command = self._get_cython_command(ext, source, output, len(pyx_sources) == 1)
+                edges.append(NinjaEdge("cython", [output], [source], [], command))
+                source = output
+            sources.append(source)
+        # The generated files do not exist yet, they are identified by their path
+        sources = self._get_unity_sources(ext, sources, [self._get_cython_output(ext, source) for source in pyx_sources])
+        ext_path = self.get_ext_fullpath(ext.name)
+
+        objects = []
+        for source in sources:
+            pch = self._get_precompiled_header(ext, source)
+            with self._capture_commands() as commands:
+                objects += self.compiler.compile([source], **self._get_compile_kwargs(ext, pch))
+            if len(commands) != 1:
+                raise DistutilsSetupError(f"can not build the extension '{ext.name}' with ninja: unexpected compiler commands")
+            depends = ext.depends
+            if pch is not None:
+                edges.append(NinjaEdge("cc", [pch.output_path], [pch.header_path], [], pch.command))
+                depends = [*depends, pch.output_path]
+            edges.append(NinjaEdge("cc", [objects[-1]], [source], depends, [*commands[0], "-MMD", "-MF", objects[-1] + ".d"]))
+
+        with self._capture_commands() as commands:
+            self._link(ext, sources, objects, ext_path)
+        edges.append(NinjaEdge("link", [ext_path], objects + (ext.extra_objects or []), ext.depends, commands[-1]))
+        return edges
+
+    def _get_cython_output(self, ext, source: str) -> str:
+        cplus = ext.language == "c++" or getattr(self, "cython_cplus", False) or getattr(ext, "cython_cplus", False)
+        return os.path.splitext(source)[0] + (CPP_EXT if cplus else C_EXT)
+
+    def _get_cython_command(self, ext, source: str, output: str, single_pyx: bool) -> list[str]:
+        # Same include path and directives as Cython's build_ext
+        command = [sys.executable, "-m", "cython", "--depfile", "-o", output]
+        if os.path.splitext(output)[1] == CPP_EXT:
+            command.append("--cplus")
+        include_dirs = [
+            *getattr(self, "cython_include_dirs", []),
+            *getattr(ext, "cython_include_dirs", []),
+            *ext.include_dirs,
+            *self.include_dirs,
+        ]
+        for include_dir in dict.fromkeys(include_dirs):
+            command += ["-I", include_dir]
+        directives = {**getattr(self, "cython_directives", {}), **getattr(ext, "cython_directives", {})}
+        for name, value in directives.items():
+            command += ["-X", f"{name}={value}"]
+        if single_pyx:
+            # Else the module name is deduced from the packages of the .pyx, like cythonize does
+            command += ["--module-name", ext.name]
+        return [*command, source]
+
+    @contextlib.contextmanager
+    def _capture_commands(self):
+        # Record the commands the compiler would spawn instead of running them
+        commands = []
+        force = self.compiler.force
+        self.compiler.spawn = lambda cmd, **kwargs: commands.append(list(cmd))
+        self.compiler.force = True
+        try:
+            yield commands
+        finally:
+            self.compiler.__dict__.pop("spawn", None)
+            self.compiler.force = force
+
+    def _run_job(self, jobserver: JobServer | None, memory_budget: MemoryBudget, key: str, function, *args):
+        with memory_budget.reserve(key), contextlib.nullcontext() if jobserver is None else jobserver.slot():
+            self._job_memory.peak = 0
+            result = function(*args)
+            if self._job_memory.peak:
+                memory_budget.record(key, self._job_memory.peak)
+            return result
+
+    def _spawn_and_measure(self, cmd: list[str], **kwargs):
+        # Same as distutils' spawn, but the peak memory of the commands of the current job is recorded
+        if self.compiler.dry_run:
+            return type(self.compiler).spawn(self.compiler, cmd, **kwargs)
+        cmd = list(cmd)
+        log.info(subprocess.list2cmdline(cmd))
+        cmd[0] = shutil.which(cmd[0]) or cmd[0]
+        env = kwargs.get("env") or dict(os.environ)
+        if sys.platform == "darwin":
+            from setuptools._distutils.util import MACOSX_VERSION_VAR, get_macosx_target_ver
+
+            macosx_target_ver = get_macosx_target_ver()
+            if macosx_target_ver:
+                env[MACOSX_VERSION_VAR] = macosx_target_ver
+        try:
+            exit_code, peak_memory = spawn_and_measure(cmd, env)
+        except OSError as e:
+            raise DistutilsExecError(f"command {cmd[0]!r} failed: {e.args[-1]}") from e
+        self._job_memory.peak = max(getattr(self._job_memory, "peak", 0), peak_memory)
+        if exit_code:
+            raise DistutilsExecError(f"command {cmd[0]!r} failed with exit code {exit_code}")
+
+    def _prepare_extension(self, ext) -> tuple[list[str], str] | None:
+        """
+        Returns:
+            The sources and the path of the extension or None if it is up-to-date
+        """
+        sources = self._get_sources(ext)
+        ext_path = self.get_ext_fullpath(ext.name)
+        if not (self.force or newer_group(sources + ext.depends, ext_path, "newer")):
+            log.debug("skipping '%s' extension (up-to-date)", ext.name)
+            return None
+        log.info("building '%s' extension", ext.name)
+        return self._get_unity_sources(ext, self.swig_sources(sources, ext)), ext_path
+
+    def _get_unity_sources(self, ext, sources: list[str], cython_outputs: list[str] | None = None) -> list[str]:
+        """
+        Returns:
+            The sources to compile, the batches of a unity build replacing their sources
+        """
+        if not getattr(ext, "unity_build", False) or self.dry_run:
+            return sources
+        return get_unity_sources(
+            sources,
+            os.path.join(self.build_temp, "unity", ext.name),
+            getattr(ext, "unity_batch_size", BUILD_EXT_ATTRIBUTES["unity_batch_size"]),
+            [*getattr(ext, "unity_exclude", []), *map(glob.escape, cython_outputs or [])],
+            self.compiler.language_map,
+        )
+
+    def _is_supported(self, ext) -> bool:
+        # Libraries, stubs and .pyx left for Cython's build_ext keep the default implementation
+        ext._convert_pyx_sources_to_lang()
+        return (
+            not isinstance(ext, Library)
+            and not getattr(ext, "_needs_stub", False)
+            and not any(os.path.splitext(source)[1] == CYTHON_EXT for source in ext.sources)
+        )
+
+    def _get_sources(self, ext) -> list[str]:
+        if ext.sources is None or not isinstance(ext.sources, (list, tuple)):
+            raise DistutilsSetupError(
+                f"in 'ext_modules' option (extension '{ext.name}'), "
+                "'sources' must be present and must be a list of source filenames"
+            )
+        # sort to make the resulting .so file build reproducible
+        return sorted(ext.sources)
+
+    def _get_macros(self, ext) -> list[tuple]:
+        macros = ext.define_macros[:]
+        for undef in ext.undef_macros:
+            macros.append((undef,))
+        return macros
+
+    def _compile_object(self, ext, source: str) -> str:
+        """
+        Compile one translation unit, or restore it from the cache
+
+        Returns:
+            The path of the object file
+        """
+        compile_kwargs = self._get_compile_kwargs(ext, self._get_precompiled_header(ext, source))
+        with get_tracer().span("compile", source, extension=ext.name) as trace_args:
+            if self._object_cache is None:
+                return self.compiler.compile([source], **compile_kwargs)[0]
+            (object_path,) = self.compiler.object_filenames([source], output_dir=self.build_temp)
+            self.mkpath(os.path.dirname(object_path))
+            key = self._get_object_cache_key(source, compile_kwargs)
+            trace_args["cache"] = "hit" if self._object_cache.restore(key, object_path) else "miss"
+            if trace_args["cache"] == "miss":
+                self.compiler.compile([source], **compile_kwargs)
+                self._object_cache.store(key, object_path)
+            return object_path
+
+    def _get_compile_kwargs(self, ext, pch: PrecompiledHeader | None = None) -> dict:
+        extra_postargs = ext.extra_compile_args or []
+        if pch is not None:
+            extra_postargs = [*extra_postargs, *pch.get_include_args()]
+        return {
+            "output_dir": self.build_temp,
+            "macros": self._get_macros(ext),
+            "include_dirs": ext.include_dirs,
+            "debug": self.debug,
+            "extra_postargs": extra_postargs,
+            "depends": ext.depends,
+        }
+
+    def _get_object_cache_key(self, source: str, compile_kwargs: dict) -> str:
+        key = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        self.mkpath(self.build_temp)
+        with tempfile.TemporaryDirectory(dir=self.build_temp) as tmp_dir:
+            preprocessed_path = os.path.join(tmp_dir, "preprocessed" + os.path.splitext(source)[1])
+            self.compiler.preprocess(
+                source,
+                output_file=preprocessed_path,
+                macros=compile_kwargs["macros"],
+                include_dirs=compile_kwargs["include_dirs"],
+                extra_postargs=compile_kwargs["extra_postargs"],
+            )
+            key.update(file_digest(preprocessed_path).encode("utf-8"))
+        for argument in (
+            *_get_executable_signature(self.compiler.compiler_so),
+            *self.compiler.compiler_so,
+            *compile_kwargs["extra_postargs"],
+            str(compile_kwargs["debug"]),
+            os.path.splitext(source)[1],
+        ):
+            key.update(argument.encode("utf-8") + b"\0")
+        return key.hexdigest()
+
+    def _link_extension(self, ext, sources: list[str], objects: list[str], ext_path: str):
+        # XXX outdated variable, kept by distutils in case third-part code needs it
+        self._built_objects = objects[:]
+        with get_tracer().span("link", ext.name):
+            self._link(ext, sources, objects, ext_path)
+
+    def _link(self, ext, sources: list[str], objects: list[str], ext_path: str):
+        if ext.extra_objects:
+            objects = objects + ext.extra_objects
+        self.compiler.link_shared_object(
+            objects,
+            ext_path,
+            libraries=self.get_libraries(ext),
+            library_dirs=ext.library_dirs,
+            runtime_library_dirs=ext.runtime_library_dirs,
+            extra_postargs=ext.extra_link_args or [],
+            export_symbols=self.get_export_symbols(ext),
+            debug=self.debug,
+            build_temp=self.build_temp,
+            target_lang=ext.language or self.compiler.detect_language(sources),
+        )
+
+
+def _get_executable_signature(command: list[str]) -> list[str]:
+    # Identify the compiler version without spawning it
+    executable = shutil.which(command[0]) if command else None
+    if executable is None:
+        return []
+    stat = os.stat(executable)
+    return [os.path.realpath(executable), str(stat.st_size), str(stat.st_mtime_ns)]
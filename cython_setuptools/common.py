@@ -1,12 +1,59 @@
-# FIXME
-# distutils is deprecated starting from python3.10
-# but the migration to setuptools is not completed
-# this import will change in the future
-from setuptools._distutils.ccompiler import get_default_compiler
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import sys
+import sysconfig
+import tempfile
+from typing import Any
 
 CYTHON_EXT = ".pyx"
 C_EXT = ".c"
 CPP_EXT = ".cpp"
+DIGEST_SIZE = 20
+# Files modified less than this many nanoseconds ago can not be trusted to be unchanged when their mtime is unchanged:
+# a second modification could happen without changing their mtime (eg: 2s on FAT)
+RACY_MTIME_DELAY_NS = 2_000_000_000
+PROFILES = ("release", "native", "size", "debug")
+# The profiles using link-time optimization when the ``lto`` option is not set
+_LTO_PROFILES = ("release", "native")
+LTO_MODES = ("full", "thin")
+# The default maximum number of sources batched in a translation unit of a unity build
+DEFAULT_UNITY_BATCH_SIZE = 8
+# The options of the extensions that setuptools does not know, set as attributes of the extensions
+# for the build_ext of cython_setuptools, with their default value
+BUILD_EXT_ATTRIBUTES = {
+    "precompiled_headers": [],
+    "unity_build": False,
+    "unity_batch_size": DEFAULT_UNITY_BATCH_SIZE,
+    "unity_exclude": [],
+}
+
+# Compile and link flags of each profile, by compiler family, without the flags of link-time optimization
+_PROFILE_FLAGS = {
+    "msvc": {
+        "release": (["/O2"], []),
+        "native": (["/O2"], []),  # msvc can not target the host CPU
+        "size": (["/O1", "/Gy", "/Gw"], ["/OPT:REF", "/OPT:ICF"]),
+        "debug": (["/Od", "/Zi"], ["/DEBUG"]),
+    },
+    "gcc": {
+        "release": (["-O3"], ["-O3"]),
+        "native": (["-O3", "-march=native"], ["-O3", "-march=native"]),
+        "size": (["-Os", "-ffunction-sections", "-fdata-sections"], ["-Os", "-Wl,--gc-sections"]),
+        "debug": (["-O0", "-g"], ["-g"]),
+    },
+}
+# The sections are garbage collected by a different option of the macOS linker
+_PROFILE_FLAGS["clang"] = {
+    **_PROFILE_FLAGS["gcc"],
+    "size": (
+        ["-Os", "-ffunction-sections", "-fdata-sections"],
+        ["-Os", "-Wl,-dead_strip" if sys.platform == "darwin" else "-Wl,--gc-sections"],
+    ),
+}
 
 
 def get_cpp_std_flag(version: int | str) -> str:
@@ -19,9 +66,124 @@ def get_cpp_std_flag(version: int | str) -> str:
     Returns:
         The compiler flag
     """
+    # FIXME
+    # distutils is deprecated starting from python3.10
+    # but the migration to setuptools is not completed
+    # this import will change in the future
+    # Imported here since it is slow and not needed when the extensions are restored from the stamp
+    from setuptools._distutils.ccompiler import get_default_compiler
+
     return f"/std:c++{version}" if get_default_compiler() == "msvc" else f"-std=c++{version}"
 
 
+def get_compiler_family() -> str:
+    """
+    Get the family of the default compiler, from the ``CC`` env variable or the compiler used to build Python
+
+    Returns:
+        "msvc", "clang" or "gcc" (any other Unix compiler is assumed to accept the options of gcc)
+    """
+    from setuptools._distutils.ccompiler import get_default_compiler
+
+    if get_default_compiler() == "msvc":
+        return "msvc"
+    compiler = os.environ.get("CC") or sysconfig.get_config_var("CC") or ""
+    executable = os.path.basename(compiler.split()[0]) if compiler.strip() else ""
+    if "clang" in executable or (sys.platform == "darwin" and executable in ("cc", "c++")):
+        return "clang"
+    return "gcc"
+
+
+def get_profile_flags(profile: str | None, lto: bool | str | None = None) -> tuple[list[str], list[str]]:
+    """
+    Get the flags of an optimization profile and of link-time optimization for the default compiler
+
+    Args:
+        profile: "release" (optimized with LTO), "native" (release for the CPU of the host), "size" (optimized for size,
+                 unused sections removed), "debug" (unoptimized with debug symbols) or None for no profile
+        lto: link-time optimization (see ``parse_lto``), None to use it with the "release" and "native" profiles
+
+    Returns:
+        The compile flags and the link flags
+    """
+    if profile is not None and profile not in PROFILES:
+        raise ValueError(f"Unknown profile {profile!r}, expected one of {', '.join(PROFILES)}")
+    family = get_compiler_family()
+    compile_flags, link_flags = _PROFILE_FLAGS[family][profile] if profile else ([], [])
+    lto_mode = parse_lto(lto) if lto is not None else ("full" if profile in _LTO_PROFILES else None)
+    lto_compile_flags, lto_link_flags = _get_lto_flags(lto_mode, family)
+    return [*compile_flags, *lto_compile_flags], [*link_flags, *lto_link_flags]
+
+
+def parse_lto(value: bool | str) -> str | None:
+    """
+    Args:
+        value: a boolean (or its string representation), "full" or "thin"
+
+    Returns:
+        The mode of link-time optimization: "full", "thin" or None if it is disabled
+    """
+    if isinstance(value, str) and value.lower() in LTO_MODES:
+        return value.lower()
+    try:
+        return "full" if convert_to_bool(value) else None
+    except ValueError:
+        raise ValueError(f"Invalid lto {value!r}, expected a boolean or one of {', '.join(LTO_MODES)}") from None
+
+
+def _get_lto_flags(lto_mode: str | None, family: str) -> tuple[list[str], list[str]]:
+    # The same mode must be used to compile and to link, else the objects of the IR of the compiler can not be linked
+    if lto_mode is None:
+        return [], []
+    if family == "msvc":
+        return ["/GL"], ["/LTCG"]
+    if family == "clang":
+        flag = "-flto=thin" if lto_mode == "thin" else "-flto"
+        # The GNU linker can only read the IR of LLVM with a plugin, which is often not installed: use lld if available
+        use_lld = sys.platform not in ("darwin", "win32") and shutil.which("ld.lld") is not None
+        return [flag], ([flag, "-fuse-ld=lld"] if use_lld else [flag])
+    # gcc has no ThinLTO, its partitioned LTO is parallelized over the available jobs at link time.
+    # The linker plugin also optimizes the LTO objects of the static libraries, eg: resolved by pkg-config
+    return ["-flto"], ["-flto=auto", "-fuse-linker-plugin"]
+
+
+def get_lto_mode(args: list[str]) -> str | None:
+    """
+    Args:
+        args: compile or link arguments of gcc or clang
+
+    Returns:
+        The mode of link-time optimization set by the last ``-flto`` argument: "full", "thin" or None
+    """
+    mode = None
+    for arg in args:
+        if arg == "-fno-lto":
+            mode = None
+        elif arg == "-flto=thin":
+            mode = "thin"
+        elif arg == "-flto" or arg.startswith("-flto="):  # eg: -flto=auto, -flto=8 or -flto=full
+            mode = "full"
+    return mode
+
+
+def get_lto_archiver(compiler: str) -> str | None:
+    """
+    Get the archiver able to index the symbols of LTO objects, needed to link the static libraries built from them
+
+    Args:
+        compiler: the compiler executable, eg: "gcc", "x86_64-linux-gnu-gcc-12" or "clang-17"
+
+    Returns:
+        The path of the archiver, eg: "gcc-ar-12" or "llvm-ar-17", None if it is not installed
+    """
+    match = re.fullmatch(r"(.*?)(gcc|cc|clang)(-[\d.]+)?", os.path.basename(compiler))
+    if match is None:
+        return None
+    prefix, name, version = match.groups(default="")
+    archiver = f"{prefix}gcc-ar{version}" if name in ("gcc", "cc") else f"llvm-ar{version}"
+    return shutil.which(archiver)
+
+
 def convert_to_bool(value: str | bool) -> bool:
     if isinstance(value, bool):
         return value
@@ -31,3 +193,96 @@ def convert_to_bool(value: str | bool) -> bool:
     elif value in ("0", "off", "false", "no"):
         return False
     raise ValueError(f"invalid boolean string {value}")
+
+
+def get_jobs(jobs: int | None = None) -> int:
+    """
+    Get the number of parallel jobs to use
+
+    Args:
+        jobs: the configured number of jobs, ``None`` means ``os.cpu_count()``
+              It is overrided by the env variable ``CYTHON_SETUPTOOLS_JOBS``
+
+    Returns:
+        The number of jobs (at least 1)
+    """
+    jobs_env = os.environ.get("CYTHON_SETUPTOOLS_JOBS", None)
+    if jobs_env is not None:
+        jobs = int(jobs_env)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    return max(jobs, 1)
+
+
+def parse_size(value: str | int) -> int:
+    """
+    Convert a size like ``"512M"`` or ``"2G"`` into a number of bytes
+
+    Args:
+        value: an integer number of bytes or a string with an optional K, M, G or T suffix (powers of 1024)
+
+    Returns:
+        The number of bytes
+    """
+    if isinstance(value, int):
+        return value
+    value = value.strip().upper().removesuffix("B")
+    units = "KMGT"
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * 1024 ** (units.index(value[-1]) + 1))
+    return int(value)
+
+
+def read_json(path: os.PathLike, default: Any = None) -> Any:
+    """
+    Read a JSON state file
+
+    Args:
+        path: path of the file
+        default: value returned if the file does not exist or is corrupted
+
+    Returns:
+        The decoded content of the file
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path: os.PathLike, content: Any):
+    """
+    Atomically write a JSON state file, so that concurrent builds never read a partially written file
+
+    Args:
+        path: path of the file, its parent directories are created if needed
+        content: the value to encode
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(content, f, sort_keys=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def file_digest(filename: os.PathLike) -> str:
+    """
+    Hash the content of a file
+
+    Args:
+        filename: path of the file
+
+    Returns:
+        An hexadecimal digest
+    """
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:  # Empty files can not be mapped
+            return hashlib.blake2b(digest_size=DIGEST_SIZE).hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            return hashlib.blake2b(content, digest_size=DIGEST_SIZE).hexdigest()
@@ -0,0 +1,240 @@
+"""
+Run ``Cython.Build.cythonize`` on several extensions using a pool of worker processes
+and an optional cache of the generated files
+"""
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import multiprocessing
+import os
+from pathlib import Path
+import re
+import time
+
+from .cache import FileCache
+from .common import BUILD_EXT_ATTRIBUTES, DIGEST_SIZE, get_jobs
+from .fingerprint import GeneratedFile, get_include_path
+from .trace import get_tracer
+
+# The first version of Cython able to share its utility code between the modules
+SHARED_UTILITY_CYTHON_VERSION = (3, 1)
+# The first version of Cython whose generated code compiles against the limited API
+LIMITED_API_CYTHON_VERSION = (3, 1)
+
+
+class CythonizeError(Exception):
+    """
+    Raised when at least one extension failed to be cythonized
+
+    Attributes:
+        failures: A dict where the key is the name of the extension and the value is the error message
+    """
+
+    def __init__(self, failures: dict[str, str]):
+        self.failures = failures
+        details = "\n".join(f"  {name}: {message}" for name, message in failures.items())
+        super().__init__(f"Failed to cythonize {len(failures)} extension(s):\n{details}")
+
+
+def cythonize_extensions(
+    extensions: list,
+    jobs: int | None = None,
+    cache: FileCache | None = None,
+    generated_files: dict[str, list[GeneratedFile]] | None = None,
+    **cythonize_kwargs,
+) -> list:
+    """
+    Call ``Cython.Build.cythonize`` on each extension, in parallel if more than 1 job is used
+
+    Contrary to ``Cython.Build.cythonize(nthreads=...)`` an error does not abort the other extensions:
+    all the errors are collected and reported at the end.
+    Note that on platforms that can not fork (eg: Windows) the ``setup.py`` must be protected by
+    a ``if __name__ == "__main__":`` guard to use more than 1 job.
+
+    Args:
+        extensions: list of Extension objects with .pyx sources
+        jobs: number of worker processes (see ``get_jobs``)
+        cache:
+            If set, the generated files are restored from this cache instead of calling Cython,
+            and the newly generated files are stored in it
+        generated_files: The fingerprints of the .pyx of each extension, required when a cache is used
+        cythonize_kwargs: extra arguments forwarded to ``Cython.Build.cythonize``
+
+    Returns:
+        The cythonized extensions, in the same order than ``extensions``
+
+    Raises:
+        CythonizeError: if at least one extension failed to be cythonized
+    """
+    tracer = get_tracer()
+    to_cythonize = extensions
+    if cache is not None:
+        to_cythonize = []
+        for extension in extensions:
+            with tracer.span("cythonize", extension.name) as args:
+                args["cache"] = "hit" if _restore_from_cache(cache, extension, generated_files[extension.name]) else "miss"
+            if args["cache"] == "miss":
+                to_cythonize.append(extension)
+    results = {extension.name: extension for extension in extensions}
+    failures = {}
+    jobs = min(get_jobs(jobs), len(to_cythonize))
+    if jobs <= 1:
+        for extension in to_cythonize:
+            with tracer.span("cythonize", extension.name):
+                _store_result(extension.name, lambda: _cythonize_one(extension, cythonize_kwargs), results, failures)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=_get_mp_context()) as executor:
+            futures = {
+                extension.name: executor.submit(_cythonize_one_timed, extension, cythonize_kwargs)
+                for extension in to_cythonize
+            }
+            for name, future in futures.items():
+                _store_result(name, lambda: _trace_timed_result(name, future.result()), results, failures)
+    if cache is not None:
+        for extension in to_cythonize:
+            if extension.name not in failures:
+                _store_in_cache(cache, extension, generated_files[extension.name])
+        cache.evict()
+    if failures:
+        raise CythonizeError(failures)
+    return [results[extension.name] for extension in extensions]
+
+
+def check_shared_utility_support():
+    """
+    Raises:
+        RuntimeError: if the installed Cython can not generate a shared utility module
+    """
+    check_cython_version(
+        SHARED_UTILITY_CYTHON_VERSION, "a shared utility module", "shared_utility_module from [tool.cython_setuptools]"
+    )
+
+
+def check_cython_version(required: tuple[int, int], feature: str, option: str):
+    """
+    Args:
+        required: the first version of Cython supporting the feature
+        feature: the feature, for the error message
+        option: the option enabling the feature, for the error message
+
+    Raises:
+        RuntimeError: if the installed Cython is older than ``required``
+    """
+    import Cython
+
+    match = re.match(r"(\d+)\.(\d+)", Cython.__version__)
+    if match is None or tuple(map(int, match.groups())) < required:
+        raise RuntimeError(
+            f"{feature} requires Cython >= {'.'.join(map(str, required))}, Cython {Cython.__version__} is installed: "
+            f"upgrade Cython or remove {option}"
+        )
+
+
+def get_shared_utility_path(module_name: str) -> str:
+    """
+    Returns:
+        The path of the C file of a shared utility module, relative to the project, eg: ``pkg/_cyutility.c``
+        for ``pkg._cyutility``
+    """
+    return os.path.join(*module_name.split(".")) + ".c"
+
+
+def generate_shared_utility(module_name: str) -> str:
+    """
+    Generate the C file of a Cython shared utility module, which holds the utility code of the modules
+    cythonized with ``shared_utility_qualified_name=module_name`` instead of each of them
+
+    Args:
+        module_name: fully qualified name of the module
+
+    Returns:
+        The path of the generated file (see ``get_shared_utility_path``)
+
+    Raises:
+        RuntimeError: if the installed Cython can not generate a shared utility module
+    """
+    check_shared_utility_support()
+    import Cython.Build
+    from setuptools.extension import Extension
+
+    path = get_shared_utility_path(module_name)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with get_tracer().span("cythonize", module_name):
+        # cythonize generates the module named like the shared utility module instead of cythonizing it
+        Cython.Build.cythonize(
+            [Extension(module_name, [path])], shared_utility_qualified_name=module_name, force=True, quiet=True
+        )
+    return path
+
+
+def _get_cache_key(extension, generated_file: GeneratedFile) -> str:
+    # The generated code also contains the module name and the path of the .pyx
+    key = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for value in (extension.name, generated_file.source.as_posix(), generated_file.fingerprint):
+        key.update(value.encode("utf-8") + b"\0")
+    return key.hexdigest()
+
+
+def _restore_from_cache(cache: FileCache, extension, generated_files: list[GeneratedFile]) -> bool:
+    for generated_file in generated_files:
+        if not cache.restore(_get_cache_key(extension, generated_file), generated_file.output):
+            return False
+    restored_sources = {generated_file.source: os.fspath(generated_file.output) for generated_file in generated_files}
+    extension.sources = [restored_sources.get(Path(source), source) for source in extension.sources]
+    return True
+
+
+def _store_in_cache(cache: FileCache, extension, generated_files: list[GeneratedFile]):
+    for generated_file in generated_files:
+        cache.store(_get_cache_key(extension, generated_file), generated_file.output)
+
+
+def _cythonize_one(extension, cythonize_kwargs: dict):
+    import Cython.Build
+    import Cython.Build.Dependencies
+    from Cython.Utils import clear_function_caches
+
+    # The dependency tree of cythonize is global and memoizes the options of an extension by its relative sources
+    # and the id of a temporary object, and the options parsed from a .pyx are memoized for the whole process and
+    # extended in place with the ones of the extension: a later extension with the same sources could get the flags
+    # of a previous one. The tree is private to Cython, hence the upper bound of its version (tested by tox).
+    Cython.Build.Dependencies._dep_tree = None
+    clear_function_caches()
+    # cythonize ignores the directives of the extension, they override the ones of the arguments
+    compiler_directives = {**cythonize_kwargs.get("compiler_directives", {}), **getattr(extension, "cython_directives", {})}
+    # Nor does it search the include_dirs of the extension for the .pxd, contrary to Cython's build_ext
+    include_path = get_include_path([*cythonize_kwargs.get("include_path", []), *extension.include_dirs])
+    cythonized = Cython.Build.cythonize(
+        [extension], **{**cythonize_kwargs, "compiler_directives": compiler_directives, "include_path": include_path}
+    )[0]
+    # Nor does it copy the abi3 tag of setuptools and the options of build_ext
+    cythonized.py_limited_api = getattr(extension, "py_limited_api", False)
+    for key, default in BUILD_EXT_ATTRIBUTES.items():
+        setattr(cythonized, key, getattr(extension, key, default))
+    return cythonized
+
+
+def _cythonize_one_timed(extension, cythonize_kwargs: dict) -> tuple:
+    # Run in a worker process: the timing is returned to be traced by the main process
+    start_ns = time.perf_counter_ns()
+    result = _cythonize_one(extension, cythonize_kwargs)
+    return result, start_ns, time.perf_counter_ns(), os.getpid()
+
+
+def _trace_timed_result(name: str, timed_result: tuple):
+    result, start_ns, end_ns, pid = timed_result
+    get_tracer().add_span("cythonize", name, start_ns, end_ns, pid=pid)
+    return result
+
+
+def _store_result(name: str, get_result, results: dict, failures: dict):
+    try:
+        results[name] = get_result()
+    except Exception as e:
+        failures[name] = str(e) or type(e).__name__
+
+
+def _get_mp_context():
+    # Prefer fork to not re-execute the setup.py in the workers
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
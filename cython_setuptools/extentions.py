@@ -1,17 +1,54 @@
-import hashlib
 import os
 from pathlib import Path
-import re
+import sys
+from typing import TYPE_CHECKING
 
-import Cython
-import Cython.Build
-import Cython.Distutils
-# Distutils is deprecated but for the moment this is the only way the default compiler is exposed when using setuptools
-from setuptools._distutils.ccompiler import get_default_compiler
+from .bundle import bundle_extensions, get_stub_path
+from .cache import get_file_cache
+from .cythonize import (
+    LIMITED_API_CYTHON_VERSION,
+    check_cython_version,
+    check_shared_utility_support,
+    cythonize_extensions,
+    generate_shared_utility,
+    get_shared_utility_path,
+)
+from .fingerprint import (
+    HASH_CACHE_NAME,
+    HashCache,
+    create_dependency_tree,
+    fingerprint_generated_files,
+    get_dependencies,
+    get_staleness_reason,
+    iter_cython_sources,
+)
+from .limited_api import LimitedApiError, find_limited_api_violations, get_limited_api_macros
+from .manifest import MANIFEST_NAME, Manifest
+from .ninja import is_ninja_enabled
+from .pkgconfig_wrapper import BuildFlags, get_flags
+from .common import BUILD_EXT_ATTRIBUTES, C_EXT, CPP_EXT, CYTHON_EXT, convert_to_bool, get_cpp_std_flag, get_profile_flags
+from .stamp import get_key, read_stamp, write_stamp
+from .trace import get_tracer
+from ._version import __version__
 
-from .pyproject import CythonSetuptoolsOptions, read_cython_setuptools_option
-from .pkgconfig_wrapper import get_flags
-from .common import C_EXT, CPP_EXT, CYTHON_EXT, convert_to_bool, get_cpp_std_flag
+if TYPE_CHECKING:
+    from .pyproject import CythonSetuptoolsConfig, CythonSetuptoolsOptions
+
+# Records the extensions created when nothing had to be cythonized, and the files they depend on
+EXTENSIONS_STAMP_NAME = ".cython_setuptools_extensions.json"
+# The arguments of the extensions recorded in the stamp
+_EXTENSION_KWARGS = (
+    "sources",
+    "libraries",
+    "include_dirs",
+    "library_dirs",
+    "extra_compile_args",
+    "extra_link_args",
+    "export_symbols",
+    "define_macros",
+    "language",
+    "py_limited_api",
+)
 
 
 def create_extensions(original_setup_file: str, cythonize: bool | None = None) -> list:
@@ -21,6 +58,35 @@ def create_extensions(original_setup_file: str, cythonize: bool | None = None) -
     To force to compile pyx into .c/.cpp set ``CYTHONIZE`` env variable to True or if it is not set use the cythonize of this function
     To get debug symboles ``DEBUG`` env variable (does not work with msvc)
     To enable profiling use ``PROFILE_CYTHON`` env variable
+    To set the number of processes used to cythonize use ``CYTHON_SETUPTOOLS_JOBS`` env variable
+    To set the cache of the generated files use ``CYTHON_SETUPTOOLS_CACHE_DIR`` and ``CYTHON_SETUPTOOLS_CACHE_SIZE`` env variables
+    To trace why and how long each extension is cythonized and compiled use ``CYTHON_SETUPTOOLS_TRACE`` env variable
+    (see ``cython_setuptools.trace``)
+    To build all the extensions with an optimization profile use ``CYTHON_SETUPTOOLS_PROFILE`` env variable
+    To enable or disable link-time optimization of all the extensions use ``CYTHON_SETUPTOOLS_LTO`` env variable
+    To cythonize, compile and link with ninja use ``CYTHON_SETUPTOOLS_NINJA`` env variable and the
+    ``cython_setuptools.build_ext`` command: the outdated extensions are returned with their .pyx, which are
+    cythonized by ninja and are not recorded in the manifest
+
+    Project wide options can be set in the ``[tool.cython_setuptools]`` table of the ``pyproject.toml``:
+    ```
+        [tool.cython_setuptools]
+        # Number of processes used to cythonize the extensions, default to `os.cpu_count()`.
+        jobs = 8
+        # Module generated and built with the extensions, holding the Cython utility code they import instead of
+        # embedding their own copy (requires Cython >= 3.1).
+        shared_utility_module = "lol._cyutility"
+        # Directory of the cache of the generated .c/.cpp, shared between checkouts (disabled by default).
+        cache_dir = "~/.cache/cython_setuptools"
+        # Maximum size of the cache, the least recently used files are removed first.
+        cache_size = "2G"
+
+        [tool.cython_setuptools.pgo]
+        # Command run by `build_ext --pgo` between the instrumented and the optimized builds.
+        training_command = ["python", "-m", "pytest", "benchmarks"]
+        # Directory of the profiles, default to `pgo` in the build temp directory.
+        profile_dir = "pgo_profiles"
+    ```
 
     Example of a what can be added to a ``pyproject.toml`` to have an extension named ``lol``:
     ```
@@ -41,12 +107,38 @@ def create_extensions(original_setup_file: str, cythonize: bool | None = None) -
         language = "c++"
         # Typically "11", "14", "17" or "20".
         cpp_std = 23
+        # Cython compiler directives.
+        cython_directives = { boundscheck = false, wraparound = false, cdivision = true, language_level = 3 }
+        # Optimization profile: "release" (-O3 with LTO), "native" (release for the host CPU),
+        # "size" (-Os, unused sections removed) or "debug" (-O0 -g), with the flags of the compiler.
+        profile = "release"
+        # Link-time optimization across the Cython and the C/C++ sources: true, false or "thin" (ThinLTO of clang,
+        # gcc uses its own parallel LTO), default to true with the "release" and "native" profiles.
+        lto = "thin"
+        # Compile this extension in the shared library of the "lol._native" extension, with the others of the same
+        # bundle, instead of its own file. Importing the bundle (eg: from the __init__.py of the package) registers
+        # an import hook loading its modules from its library.
+        bundle = "lol._native"
         # A list of `pkg-config` package names to link with the module.
         pkg_config_packages = ["super_lib"]
         # A list of directories to add to the pkg-config search paths (extends the `PKG_CONFIG_PATH` environment variable).
         pkg_config_dirs = ["toto/lib/pkgconfig"]
     ```
 
+    Options shared by all the extensions can be set in the ``[cython_defaults]`` table: the lists are extended
+    by the ones of the extensions, the ``cython_directives`` are updated by the ones of the extensions
+    and the other options of the extensions override the defaults:
+    ```
+        [cython_defaults]
+        include_dirs = ["include"]
+        cython_directives = { language_level = 3, boundscheck = false }
+
+        [cython_extensions.lol]
+        sources = ["a.pyx"]
+        # Compiled with language_level=3, boundscheck=False and wraparound=False
+        cython_directives = { wraparound = false }
+    ```
+
     Args:
         original_setup_file:
             Location of the ``setup.py`` calling this file.
@@ -55,79 +147,239 @@ def create_extensions(original_setup_file: str, cythonize: bool | None = None) -
         cythonize:
             If True ``Cython.Build.cythonize`` will always be called
             If False ``Cython.Build.cythonize`` will never be called
-            If None ``Cython.Build.cythonize`` will be called if the generated .c/.cpp file does not match the .pyx
-            Note that even if only 1 file does not match, it will be called for all extensions
+            If None ``Cython.Build.cythonize`` will be called only for the extensions
+            whose generated .c/.cpp files do not match their .pyx, the .pxd/.pxi they cimport or include,
+            the Cython version or the compiler directives
+            The fingerprints of the generated files are stored in ``.cython_setuptools_manifest.json``
+            next to the ``pyproject.toml``, distribute it with the .c/.cpp files
+            When nothing has to be cythonized, the created extensions are recorded in
+            ``.cython_setuptools_extensions.json`` and reused until the ``pyproject.toml``, a .pyx or one of its
+            dependencies, a generated file, the pkg-config flags or the env variables change
             It is overrided by the env variable ``CYTHONIZE``
 
     Returns:
         A list Extentions, It can be safely used for ``ext_modules`` argument of ``setuptools.setup()``
     """
-    extensions_options = read_cython_setuptools_option(Path(original_setup_file).parent / "pyproject.toml")
-    extensions = []
-    cythonize = _compute_cythonize(extensions_options, cythonize)
+    tracer = get_tracer()
+    project_dir = Path(original_setup_file).parent
+    stamp_path = project_dir / EXTENSIONS_STAMP_NAME
+    with tracer.span("config", EXTENSIONS_STAMP_NAME) as args:
+        stamp_key = _get_stamp_key(project_dir, cythonize)
+        extensions = _restore_extensions(stamp_path, stamp_key)
+        args["reused"] = extensions is not None
+    if extensions is not None:
+        return extensions
+
+    with tracer.span("config", "pyproject.toml"):
+        # pyserde is slow to import, only import it when the pyproject.toml has to be parsed
+        from .pyproject import read_pyproject
+
+        extensions_options, config = read_pyproject(project_dir / "pyproject.toml")
+    manifest = Manifest(project_dir / MANIFEST_NAME)
+    hash_cache = HashCache(project_dir / HASH_CACHE_NAME)
+    # The .pyx are replaced by their generated files in the sources of the extensions that are not cythonized
+    sources = {name: list(options.sources) for name, options in extensions_options.items()}
+    extensions = {}
     profile_cython = convert_to_bool(os.environ.get("PROFILE_CYTHON", False))
     debug = convert_to_bool(os.environ.get("DEBUG", False))
+    cython_directives = {name: _get_cython_directives(options, profile_cython) for name, options in extensions_options.items()}
+    shared_utility = config.shared_utility_module
+    to_cythonize = _compute_cythonize(extensions_options, cythonize, cython_directives, manifest, hash_cache, shared_utility)
+    _check_limited_api(project_dir, extensions_options, to_cythonize, manifest)
     for name, options in extensions_options.items():
-        _complete_cython_options(options, debug, cythonize)
-        extensions.append(_create_extension(name, options, profile_cython))
-    if cythonize:
-        cythonized_extensions = Cython.Build.cythonize(extensions, force=True)
-        for options in extensions_options.values():
-            _add_pyx_file_hash_to_generated_files(options)
-        return cythonized_extensions
-    return extensions
+        _complete_cython_options(options, debug, name in to_cythonize)
+        extensions[name] = _create_extension(name, options, cython_directives[name], name in to_cythonize)
+    # The bundled extensions are merged once cythonized, the other ones are left to the ninja backend of build_ext,
+    # which tracks the dependencies of the .pyx with depfiles, unless they share their utility code
+    left_to_ninja = []
+    if is_ninja_enabled() and not shared_utility:
+        left_to_ninja = [name for name in to_cythonize if not extensions_options[name].bundle]
+    cythonized_now = [name for name in to_cythonize if name not in left_to_ninja]
+    cythonize_kwargs = {}
+    generate_shared = False
+    if shared_utility:
+        cythonize_kwargs["shared_utility_qualified_name"] = shared_utility
+        generate_shared = bool(cythonized_now) or not os.path.exists(get_shared_utility_path(shared_utility))
+        if generate_shared:
+            # Before cythonizing extensions importing their utility code from a module that could not be generated
+            check_shared_utility_support()
+    if cythonized_now:
+        # The .pxd are searched in the include_dirs of each extension
+        dependency_trees = {}
+        generated_files = {}
+        for name in cythonized_now:
+            include_dirs = tuple(extensions_options[name].include_dirs)
+            if include_dirs not in dependency_trees:
+                dependency_trees[include_dirs] = create_dependency_tree(list(include_dirs))
+            generated_files[extensions[name].name] = fingerprint_generated_files(
+                extensions_options[name].sources,
+                extensions_options[name].language,
+                cython_directives[name],
+                dependency_trees[include_dirs],
+                hash_cache,
+                shared_utility,
+                extensions_options[name].include_dirs,
+            )
+        cythonized_extensions = cythonize_extensions(
+            [extensions[name] for name in cythonized_now],
+            jobs=config.jobs,
+            cache=get_file_cache(config.cache_dir, config.cache_size),
+            generated_files=generated_files,
+            force=True,
+            **cythonize_kwargs,
+        )
+        for name, cythonized_extension in zip(cythonized_now, cythonized_extensions):
+            extensions[name] = cythonized_extension
+            for generated_file in generated_files[cythonized_extension.name]:
+                manifest.update(
+                    generated_file.source, generated_file.output, generated_file.fingerprint, generated_file.dependencies
+                )
+        manifest.save()
+    bundled_extensions = bundle_extensions(
+        list(extensions.values()), [options.bundle or None for options in extensions_options.values()]
+    )
+    if generate_shared:
+        generate_shared_utility(shared_utility)
+    if shared_utility:
+        from setuptools.extension import Extension
 
+        bundled_extensions.append(Extension(shared_utility, [get_shared_utility_path(shared_utility)]))
+    if not to_cythonize:
+        _save_extensions(stamp_path, stamp_key, project_dir, bundled_extensions, extensions_options, config, sources, manifest)
+    hash_cache.save()
+    return bundled_extensions
 
-def _compute_cythonize(extensions_options: dict[str, CythonSetuptoolsOptions], cythonize_arg: bool | None) -> bool:
-    cythonize_env = os.environ.get("CYTHONIZE", None)
-    if cythonize_env is not None:
-        return convert_to_bool(cythonize_env)
-    if cythonize_arg is not None:
-        return cythonize_arg
-    for options in extensions_options.values():
-        new_ext = CPP_EXT if options.language == "c++" else C_EXT
-        for source in options.sources:
-            source_path = Path(source)
-            if source_path.suffix == CYTHON_EXT:
-                output_path = source_path.with_suffix(new_ext)
-                if not _is_generated_file_up_to_date(source_path, output_path):
-                    return True
-    return False
 
+def _get_stamp_key(project_dir: Path, cythonize_arg: bool | None) -> str:
+    import Cython
+
+    return get_key({
+        "version": __version__,
+        "python": sys.version,
+        "cython": Cython.__version__,
+        "cwd": os.getcwd(),
+        "project_dir": os.fspath(project_dir),
+        "cythonize": cythonize_arg,
+        "env": {
+            name: os.environ.get(name)
+            for name in ("CYTHONIZE", "DEBUG", "PROFILE_CYTHON", "CYTHON_SETUPTOOLS_PROFILE", "CYTHON_SETUPTOOLS_LTO", "CC")
+        },
+    })
 
-def _read_pyx_file_hash_from_generated_files(generated_file_path: Path) -> str:
-    if not generated_file_path.exists():
-        return ""
-    with open(generated_file_path, 'r', encoding='utf8') as f:
-        content = f.read()
-    match = re.search(r'^// input_hash: ([a-fA-F0-9]+)$', content, re.MULTILINE)
-    return match.group(1) if match else ""
 
+def _restore_extensions(stamp_path: Path, stamp_key: str) -> list | None:
+    content = read_stamp(stamp_path, stamp_key)
+    if content is None:
+        return None
+    # pkg-config results are themselves cached until the .pc files change
+    for pkg_config_packages, pkg_config_dirs, compile_flags, link_flags in content["pkg_config"]:
+        if get_flags(pkg_config_packages, pkg_config_dirs) != BuildFlags(compile_flags, link_flags):
+            return None
+    from setuptools.extension import Extension
+
+    extensions = []
+    for name, kwargs in content["extensions"]:
+        # The macros are stored as JSON arrays
+        kwargs["define_macros"] = [tuple(macro) for macro in kwargs.get("define_macros", [])]
+        attributes = {key: kwargs.pop(key, default) for key, default in BUILD_EXT_ATTRIBUTES.items()}
+        extensions.append(Extension(name=name, **kwargs))
+        for key, value in attributes.items():
+            setattr(extensions[-1], key, value)
+    return extensions
 
-def _is_generated_file_up_to_date(pyx_file_path: Path, generated_file_path: Path) -> bool:
-    return _sha256sum(pyx_file_path) == _read_pyx_file_hash_from_generated_files(generated_file_path)
 
+def _save_extensions(
+    stamp_path: Path,
+    stamp_key: str,
+    project_dir: Path,
+    extensions: list,
+    extensions_options: dict[str, "CythonSetuptoolsOptions"],
+    config: "CythonSetuptoolsConfig",
+    sources: dict[str, list[str]],
+    manifest: Manifest,
+):
+    inputs = [os.fspath(project_dir / "pyproject.toml"), os.fspath(manifest.path)]
+    pkg_config = []
+    for name, options in extensions_options.items():
+        for source_path, output_path in iter_cython_sources(sources[name], options.language):
+            inputs += [os.fspath(source_path), os.fspath(output_path), *(manifest.get_dependencies(source_path, output_path) or [])]
+        build_flags = get_flags(options.pkg_config_packages, options.pkg_config_dirs)
+        pkg_config.append([options.pkg_config_packages, options.pkg_config_dirs, build_flags.compile_flags, build_flags.link_flags])
+    inputs += sorted({get_stub_path(options.bundle) for options in extensions_options.values() if options.bundle})
+    if config.shared_utility_module:
+        inputs.append(get_shared_utility_path(config.shared_utility_module))
+    content = {
+        "extensions": [
+            [
+                extension.name,
+                {
+                    **{key: getattr(extension, key) for key in _EXTENSION_KWARGS},
+                    **{key: getattr(extension, key, default) for key, default in BUILD_EXT_ATTRIBUTES.items()},
+                },
+            ]
+            for extension in extensions
+        ],
+        "pkg_config": pkg_config,
+    }
+    write_stamp(stamp_path, stamp_key, inputs, content=content)
 
-def _add_pyx_file_hash_to_generated_files(options: CythonSetuptoolsOptions):
-    new_ext = CPP_EXT if options.language == "c++" else C_EXT
-    for source in options.sources:
-        source_path = Path(source)
-        if source_path.suffix == CYTHON_EXT:
-            output_path = source_path.with_suffix(new_ext)
-            pyx_hash = _sha256sum(source_path)
-            with open(output_path, "a", encoding="utf-8") as f:
-                f.write(f"\n// input_hash: {pyx_hash}\n")
 
+def _compute_cythonize(
+    extensions_options: dict[str, "CythonSetuptoolsOptions"],
+    cythonize_arg: bool | None,
+    cython_directives: dict[str, dict],
+    manifest: Manifest,
+    hash_cache: HashCache,
+    shared_utility: str | None,
+) -> list[str]:
+    """
+    Args:
+        cython_directives: the compiler directives of each extension
+        shared_utility: the shared utility module of the extensions
 
-def _sha256sum(filename: Path) -> str:
-    with open(filename, "rb") as f:
-        file_hash = hashlib.md5()
-        while chunk := f.read(8192):
-            file_hash.update(chunk)
-        return file_hash.hexdigest()
+    Returns:
+        The names of the extensions that have to be cythonized
+    """
+    tracer = get_tracer()
+    forced_by = "the cythonize argument"
+    cythonize_env = os.environ.get("CYTHONIZE", None)
+    if cythonize_env is not None:
+        cythonize_arg = convert_to_bool(cythonize_env)
+        forced_by = "CYTHONIZE"
+    if cythonize_arg is not None:
+        reason = f"forced by {forced_by}" if cythonize_arg else f"disabled by {forced_by}"
+        for name in extensions_options:
+            with tracer.span("staleness", name, reason=reason):
+                pass
+        return list(extensions_options) if cythonize_arg else []
+    to_cythonize = []
+    for name, options in extensions_options.items():
+        with tracer.span("staleness", name) as args:
+            args["reason"] = get_staleness_reason(
+                options.sources,
+                options.language,
+                cython_directives[name],
+                manifest,
+                hash_cache,
+                shared_utility,
+                options.include_dirs,
+            )
+        if args["reason"] is not None:
+            to_cythonize.append(name)
+    return to_cythonize
 
 
-def _complete_cython_options(options: CythonSetuptoolsOptions, debug: bool, cythonize: bool):
+def _complete_cython_options(options: "CythonSetuptoolsOptions", debug: bool, cythonize: bool):
+    # Distutils is deprecated but for the moment this is the only way the default compiler is exposed when using
+    # setuptools, imported here since it is slow and not needed when the extensions are restored from the stamp
+    from setuptools._distutils.ccompiler import get_default_compiler
+
+    profile = os.environ.get("CYTHON_SETUPTOOLS_PROFILE") or options.profile
+    lto = os.environ.get("CYTHON_SETUPTOOLS_LTO") or options.lto
+    # Before the flags of the extension, which can override them
+    compile_flags, link_flags = get_profile_flags(profile, lto)
+    options.extra_compile_args = compile_flags + options.extra_compile_args
+    options.extra_link_args = link_flags + options.extra_link_args
     if debug and get_default_compiler() != "msvc":
         options.extra_compile_args.append("-g")
     if options.language == "c++":
@@ -150,7 +402,59 @@ def _complete_cython_options(options: CythonSetuptoolsOptions, debug: bool, cyth
         options.sources = new_sources
 
 
-def _create_extension(name: str, options: CythonSetuptoolsOptions, profile_cython: bool) -> Cython.Distutils.Extension:
-    cython_directives = {"profile": True} if profile_cython else {}
+def _check_limited_api(
+    project_dir: Path, extensions_options: dict[str, "CythonSetuptoolsOptions"], to_cythonize: list[str], manifest: Manifest
+):
+    """
+    Raises:
+        RuntimeError: if an abi3 extension has to be cythonized by a Cython not supporting the limited API
+        LimitedApiError: if the .pyx of an abi3 extension, or the .pxd/.pxi of the project it depends on,
+            use the full API of Python
+    """
+    if any(extensions_options[name].abi3 for name in to_cythonize):
+        check_cython_version(LIMITED_API_CYTHON_VERSION, "building for the limited API", "abi3 from the extensions")
+    project_path = project_dir.resolve()
+    violations = {}
+    for name, options in extensions_options.items():
+        if not options.abi3:
+            continue
+        paths = set()
+        dependency_tree = None
+        for source_path, output_path in iter_cython_sources(options.sources, options.language):
+            dependencies = manifest.get_dependencies(source_path, output_path)
+            if dependencies is None:
+                if dependency_tree is None:
+                    dependency_tree = create_dependency_tree(options.include_dirs)
+                dependencies = get_dependencies(source_path, dependency_tree)
+            # The .pxd of Cython and of the other packages declare the full API
+            paths.update(path for path in dependencies if Path(path).resolve().is_relative_to(project_path))
+        extension_violations = find_limited_api_violations(sorted(paths), options.abi3)
+        if extension_violations:
+            violations[name] = extension_violations
+    if violations:
+        raise LimitedApiError(violations)
+
+
+def _get_cython_directives(options: "CythonSetuptoolsOptions", profile_cython: bool) -> dict:
+    # PROFILE_CYTHON overrides the directives of the pyproject.toml
+    return {**options.cython_directives, "profile": True} if profile_cython else dict(options.cython_directives)
+
+
+def _create_extension(name: str, options: "CythonSetuptoolsOptions", cython_directives: dict, cythonize: bool):
     extension_name = name if options.name is None else options.name
-    return Cython.Distutils.Extension(name=extension_name, cython_directives=cython_directives, **options.to_extension_kwargs())
+    kwargs = options.to_extension_kwargs()
+    if options.abi3:
+        kwargs.update(define_macros=get_limited_api_macros(options.abi3), py_limited_api=True)
+    if not cythonize:
+        # Only the generated .c/.cpp are compiled, Cython is not needed
+        from setuptools.extension import Extension
+
+        extension = Extension(name=extension_name, **kwargs)
+    else:
+        import Cython.Distutils
+
+        extension = Cython.Distutils.Extension(name=extension_name, cython_directives=cython_directives, **kwargs)
+    # Not options of setuptools, read by the build_ext of cython_setuptools
+    for key in BUILD_EXT_ATTRIBUTES:
+        setattr(extension, key, getattr(options, key))
+    return extension
@@ -0,0 +1,291 @@
+"""
+Compute the fingerprint of everything that has an impact on the C/C++ generated by Cython from a .pyx
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+import sysconfig
+import time
+from typing import TYPE_CHECKING, NamedTuple
+
+import Cython
+
+from .common import C_EXT, CPP_EXT, CYTHON_EXT, DIGEST_SIZE, RACY_MTIME_DELAY_NS, file_digest, read_json, write_json
+
+if TYPE_CHECKING:
+    from Cython.Build.Dependencies import DependencyTree
+
+    from .manifest import Manifest
+
+HASH_CACHE_NAME = ".cython_setuptools_hashes.json"
+
+
+class GeneratedFile(NamedTuple):
+    """
+    A .c/.cpp file generated by Cython
+
+    Attributes:
+        source: the .pyx
+        output: the generated .c/.cpp
+        fingerprint: the fingerprint of the .pyx (see ``compute_fingerprint``)
+        dependencies: the dependencies of the .pyx (see ``get_dependencies``)
+    """
+    source: Path
+    output: Path
+    fingerprint: str
+    dependencies: list[str]
+
+
+def iter_cython_sources(sources: list[str], language: str | None):
+    """
+    Iterate over the .pyx of an extension
+
+    Args:
+        sources: the sources of the extension
+        language: the language of the extension, "c++" or anything else for C
+
+    Yields:
+        Tuples with the path of the .pyx and the path of the .c/.cpp generated from it
+    """
+    new_ext = CPP_EXT if language == "c++" else C_EXT
+    for source in sources:
+        source_path = Path(source)
+        if source_path.suffix == CYTHON_EXT:
+            yield source_path, source_path.with_suffix(new_ext)
+
+
+def fingerprint_generated_files(
+    sources: list[str],
+    language: str | None,
+    compiler_directives: dict,
+    dependency_tree: "DependencyTree",
+    hash_cache: "HashCache | None" = None,
+    shared_utility: str | None = None,
+    include_dirs: list[str] | None = None,
+) -> list[GeneratedFile]:
+    """
+    Compute the fingerprint of every .pyx of an extension
+
+    Args:
+        sources: the sources of the extension
+        language: the language of the extension
+        compiler_directives: the Cython compiler directives of the extension
+        dependency_tree: the tree returned by ``create_dependency_tree``
+        hash_cache: cache used to not hash again the unchanged dependencies
+        shared_utility: the shared utility module the generated code imports its utility code from
+        include_dirs: the ``include_dirs`` of the extension
+
+    Returns:
+        A GeneratedFile for each .pyx
+    """
+    generated_files = []
+    for source_path, output_path in iter_cython_sources(sources, language):
+        dependencies = get_dependencies(source_path, dependency_tree)
+        fingerprint = compute_fingerprint(
+            source_path, dependencies, compiler_directives, language, hash_cache, shared_utility, include_dirs
+        )
+        generated_files.append(GeneratedFile(source_path, output_path, fingerprint, dependencies))
+    return generated_files
+
+
+def get_include_path(include_dirs: list[str]) -> list[str]:
+    """
+    Returns:
+        The directories searched for the .pxd/.pxi of an extension: the current directory like ``Cython.Build.cythonize``
+        and the ``include_dirs`` of the extension like Cython's ``build_ext``
+    """
+    return list(dict.fromkeys([".", *include_dirs]))
+
+
+def create_dependency_tree(include_dirs: list[str] | None = None) -> "DependencyTree":
+    """
+    Create a fresh Cython dependency tree, used to walk the cimport/include graph of the .pyx files
+
+    Args:
+        include_dirs: the ``include_dirs`` of the extensions whose .pyx are walked (see ``get_include_path``)
+
+    Returns:
+        A ``Cython.Build.Dependencies.DependencyTree`` resolving paths like ``Cython.Build.cythonize`` does
+    """
+    # The Cython compiler is only imported when a .pyx has to be parsed
+    from Cython.Build.Dependencies import DependencyTree
+    from Cython.Compiler.Main import Context
+    from Cython.Compiler.Options import CompilationOptions, default_options, get_directive_defaults
+    from Cython.Utils import clear_function_caches
+
+    # Cython memoizes the parsed dependencies of a file for the whole process
+    clear_function_caches()
+    context = Context(get_include_path(include_dirs or []), get_directive_defaults(), options=CompilationOptions(default_options))
+    return DependencyTree(context, quiet=True)
+
+
+def get_dependencies(pyx_path: os.PathLike, dependency_tree: "DependencyTree") -> list[str]:
+    """
+    Get all the files Cython reads to generate the C/C++ of a .pyx
+
+    Args:
+        pyx_path: path of the .pyx
+        dependency_tree: the tree returned by ``create_dependency_tree``
+
+    Returns:
+        The sorted list of the .pyx itself and of the .pxd/.pxi it transitively cimports or includes
+    """
+    return sorted(dependency_tree.all_dependencies(os.fspath(pyx_path)))
+
+
+class HashCache:
+    """
+    Persistent cache of file digests keyed on the path, the size, the mtime and the inode of the files,
+    so that unchanged files are never hashed again. Only the files looked up by the last run are kept.
+    """
+
+    def __init__(self, path: os.PathLike):
+        self.path = path
+        self._entries = read_json(path, {})
+        self._used = set()
+        self._modified = False
+
+    def digest(self, filename: os.PathLike) -> str:
+        """
+        Same as ``file_digest`` but only hash ``filename`` if it changed since the last call
+        """
+        key = os.path.abspath(filename)
+        self._used.add(key)
+        stat = os.stat(key)
+        signature = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        entry = self._entries.get(key)
+        if entry is not None and entry[:3] == signature:
+            return entry[3]
+        digest = file_digest(key)
+        if time.time_ns() - stat.st_mtime_ns > RACY_MTIME_DELAY_NS:
+            self._entries[key] = [*signature, digest]
+            self._modified = True
+        return digest
+
+    def save(self):
+        """
+        Write the cache if it has been updated, without the entries not looked up since it was loaded,
+        eg: of removed files or of files that are no longer dependencies
+        """
+        unused = self._entries.keys() - self._used if self._used else set()
+        if self._modified or unused:
+            for key in unused:
+                del self._entries[key]
+            write_json(self.path, self._entries)
+            self._modified = False
+
+
+def compute_fingerprint(
+    pyx_path: os.PathLike,
+    dependencies: list[str],
+    compiler_directives: dict,
+    language: str,
+    hash_cache: HashCache | None = None,
+    shared_utility: str | None = None,
+    include_dirs: list[str] | None = None,
+) -> str:
+    """
+    Compute the fingerprint of a .pyx, if it changes, the generated C/C++ has to be regenerated
+
+    The fingerprint covers the content of the dependencies, the Cython version,
+    the compiler directives, the output language and the shared utility module.
+    The dependencies are identified by their path relative to the directory they are found in
+    (the Includes of Cython, an include directory, the site-packages or the directory of the .pyx),
+    so that it does not depend on where the project and the Python environment are.
+
+    Args:
+        pyx_path: path of the .pyx
+        dependencies: dependencies of the .pyx (see ``get_dependencies``)
+        compiler_directives: the Cython compiler directives used to cythonize the .pyx
+        language: "c" or "c++"
+        hash_cache: cache used to not hash again the unchanged dependencies
+        shared_utility: the shared utility module the generated code imports its utility code from
+        include_dirs: the ``include_dirs`` of the extension
+
+    Returns:
+        An hexadecimal digest
+    """
+    digest = file_digest if hash_cache is None else hash_cache.digest
+    fingerprint = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    header = {
+        "cython": Cython.__version__,
+        "directives": compiler_directives,
+        "language": language,
+    }
+    if shared_utility is not None:  # The fingerprints of the projects without one are unchanged
+        header["shared_utility"] = shared_utility
+    fingerprint.update(json.dumps(header, sort_keys=True, default=str).encode("utf-8"))
+    pyx_dir = os.path.dirname(os.path.abspath(pyx_path))
+    include_roots = _get_include_roots(include_dirs or [])
+    for dependency in dependencies:
+        fingerprint.update(_get_dependency_key(dependency, pyx_dir, include_roots).encode("utf-8"))
+        fingerprint.update(digest(dependency).encode("utf-8"))
+    return fingerprint.hexdigest()
+
+
+def get_staleness_reason(
+    sources: list[str],
+    language: str | None,
+    compiler_directives: dict,
+    manifest: "Manifest",
+    hash_cache: HashCache | None = None,
+    shared_utility: str | None = None,
+    include_dirs: list[str] | None = None,
+) -> str | None:
+    """
+    Args:
+        sources: the sources of the extension
+        language: the language of the extension
+        compiler_directives: the Cython compiler directives of the extension
+        manifest: the manifest of the generated files
+        hash_cache: cache used to not hash again the unchanged dependencies
+        shared_utility: the shared utility module the generated code imports its utility code from
+        include_dirs: the ``include_dirs`` of the extension
+
+    Returns:
+        Why the extension has to be cythonized, None if its generated files are up to date
+    """
+    for source_path, output_path in iter_cython_sources(sources, language):
+        if not output_path.exists():
+            return f"missing output {output_path}"
+        dependencies = manifest.get_dependencies(source_path, output_path)
+        if dependencies is None:
+            return f"{source_path} not in the manifest"
+        try:
+            fingerprint = compute_fingerprint(
+                source_path, dependencies, compiler_directives, language, hash_cache, shared_utility, include_dirs
+            )
+        except OSError as e:  # A dependency has been removed
+            return f"missing dependency {e.filename}"
+        if fingerprint != manifest.get_fingerprint(source_path):
+            # The fingerprint covers the content of the dependencies, the Cython version and the directives
+            return f"{source_path} or its dependencies changed"
+    return None
+
+
+def _get_include_roots(include_dirs: list[str]) -> list[str]:
+    # The directories the .pxd/.pxi are found in, the most specific first
+    # (the Includes of Cython, eg: libc/stdlib.pxd, are in the site-packages)
+    roots = [
+        os.path.join(os.path.dirname(os.path.abspath(Cython.__file__)), "Includes"),
+        *(os.path.abspath(include_dir) for include_dir in include_dirs),
+        *(os.path.abspath(sysconfig.get_path(name)) for name in ("platlib", "purelib")),
+    ]
+    return list(dict.fromkeys(roots))
+
+
+def _get_dependency_key(dependency: str, pyx_dir: str, include_roots: list[str]) -> str:
+    path = os.path.abspath(dependency)
+    for root in include_roots:
+        if path.startswith(root + os.sep):
+            return _relative_path(path, root)
+    return _relative_path(path, pyx_dir)
+
+
+def _relative_path(path: str, start: str) -> str:
+    # The fingerprint must not change when the project is moved or checked out elsewhere
+    try:
+        return os.path.relpath(path, start).replace(os.sep, "/")
+    except ValueError:  # On Windows, paths on different drives
+        return os.path.abspath(path)
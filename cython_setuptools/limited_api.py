@@ -0,0 +1,120 @@
+"""
+Build of the extensions against the limited API of Python, whose stable ABI (abi3) is shared by all the Python
+versions from the targeted one
+
+The C generated by Cython is compiled with ``CYTHON_LIMITED_API`` and ``Py_LIMITED_API``, the sources are first
+scanned for what the limited API can not provide, so that these modules fail before being cythonized or compiled.
+"""
+import os
+from pathlib import Path
+import re
+from typing import NamedTuple
+
+# The cimported modules declaring the full C API of Python, with the first version their API is limited in
+_FULL_API_CIMPORTS = {
+    "cpython.array": None,
+    "cpython.buffer": (3, 11),
+    "cpython.datetime": None,
+    "numpy": None,
+}
+# "from package cimport module" and "cimport package.module, other as alias"
+_CIMPORT_PATTERN = re.compile(r"^[ \t]*(?:from[ \t]+([\w.]+)[ \t]+)?cimport[ \t]+\(?([^\n)]*)", re.MULTILINE)
+# The private API and the macros accessing the internals of the objects, eg: PyList_GET_ITEM, PyBytes_AS_STRING
+_FULL_API_NAME_PATTERN = re.compile(r"\b(?:_Py[A-Z_]\w*|Py\w+_(?:GET|SET|AS)_[A-Z_]+)\b")
+
+
+class LimitedApiViolation(NamedTuple):
+    path: str
+    line: int
+    usage: str
+
+
+class LimitedApiError(Exception):
+    """
+    Raised when an extension built against the limited API uses the full API of Python
+
+    Attributes:
+        violations: A dict where the key is the name of the extension and the value is the list of its violations
+    """
+
+    def __init__(self, violations: dict[str, list[LimitedApiViolation]]):
+        self.violations = violations
+        details = "\n".join(
+            f"  {name}: {violation.path}:{violation.line}: {violation.usage}"
+            for name, extension_violations in violations.items()
+            for violation in extension_violations
+        )
+        super().__init__(f"{len(violations)} extension(s) built for abi3 use the full API of Python:\n{details}")
+
+
+def parse_abi3(version: str) -> tuple[int, int]:
+    """
+    Args:
+        version: the oldest supported Python version, eg: "3.10"
+
+    Returns:
+        The major and minor versions
+    """
+    match = re.fullmatch(r"(\d+)\.(\d+)", str(version))
+    if match is None or int(match[1]) != 3 or int(match[2]) < 2:
+        raise ValueError(f"Invalid abi3 {version!r}, expected a Python version from 3.2, eg: '3.10'")
+    return int(match[1]), int(match[2])
+
+
+def get_limited_api_macros(version: str) -> list[tuple[str, str]]:
+    """
+    Args:
+        version: the oldest supported Python version, eg: "3.10"
+
+    Returns:
+        The ``define_macros`` building a Cython extension against the limited API of this version
+    """
+    major, minor = parse_abi3(version)
+    return [("CYTHON_LIMITED_API", "1"), ("Py_LIMITED_API", f"0x{major:02X}{minor:02X}0000")]
+
+
+def find_limited_api_violations(paths: list[os.PathLike], version: str) -> list[LimitedApiViolation]:
+    """
+    Scan Cython sources for the usages of the full API of Python
+
+    Only the cimports of the modules declaring the full API (eg: ``cpython.array``), the private names
+    and the accessor macros are detected, the other errors are reported by the C compiler.
+
+    Args:
+        paths: the .pyx, .pxd and .pxi to scan
+        version: the oldest supported Python version, eg: "3.10"
+
+    Returns:
+        The violations, sorted by path and line
+    """
+    target = parse_abi3(version)
+    violations = []
+    for path in paths:
+        content = Path(path).read_text(encoding="utf-8", errors="replace")
+        # Comments can not contain code, the strings are assumed not to look like it
+        content = re.sub(r"#[^\n]*", "", content)
+        for match in _CIMPORT_PATTERN.finditer(content):
+            package, names = match.groups()
+            names = [name.split(" as ")[0].strip() for name in names.split(",")]
+            # "from cpython cimport array" cimports the module cpython.array
+            modules = [package] if package and _is_full_api_module(package, target) else [
+                f"{package}.{name}" if package else name for name in names
+            ]
+            line = content.count("\n", 0, match.start()) + 1
+            violations += [
+                LimitedApiViolation(os.fspath(path), line, f"cimport {module}")
+                for module in modules
+                if _is_full_api_module(module, target)
+            ]
+        for match in _FULL_API_NAME_PATTERN.finditer(content):
+            line = content.count("\n", 0, match.start()) + 1
+            violations.append(LimitedApiViolation(os.fspath(path), line, match[0]))
+    return sorted(set(violations))
+
+
+def _is_full_api_module(module: str, target: tuple[int, int]) -> bool:
+    for name in (module, module.partition(".")[0]):  # eg: numpy.math is part of numpy
+        if name in _FULL_API_CIMPORTS:
+            limited_since = _FULL_API_CIMPORTS[name]
+            return limited_since is None or target < limited_since
+    return False
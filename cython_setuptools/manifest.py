@@ -0,0 +1,55 @@
+"""
+Sidecar manifest recording the fingerprint of the .pyx files used to generate each .c/.cpp file
+"""
+import os
+
+from .common import read_json, write_json
+
+MANIFEST_NAME = ".cython_setuptools_manifest.json"
+_VERSION = 1
+
+
+class Manifest:
+    """
+    Map each .pyx to its generated file, its fingerprint and its dependencies
+
+    The dependencies are stored so that the staleness check can recompute the fingerprint
+    without walking the cimport/include graph again: the graph can only change if one of
+    the dependencies changes, in which case the fingerprint changes too.
+    """
+
+    def __init__(self, path: os.PathLike):
+        self.path = path
+        content = read_json(path, {})
+        self._entries = content.get("entries", {}) if content.get("version") == _VERSION else {}
+        self._modified = False
+
+    def get_dependencies(self, source: os.PathLike, output: os.PathLike) -> list[str] | None:
+        """
+        Returns:
+            The dependencies recorded for ``source`` if its generated file is ``output`` and exists, else None
+        """
+        entry = self._entries.get(os.fspath(source))
+        if entry is None or entry["output"] != os.fspath(output) or not os.path.exists(output):
+            return None
+        return entry["dependencies"]
+
+    def get_fingerprint(self, source: os.PathLike) -> str | None:
+        entry = self._entries.get(os.fspath(source))
+        return None if entry is None else entry["fingerprint"]
+
+    def update(self, source: os.PathLike, output: os.PathLike, fingerprint: str, dependencies: list[str]):
+        self._entries[os.fspath(source)] = {
+            "output": os.fspath(output),
+            "fingerprint": fingerprint,
+            "dependencies": dependencies,
+        }
+        self._modified = True
+
+    def save(self):
+        """
+        Write the manifest if it has been updated
+        """
+        if self._modified:
+            write_json(self.path, {"version": _VERSION, "entries": self._entries})
+            self._modified = False
@@ -0,0 +1,80 @@
+"""
+Generation of the ``build.ninja`` file used by the ninja backend of ``build_ext``
+
+Each build edge runs a command computed by ``build_ext``: cythonization of a .pyx, compilation of a translation unit
+or link of an extension. The cythonization and compilation edges read the dependencies discovered by Cython and by
+the compiler from depfiles, so that ninja rebuilds exactly what changed, as soon as its inputs are ready.
+"""
+import os
+import shlex
+import shutil
+from typing import NamedTuple
+
+from .common import convert_to_bool
+
+NINJA_FILE_NAME = "build.ninja"
+
+# Every edge sets its command in the ``cmd`` variable, the rules only differ by how their dependencies are tracked
+_RULES = {
+    # Cython writes the dependencies in ``<output>.dep`` with ``--depfile``, restat prunes the compilation
+    # of the generated files that did not change
+    "cython": {"command": "$cmd", "description": "CYTHON $in", "depfile": "$out.dep", "deps": "gcc", "restat": "1"},
+    # The compiler writes the dependencies in ``<object>.d`` with ``-MMD -MF``
+    "cc": {"command": "$cmd", "description": "CC $in", "depfile": "$out.d", "deps": "gcc"},
+    "link": {"command": "$cmd", "description": "LINK $out"},
+}
+
+
+class NinjaEdge(NamedTuple):
+    rule: str  # one of "cython", "cc" or "link"
+    outputs: list[str]
+    inputs: list[str]
+    implicit_inputs: list[str]  # eg: the ``depends`` of an extension
+    command: list[str]
+
+
+def is_ninja_enabled(default: bool | str = False) -> bool:
+    """
+    Returns:
+        Whether the ninja backend is used, set by the ``CYTHON_SETUPTOOLS_NINJA`` env variable, else ``default``
+    """
+    return convert_to_bool(os.environ.get("CYTHON_SETUPTOOLS_NINJA", default))
+
+
+def find_ninja() -> str | None:
+    """
+    Returns:
+        The path of the ninja executable, None if it is not installed
+    """
+    return shutil.which("ninja")
+
+
+def write_ninja_file(path: os.PathLike, build_dir: str, edges: list[NinjaEdge]):
+    """
+    Write a ``build.ninja`` file
+
+    Args:
+        path: path of the file
+        build_dir: directory of the ninja logs (``.ninja_log`` and ``.ninja_deps``)
+        edges: the build edges, their paths are relative to the directory ninja is run from
+    """
+    lines = ["ninja_required_version = 1.5", f"builddir = {_escape(build_dir)}", ""]
+    for name, variables in _RULES.items():
+        lines.append(f"rule {name}")
+        lines += [f"  {variable} = {value}" for variable, value in variables.items()]
+        lines.append("")
+    for edge in edges:
+        build = f"build {_escape_paths(edge.outputs)}: {edge.rule} {_escape_paths(edge.inputs)}"
+        if edge.implicit_inputs:
+            build += f" | {_escape_paths(edge.implicit_inputs)}"
+        lines += [build, f"  cmd = {_escape(shlex.join(edge.command))}", ""]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def _escape(value: str) -> str:
+    return value.replace("$", "$$").replace("\n", " ")
+
+
+def _escape_paths(paths: list[str]) -> str:
+    return " ".join(_escape(os.fspath(path)).replace(" ", "$ ").replace(":", "$:") for path in paths)
@@ -0,0 +1,131 @@
+"""
+Precompiled headers of the ``build_ext`` command
+
+The ``precompiled_headers`` of an extension are included by a generated header, which is precompiled with the exact
+command compiling the translation units of the extension (compiler, flags, macros, include directories and language),
+so the extensions compiled with identical flags share the same precompiled header.
+Each translation unit is compiled with ``-include`` of the generated header: gcc and clang load its precompiled
+``.gch`` instead of parsing the headers, or parse them as usual if it is missing or does not match the command.
+The generated header starts with ``Python.h``, which must be included before any standard header.
+"""
+import hashlib
+import os
+from typing import NamedTuple
+
+from .common import DIGEST_SIZE
+
+# The language of the translation units -> the language of their precompiled header
+PCH_LANGUAGES = {"c": "c-header", "c++": "c++-header"}
+_HEADER_NAME = "precompiled.h"
+# Stand-ins of the source and the object in the command of the translation units, to key their precompiled header
+_SOURCE_PLACEHOLDER = "<source>"
+_OBJECT_PLACEHOLDER = "<object>"
+
+
+class PrecompiledHeader(NamedTuple):
+    header_path: str  # the generated header including the precompiled headers
+    output_path: str  # the precompiled header, loaded by the compiler in place of ``header_path``
+    headers: list[str]
+    command: list[str]
+
+    def get_include_args(self) -> list[str]:
+        """
+        Returns:
+            The compilation flags using the precompiled header
+        """
+        return ["-include", self.header_path]
+
+
+def get_precompiled_header(
+    headers: list[str], command: list[str], source: str, object_path: str, language: str, pch_dir: str, signature: list[str]
+) -> PrecompiledHeader:
+    """
+    Args:
+        headers: the headers to precompile, as they are included (eg: "numpy/arrayobject.h") or paths of existing files
+        command: the command compiling a translation unit ``source`` into ``object_path``
+        source: the source of the command
+        object_path: the object of the command
+        language: the language of the translation unit, "c" or "c++"
+        pch_dir: the directory of the precompiled headers
+        signature: identifies the version of the compiler (see ``_get_executable_signature``)
+
+    Returns:
+        The precompiled header of the translation units compiled by ``command``, in a subdirectory of ``pch_dir``
+        named after its key
+    """
+    key = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for argument in (
+        *signature,
+        language,
+        *[_SOURCE_PLACEHOLDER if arg == source else _OBJECT_PLACEHOLDER if arg == object_path else arg for arg in command],
+        "",
+        *headers,
+    ):
+        key.update(argument.encode("utf-8") + b"\0")
+    header_path = os.path.join(pch_dir, key.hexdigest(), _HEADER_NAME)
+    output_path = header_path + ".gch"
+    pch_command = []
+    for arg in command:
+        if arg == source:
+            pch_command += ["-x", PCH_LANGUAGES[language], header_path]
+        elif arg == object_path:
+            pch_command.append(output_path)
+        else:
+            pch_command.append(arg)
+    return PrecompiledHeader(header_path, output_path, headers, [*pch_command, "-MMD", "-MF", get_depfile_path(output_path)])
+
+
+def write_header(pch: PrecompiledHeader):
+    """
+    Write the generated header of a precompiled header, if its content changed
+    """
+    # Python.h must be included first, it is force-included before the own includes of the translation units
+    lines = ["/* Generated by cython_setuptools: headers precompiled for the extensions */", "#include <Python.h>"]
+    for header in pch.headers:
+        if header == "Python.h":
+            continue
+        lines.append(f'#include "{os.path.abspath(header)}"' if os.path.isfile(header) else f"#include <{header}>")
+    content = "\n".join(lines) + "\n"
+    try:
+        with open(pch.header_path, encoding="utf-8") as f:
+            if f.read() == content:  # Keep its mtime, so that it is not precompiled again
+                return
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(pch.header_path), exist_ok=True)
+    with open(pch.header_path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def get_depfile_path(output_path: str) -> str:
+    """
+    Returns:
+        The path of the depfile written by the compiler with the precompiled header
+    """
+    return output_path + ".d"
+
+
+def read_depfile(path: str) -> list[str] | None:
+    """
+    Read the dependencies of a Makefile depfile written by the compiler (``-MMD -MF``)
+
+    Returns:
+        The paths of the dependencies, None if the depfile does not exist
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+    except OSError:
+        return None
+    content = content.replace("\\\r\n", " ").replace("\\\n", " ")
+    _, _, dependencies = content.partition(": ")
+    paths = []
+    path = ""
+    for part in dependencies.split():
+        # The spaces of the paths are escaped by a backslash
+        if part.endswith("\\"):
+            path += part[:-1] + " "
+        else:
+            paths.append(path + part)
+            path = ""
+    return paths
@@ -0,0 +1,87 @@
+"""
+Profile-guided optimization: flags of the instrumented and optimized builds, and preparation of the profiles
+
+``build_ext --pgo`` builds the extensions with the ``generate`` flags, runs the training command, which writes the
+profiles of each extension in its own directory, merges them if needed and rebuilds with the ``use`` flags.
+gcc reads its ``.gcda`` files directly, clang needs the ``.profraw`` files to be merged into a ``.profdata``
+by ``llvm-profdata``.
+"""
+import glob
+import os
+import shutil
+import subprocess
+import sys
+
+# Distutils is deprecated but for the moment this is the only way to raise the errors of the setuptools commands
+from setuptools._distutils import log
+from setuptools._distutils.errors import DistutilsExecError, DistutilsPlatformError
+
+PGO_PHASES = ("generate", "use")
+_CLANG_PROFDATA_NAME = "default.profdata"
+
+
+def get_pgo_flags(phase: str, profile_dir: str, compiler_family: str) -> list[str]:
+    """
+    Get the flags of a phase of profile-guided optimization, used both to compile and to link
+
+    Args:
+        phase: "generate" for the instrumented build, "use" for the optimized build
+        profile_dir: the directory of the profiles of the extension
+        compiler_family: "gcc" or "clang" (see ``get_compiler_family``)
+
+    Returns:
+        The flags, empty for the ``use`` phase of clang if the training did not load the extension: clang fails
+        without its merged profile
+
+    Raises:
+        DistutilsPlatformError: if the compiler does not support profile-guided optimization
+    """
+    if phase not in PGO_PHASES:
+        raise ValueError(f"Unknown PGO phase {phase!r}, expected one of {', '.join(PGO_PHASES)}")
+    profile_dir = os.path.abspath(profile_dir)
+    if compiler_family == "gcc":
+        if phase == "generate":
+            return [f"-fprofile-generate={profile_dir}"]
+        # The profiles of the functions not run by the training are missing, and threads may corrupt the counters
+        return [f"-fprofile-use={profile_dir}", "-fprofile-correction", "-Wno-missing-profile"]
+    if compiler_family == "clang":
+        if phase == "generate":
+            return [f"-fprofile-generate={profile_dir}"]
+        profdata_path = os.path.join(profile_dir, _CLANG_PROFDATA_NAME)
+        if not os.path.exists(profdata_path):
+            log.warn("no profile in %s, the extension is built without profile-guided optimization", profile_dir)
+            return []
+        return [f"-fprofile-use={profdata_path}", "-Wno-profile-instr-unprofiled", "-Wno-profile-instr-out-of-date"]
+    raise DistutilsPlatformError(f"profile-guided optimization is not supported with the {compiler_family} compiler")
+
+
+def merge_profiles(profile_dir: str, compiler_family: str):
+    """
+    Prepare the profiles written by the training of an extension for the ``use`` phase
+
+    Raises:
+        DistutilsExecError: if the profiles of clang can not be merged
+    """
+    if compiler_family != "clang":
+        return
+    profraw_paths = sorted(glob.glob(os.path.join(glob.escape(profile_dir), "*.profraw")))
+    if not profraw_paths:
+        return
+    command = [*_get_llvm_profdata_command(), "merge", "-o", os.path.join(profile_dir, _CLANG_PROFDATA_NAME), *profraw_paths]
+    try:
+        subprocess.run(command, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise DistutilsExecError(f"can not merge the profiles of {profile_dir}: {e}") from e
+
+
+def _get_llvm_profdata_command() -> list[str]:
+    if shutil.which("llvm-profdata"):
+        return ["llvm-profdata"]
+    if sys.platform == "darwin":
+        return ["xcrun", "llvm-profdata"]
+    # The tools of the versioned LLVM packages, eg: llvm-profdata-17
+    versioned = [path for path in glob.glob("/usr/bin/llvm-profdata-*") if path.rsplit("-", 1)[1].isdigit()]
+    versioned.sort(key=lambda path: int(path.rsplit("-", 1)[1]))
+    if versioned:
+        return [versioned[-1]]
+    raise DistutilsExecError("llvm-profdata is needed to merge the profiles of clang")
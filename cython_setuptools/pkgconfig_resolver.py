@@ -0,0 +1,309 @@
+"""
+Pure Python resolver of pkg-config ``.pc`` files, to get the build flags of packages without spawning pkg-config
+
+Only the features used to get the flags of installed packages are supported: variables, ``Cflags``, ``Libs``,
+``Requires`` and ``Requires.private``. Version constraints of the requirements are not checked.
+"""
+import functools
+import os
+import re
+import shlex
+import subprocess
+import sysconfig
+from typing import NamedTuple
+
+from .pkgconfig_wrapper import BuildFlags
+
+_LINE_RE = re.compile(r"([A-Za-z0-9_.]+)\s*([:=])\s*(.*)")
+_EXPANSION_RE = re.compile(r"\$\$|\$\{([^}]*)\}")
+_REQUIRES_TOKEN_RE = re.compile(r"[<>=!]+|[^\s,<>=!]+")
+# The special flags of pkg-config, which are grouped with their arguments and may be repeated
+_UNMERGEABLE_PREFIXES = (
+    "-framework", "-isystem", "-idirafter", "-pthread", "-Wa,", "-Wl,", "-Wp,", "-trigraphs", "-pedantic", "-ansi",
+    "-std=", "-stdlib=", "-include", "-nostdinc", "-nostdlibinc", "-nobuiltininc", "-nodefaultlibs",
+)
+
+
+class PkgConfigError(Exception):
+    """
+    Raised when a package or one of its requirements can not be resolved
+    """
+
+
+class PcFile(NamedTuple):
+    path: str
+    variables: dict[str, str]  # eg: prefix, libdir
+    fields: dict[str, str]  # lower case keys, eg: cflags, libs, requires
+
+
+class _Fragment(NamedTuple):
+    type: str  # the letter of the flag, eg: "I" for -I/usr/include/foo, empty for the special flags
+    args: tuple[str, ...]  # eg: ("-I/usr/include/foo",), ("-framework", "Foo")
+
+
+def resolve_flags(pkg_names: list[str], env: dict[str, str] | None = None) -> BuildFlags:
+    """
+    Get the build flags of packages, like ``pkg-config --cflags`` and ``pkg-config --libs``
+
+    Args:
+        pkg_names: the packages
+        env: the env variables used to find the ``.pc`` files (``PKG_CONFIG_PATH``, ``PKG_CONFIG_LIBDIR``,
+             ``PKG_CONFIG_SYSROOT_DIR``, ...), default to ``os.environ``
+
+    Returns:
+        A BuildFlags dataclass
+
+    Raises:
+        PkgConfigError: if a package or one of its requirements is not found or can not be parsed
+    """
+    env = os.environ if env is None else env
+    search_dirs = get_search_dirs(env)
+    parsed = {}
+    # The private requirements are only needed to link statically, but their headers may be included
+    compile_flags = _render(_collect_fragments(pkg_names, "cflags", ("requires", "requires.private"), search_dirs, parsed))
+    link_flags = _render(_collect_fragments(pkg_names, "libs", ("requires",), search_dirs, parsed))
+
+    sysroot = env.get("PKG_CONFIG_SYSROOT_DIR", "")
+    if not env.get("PKG_CONFIG_ALLOW_SYSTEM_CFLAGS"):
+        system_include_dirs = _get_system_dirs(env, "PKG_CONFIG_SYSTEM_INCLUDE_PATH", "pc_system_includedirs")
+        compile_flags = [flag for flag in compile_flags if not _is_system_dir_flag(flag, "-I", system_include_dirs)]
+    if not env.get("PKG_CONFIG_ALLOW_SYSTEM_LIBS"):
+        system_library_dirs = _get_system_dirs(env, "PKG_CONFIG_SYSTEM_LIBRARY_PATH", "pc_system_libdirs")
+        link_flags = [flag for flag in link_flags if not _is_system_dir_flag(flag, "-L", system_library_dirs)]
+    return BuildFlags(
+        [_add_sysroot(flag, "-I", sysroot) for flag in compile_flags],
+        [_add_sysroot(flag, "-L", sysroot) for flag in link_flags],
+    )
+
+
+def get_search_dirs(env: dict[str, str]) -> list[str]:
+    """
+    Returns:
+        The directories searched for ``.pc`` files: ``PKG_CONFIG_PATH`` then ``PKG_CONFIG_LIBDIR``
+        or the default directories of pkg-config
+    """
+    search_dirs = env.get("PKG_CONFIG_PATH", "").split(os.pathsep)
+    libdir = env.get("PKG_CONFIG_LIBDIR")
+    if libdir is not None:
+        search_dirs += libdir.split(os.pathsep)
+    else:
+        search_dirs += _get_default_dirs("pc_path")
+    return [search_dir for search_dir in search_dirs if search_dir]
+
+
+def find_pc_file(pkg_name: str, search_dirs: list[str]) -> str:
+    """
+    Returns:
+        The path of the ``.pc`` file of the package, ``pkg_name`` can also be the path of a ``.pc`` file
+
+    Raises:
+        PkgConfigError: if it is not found
+    """
+    if pkg_name.endswith(".pc") and os.path.isfile(pkg_name):
+        return pkg_name
+    for search_dir in search_dirs:
+        path = os.path.join(search_dir, f"{pkg_name}.pc")
+        if os.path.isfile(path):
+            return path
+    raise PkgConfigError(f"Package {pkg_name!r} not found in {os.pathsep.join(search_dirs)!r}")
+
+
+def find_required_pc_files(pkg_names: list[str], search_dirs: list[str]) -> list[str]:
+    """
+    Returns:
+        The paths of the ``.pc`` files of the packages and of all their requirements, private ones included
+
+    Raises:
+        PkgConfigError: if a package or one of its requirements is not found or can not be parsed
+    """
+    paths = {}
+    pending = list(pkg_names)
+    while pending:
+        pkg_name = pending.pop()
+        if pkg_name in paths:
+            continue
+        pc_file = parse_pc_file(find_pc_file(pkg_name, search_dirs))
+        paths[pkg_name] = pc_file.path
+        for requires_field in ("requires", "requires.private"):
+            pending += parse_requires(pc_file.fields.get(requires_field, ""))
+    return list(paths.values())
+
+
+def parse_pc_file(path: str) -> PcFile:
+    """
+    Parse a ``.pc`` file and expand its variables
+
+    Raises:
+        PkgConfigError: if the file can not be read or uses an undefined variable
+    """
+    variables = {"pcfiledir": os.path.dirname(os.path.abspath(path))}
+    fields = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+    except OSError as e:
+        raise PkgConfigError(f"Can not read {path}: {e}") from e
+    for line in content.replace("\\\n", " ").splitlines():
+        line = re.sub(r"(?<!\\)#.*", "", line).replace("\\#", "#").strip()
+        match = _LINE_RE.fullmatch(line)
+        if not match:
+            continue
+        name, separator, value = match.groups()
+        value = _expand_variables(value, variables, path)
+        if separator == "=":
+            variables[name] = value
+        else:
+            fields[name.lower()] = value
+    return PcFile(path, variables, fields)
+
+
+def parse_requires(value: str) -> list[str]:
+    """
+    Returns:
+        The package names of a ``Requires`` field, eg: ``["foo", "bar"]`` for ``"foo >= 1.0, bar"``
+    """
+    names = []
+    skip_version = False
+    for token in _REQUIRES_TOKEN_RE.findall(value):
+        if token[0] in "<>=!":
+            skip_version = True
+        elif skip_version:
+            skip_version = False
+        else:
+            names.append(token)
+    return names
+
+
+def _collect_fragments(
+    pkg_names: list[str], field: str, requires_fields: tuple[str, ...], search_dirs: list[str], parsed: dict[str, PcFile]
+) -> list[_Fragment]:
+    # Like pkg-config, the packages are visited in depth-first pre-order, again each time they are required (except
+    # through a cycle), since the deduplication of the flags depends on all their occurrences
+    requirements = {}
+    package_fragments = {}
+    fragments = []
+
+    def visit(pkg_name, path):
+        if pkg_name not in requirements:
+            if pkg_name not in parsed:
+                parsed[pkg_name] = parse_pc_file(find_pc_file(pkg_name, search_dirs))
+            pc_file = parsed[pkg_name]
+            requirements[pkg_name] = [
+                required for requires_field in requires_fields for required in parse_requires(pc_file.fields.get(requires_field, ""))
+            ]
+            package_fragments[pkg_name] = _parse_fragments(_get_field_flags(pc_file, field))
+        for fragment in package_fragments[pkg_name]:
+            _add_fragment(fragments, fragment)
+        path = path | {pkg_name}
+        for required in requirements[pkg_name]:
+            if required not in path:
+                visit(required, path)
+
+    for pkg_name in pkg_names:
+        visit(pkg_name, frozenset())
+    return fragments
+
+
+def _parse_fragments(flags: list[str]) -> list[_Fragment]:
+    fragments = []
+    for flag in flags:
+        if len(flag) > 1 and flag.startswith("-") and not flag.startswith("-lib:") and not _is_unmergeable(flag):
+            fragments.append(_Fragment(flag[1], (flag,)))
+        elif fragments and not fragments[-1].type and _is_unmergeable(fragments[-1].args[0]):
+            # The arguments of a special flag are grouped with it, eg: -framework Foo, -isystem /usr/include/foo
+            fragments[-1] = _Fragment("", (*fragments[-1].args, flag))
+        else:
+            fragments.append(_Fragment("", (flag,)))
+    return fragments
+
+
+def _add_fragment(fragments: list[_Fragment], fragment: _Fragment):
+    # The deduplication of pkg-config (pkgconf): the search paths keep their first occurrence, the other flags are
+    # moved to the end unless their previous occurrence follows a different kind of flag,
+    # eg: -latomic in -Wl,--push-state,--as-needed -latomic -Wl,--pop-state
+    if fragment.type in ("F", "L", "I"):
+        if fragment in fragments:
+            return
+    elif _is_unmergeable(fragment.args[0][2:] if fragment.type else fragment.args[0]):
+        for index in range(len(fragments) - 1, -1, -1):
+            if fragments[index] == fragment:
+                if _should_move(fragments, index):
+                    del fragments[index]
+                break
+    fragments.append(fragment)
+
+
+def _should_move(fragments: list[_Fragment], index: int) -> bool:
+    if index == 0 or fragments[index - 1].type in ("l", "L", "I"):
+        return True
+    return not fragments[index].type or fragments[index - 1].type == fragments[index].type
+
+
+def _is_unmergeable(data: str) -> bool:
+    return not data.startswith("-") or data.startswith(_UNMERGEABLE_PREFIXES)
+
+
+def _render(fragments: list[_Fragment]) -> list[str]:
+    return [arg for fragment in fragments for arg in fragment.args]
+
+
+def _get_field_flags(pc_file: PcFile, field: str) -> list[str]:
+    try:
+        return shlex.split(pc_file.fields.get(field, ""))
+    except ValueError as e:
+        raise PkgConfigError(f"{pc_file.path}: invalid {field} field: {e}") from e
+
+
+def _expand_variables(value: str, variables: dict[str, str], path: str) -> str:
+    def expand(match):
+        if match.group(0) == "$$":
+            return "$"
+        try:
+            return variables[match.group(1)]
+        except KeyError:
+            raise PkgConfigError(f"{path}: undefined variable {match.group(1)!r}") from None
+
+    return _EXPANSION_RE.sub(expand, value)
+
+
+def _get_system_dirs(env: dict[str, str], variable: str, pkg_config_variable: str) -> list[str]:
+    if env.get(variable):
+        return [os.path.normpath(path) for path in env[variable].split(os.pathsep) if path]
+    return [os.path.normpath(path) for path in _get_default_dirs(pkg_config_variable)]
+
+
+@functools.lru_cache
+def _get_default_dirs(pkg_config_variable: str) -> list[str]:
+    # The defaults depend on how pkg-config was built for the distribution (eg: /usr/lib64 on Fedora,
+    # /usr/lib/x86_64-linux-gnu on Debian), they are asked once to the executable if it is installed
+    try:
+        output = subprocess.run(
+            ["pkg-config", "--variable", pkg_config_variable, "pkg-config"], capture_output=True, check=True
+        ).stdout.decode("utf8")
+    except (OSError, subprocess.CalledProcessError):
+        output = ""
+    default_dirs = [path for path in output.strip().split(os.pathsep) if path]
+    return default_dirs or _get_fallback_dirs(pkg_config_variable)
+
+
+def _get_fallback_dirs(pkg_config_variable: str) -> list[str]:
+    # The usual defaults of pkg-config, with the library directories of the multiarch and lib64 layouts
+    multiarch = sysconfig.get_config_var("MULTIARCH")
+    library_dirs = ([f"lib/{multiarch}"] if multiarch else []) + ["lib64", "lib"]
+    if pkg_config_variable == "pc_path":
+        return [
+            f"{prefix}/{directory}/pkgconfig" for prefix in ("/usr/local", "/usr") for directory in (*library_dirs, "share")
+        ]
+    if pkg_config_variable == "pc_system_libdirs":
+        return [f"{prefix}/{directory}" for prefix in ("/usr", "") for directory in library_dirs]
+    return ["/usr/include"]
+
+
+def _is_system_dir_flag(flag: str, prefix: str, system_dirs: list[str]) -> bool:
+    return flag.startswith(prefix) and os.path.normpath(flag[len(prefix):]) in system_dirs
+
+
+def _add_sysroot(flag: str, prefix: str, sysroot: str) -> str:
+    if sysroot and flag.startswith(prefix + "/"):
+        return prefix + sysroot + flag[len(prefix):]
+    return flag
@@ -1,11 +1,28 @@
 """
 Module to wrap calls to pkg-config
+
+The flags are memoized in the process and persisted in a cache file, which is validated by the mtimes of the
+``.pc`` files they were resolved from, so that unchanged packages do not spawn pkg-config again.
 """
 from dataclasses import dataclass, field
+import hashlib
+import json
 import os
 import shlex
 import subprocess
 
+from .common import DIGEST_SIZE, read_json, write_json
+from .trace import get_tracer
+
+# The env variables changing the output of pkg-config
+_PKG_CONFIG_ENV_VARS = (
+    "PKG_CONFIG_PATH",
+    "PKG_CONFIG_LIBDIR",
+    "PKG_CONFIG_SYSROOT_DIR",
+    "PKG_CONFIG_ALLOW_SYSTEM_CFLAGS",
+    "PKG_CONFIG_ALLOW_SYSTEM_LIBS",
+)
+
 
 @dataclass
 class BuildFlags:
@@ -16,6 +33,9 @@ class BuildFlags:
     link_flags: list[str] = field(default_factory=list)  # eg: -L -l
 
 
+_memo: dict[str, BuildFlags] = {}
+
+
 def get_flags(pkg_config_packages: list[str], pkg_config_dirs: list[str] | None = None) -> BuildFlags:
     """
     Get build flags from dependencies using pkg-config.
@@ -31,22 +51,137 @@ def get_flags(pkg_config_packages: list[str], pkg_config_dirs: list[str] | None
     if not pkg_config_packages:
         return BuildFlags()
 
-    compile_flags = _run_pkg_config(pkg_config_packages, "--cflags", pkg_config_dirs)
-    link_flags = _run_pkg_config(pkg_config_packages, "--libs", pkg_config_dirs)
+    env = os.environ.copy()
+    if pkg_config_dirs:
+        _extend_pkg_config_path(pkg_config_dirs, env)
+    return get_flags_from_env(pkg_config_packages, env)
+
+
+def get_flags_from_env(pkg_config_packages: list[str], env: dict[str, str]) -> BuildFlags:
+    """
+    Same as ``get_flags`` but the pkg-config search path is already set in ``env``
+
+    The flags are memoized by packages and pkg-config env variables.
+    By default they are resolved by the pkg-config executable and persisted in the file returned by
+    ``get_cache_path``. With the ``CYTHON_SETUPTOOLS_PKG_CONFIG_BACKEND=python`` env variable, the ``.pc`` files
+    are resolved in process by ``pkgconfig_resolver``, falling back to the executable if it fails.
+
+    Args:
+        pkg_config_packages: list of packages to send to pkg config
+        env: the env variables of pkg-config
+
+    Returns:
+        A BuildFlags dataclass
+    """
+    key = (list(pkg_config_packages), [env.get(name) for name in _PKG_CONFIG_ENV_VARS])
+    memo_key = json.dumps(key)
+    build_flags = _memo.get(memo_key)
+    if build_flags is None:
+        with get_tracer().span("pkg-config", " ".join(pkg_config_packages)):
+            build_flags = _memo[memo_key] = _resolve_flags(list(pkg_config_packages), env, memo_key)
+    # The callers extend their own flags with the returned lists
+    return BuildFlags(list(build_flags.compile_flags), list(build_flags.link_flags))
+
 
+def get_cache_path() -> str | None:
+    """
+    Returns:
+        The path of the persistent cache of pkg-config results, set by the ``CYTHON_SETUPTOOLS_PKG_CONFIG_CACHE``
+        env variable (an empty value disables the cache, a path in the home directory shares it between projects),
+        default to ``build/cython_setuptools/pkg_config.json`` in the current directory, next to the build files
+        of setuptools
+    """
+    cache_path = os.environ.get("CYTHON_SETUPTOOLS_PKG_CONFIG_CACHE")
+    if cache_path is not None:
+        return os.path.expanduser(cache_path) or None
+    return os.path.join("build", "cython_setuptools", "pkg_config.json")
+
+
+def _resolve_flags(pkg_names: list[str], env: dict[str, str], memo_key: str) -> BuildFlags:
+    backend = os.environ.get("CYTHON_SETUPTOOLS_PKG_CONFIG_BACKEND", "subprocess")
+    if backend not in ("subprocess", "python"):
+        raise ValueError(f"Unknown pkg-config backend {backend!r}, expected 'subprocess' or 'python'")
+    if backend == "python":
+        from .pkgconfig_resolver import PkgConfigError, resolve_flags
+
+        try:
+            return resolve_flags(pkg_names, env)
+        except PkgConfigError as e:
+            # Distutils is deprecated but for the moment this is the only way to log like the setuptools commands
+            from setuptools._distutils import log
+
+            log.warn("%s, falling back to pkg-config", e)
+    return _get_persisted_flags(pkg_names, env, memo_key)
+
+
+def _get_persisted_flags(pkg_names: list[str], env: dict[str, str], memo_key: str) -> BuildFlags:
+    cache_path = get_cache_path()
+    if cache_path is None:
+        return _run_pkg_config_flags(pkg_names, env)
+    entry_key = hashlib.blake2b(memo_key.encode("utf-8"), digest_size=DIGEST_SIZE).hexdigest()
+    entries = read_json(cache_path, {})
+    entry = entries.get(entry_key)
+    if entry is not None and _get_mtimes(entry["mtimes"]) == entry["mtimes"]:
+        return BuildFlags(entry["compile_flags"], entry["link_flags"])
+
+    build_flags = _run_pkg_config_flags(pkg_names, env)
+    watched_paths = _get_watched_paths(pkg_names, env)
+    if watched_paths is None:
+        return build_flags
+    entries[entry_key] = {
+        "compile_flags": build_flags.compile_flags,
+        "link_flags": build_flags.link_flags,
+        "mtimes": _get_mtimes(watched_paths),
+    }
+    try:
+        write_json(cache_path, entries)
+    except OSError:  # eg: read-only directory, the cache is only an optimization
+        pass
+    return build_flags
+
+
+def _run_pkg_config_flags(pkg_names: list[str], env: dict[str, str]) -> BuildFlags:
+    compile_flags = _check_output(["pkg-config", "--cflags", *pkg_names], env)
+    link_flags = _check_output(["pkg-config", "--libs", *pkg_names], env)
     return BuildFlags(shlex.split(compile_flags), shlex.split(link_flags))
 
 
-def _run_pkg_config(pkg_names: list[str], option: str, pkg_config_dirs: list[str] | None = None) -> str:
-    env = os.environ.copy()
-    if pkg_config_dirs:
-        _extend_pkg_config_path(pkg_config_dirs, env)
-    cmd = ["pkg-config", option, *pkg_names]
+def _get_watched_paths(pkg_names: list[str], env: dict[str, str]) -> list[str] | None:
+    # The .pc files of the packages and of their (private) requirements, and the search directories
+    # whose mtime changes when a .pc file is added and may shadow a resolved one.
+    # The requirements are found by parsing the .pc files instead of running pkg-config for each of them.
+    from .pkgconfig_resolver import PkgConfigError, find_required_pc_files
+
+    search_dirs = []
+    for variable in ("PKG_CONFIG_PATH", "PKG_CONFIG_LIBDIR"):
+        search_dirs += env.get(variable, "").split(os.pathsep)
+    if not env.get("PKG_CONFIG_LIBDIR"):
+        search_dirs += _check_output(["pkg-config", "--variable", "pc_path", "pkg-config"], env).strip().split(os.pathsep)
+    search_dirs = [search_dir for search_dir in search_dirs if search_dir]
+    try:
+        pc_files = find_required_pc_files(pkg_names, search_dirs)
+    except PkgConfigError:  # the results can not be validated, they are not persisted
+        return None
+    paths = search_dirs + pc_files + [os.path.dirname(pc_file) for pc_file in pc_files]
+    return sorted({os.path.abspath(path) for path in paths})
+
+
+def _get_mtimes(paths: list[str]) -> dict[str, int | None]:
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            mtimes[path] = None
+    return mtimes
+
+
+def _check_output(cmd: list[str], env: dict[str, str]) -> str:
     return subprocess.check_output(cmd, env=env).decode("utf8")
 
 
 def _extend_pkg_config_path(pkg_config_dirs: list[str], env_to_update: dict[str, str]):
     original = env_to_update.get("PKG_CONFIG_PATH", "")
-    if original != "" and not original.endswith(":"):
-        original += ":"
-    env_to_update["PKG_CONFIG_PATH"] = original + ":".join(pkg_config_dirs)
+    if original != "" and not original.endswith(os.pathsep):
+        original += os.pathsep
+    env_to_update["PKG_CONFIG_PATH"] = original + os.pathsep.join(pkg_config_dirs)
@@ -5,8 +5,14 @@ Encapsulate the retrieval of information from the pyproject.toml
 import os
 from typing import Any
 
-from serde import field, serde
-from serde.toml import from_toml
+from serde import field, from_dict, serde
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+from .common import DEFAULT_UNITY_BATCH_SIZE
 
 
 @serde
@@ -28,6 +34,19 @@ class CythonSetuptoolsOptions:
         pkg_config_dirs:
             A list of directories to add to the pkg-config search paths
             (extends the `PKG_CONFIG_PATH` environment variable).
+        cython_directives: Cython compiler directives (eg: ``{"boundscheck": False, "language_level": 3}``).
+        profile: Optimization profile: "release", "native", "size" or "debug" (see ``get_profile_flags``).
+        lto: Link-time optimization: true, false or "thin" (default to true with the "release" and "native" profiles).
+        bundle: Name of the extension bundling this one with the others of the same bundle (see ``bundle_extensions``),
+            an empty name overrides the bundle of the ``[cython_defaults]``.
+        abi3: Oldest Python version (eg: "3.10") whose limited API the extension is built against, to be loaded
+            by all the later versions.
+        precompiled_headers: Headers included by all the translation units (eg: "numpy/arrayobject.h"), precompiled
+            once by ``build_ext`` for all the extensions with the same compilation flags (see ``cython_setuptools.pch``).
+        unity_build: Compile the C/C++ sources that are not generated by Cython in batches, each batch being a single
+            translation unit generated by ``build_ext`` (see ``cython_setuptools.unity``).
+        unity_batch_size: Maximum number of sources in a batch of a unity build, 0 to batch all the sources together.
+        unity_exclude: Glob patterns of the sources compiled on their own by a unity build (eg: ``["src/legacy_*.cpp"]``).
     """
     sources: list[str]
     name: str | None = None
@@ -40,6 +59,15 @@ class CythonSetuptoolsOptions:
     cpp_std: int = 17
     pkg_config_packages: list[str] = field(default_factory=list)
     pkg_config_dirs: list[str] = field(default_factory=list)
+    cython_directives: dict[str, Any] = field(default_factory=dict)
+    profile: str | None = None
+    lto: bool | str | None = None
+    bundle: str | None = None
+    abi3: str | None = None
+    precompiled_headers: list[str] = field(default_factory=list)
+    unity_build: bool = False
+    unity_batch_size: int = DEFAULT_UNITY_BATCH_SIZE
+    unity_exclude: list[str] = field(default_factory=list)
 
     def to_extension_kwargs(self) -> dict[str, Any]:
         """
@@ -60,13 +88,80 @@ class CythonSetuptoolsOptions:
         }
 
 
+@serde
+class PgoConfig:
+    """
+    Profile-guided optimization options that can be in the ``[tool.cython_setuptools.pgo]`` table of the pyproject.toml
+
+    Attributes:
+        training_command:
+            Command run between the instrumented build and the optimized build of ``build_ext --pgo``,
+            a list of arguments or a shell command (eg: ``["python", "-m", "pytest", "benchmarks"]``).
+        profile_dir: Directory of the profiles, one subdirectory per extension (default to ``pgo`` in the build temp directory).
+    """
+    training_command: list[str] | str | None = None
+    profile_dir: str | None = None
+
+
+@serde
+class CythonSetuptoolsConfig:
+    """
+    Project wide cython setuptools options that can be in the ``[tool.cython_setuptools]`` table of the pyproject.toml
+
+    Attributes:
+        jobs: Number of worker processes used to cythonize the extensions (default to ``os.cpu_count()``).
+        cache_dir: Directory of the cache of the generated .c/.cpp files, the cache is disabled if not set.
+        cache_size: Maximum size of the cache (eg: "2G"), unbounded if not set.
+        pgo: Profile-guided optimization options.
+        shared_utility_module:
+            Fully qualified name of a module holding the Cython utility code of all the extensions,
+            generated and built with them (requires Cython >= 3.1).
+    """
+    jobs: int | None = None
+    cache_dir: str | None = None
+    cache_size: str | int | None = None
+    shared_utility_module: str | None = None
+    pgo: PgoConfig = field(default_factory=PgoConfig)
+
+
+@serde
+class _Tool:
+    cython_setuptools: CythonSetuptoolsConfig = field(default_factory=CythonSetuptoolsConfig)
+
+
 @serde
 class _PyProject:
-    cython_extensions: dict[str, CythonSetuptoolsOptions]
+    # Empty when the extensions are defined in the setup.cfg
+    cython_extensions: dict[str, CythonSetuptoolsOptions] = field(default_factory=dict)
+    tool: _Tool = field(default_factory=_Tool)
+
+
+def _read_pyproject_from_string(pyproject_content: str) -> _PyProject:
+    pyproject = tomllib.loads(pyproject_content)
+    defaults = pyproject.pop("cython_defaults", {})
+    if defaults:
+        extensions = pyproject.get("cython_extensions", {})
+        for name, options in extensions.items():
+            extensions[name] = _merge_defaults(defaults, options)
+    return from_dict(_PyProject, pyproject)
+
+
+def _merge_defaults(defaults: dict[str, Any], options: dict[str, Any]) -> dict[str, Any]:
+    # Like the [cython-defaults] section of setup.cfg: lists are extended, tables are updated
+    # and the other values of the extension override the defaults
+    merged = dict(options)
+    for key, default in defaults.items():
+        if key not in options:
+            merged[key] = default
+        elif isinstance(default, list) and isinstance(options[key], list):
+            merged[key] = default + options[key]
+        elif isinstance(default, dict) and isinstance(options[key], dict):
+            merged[key] = {**default, **options[key]}
+    return merged
 
 
 def _read_cython_setuptools_option_from_string(pyproject_content: str) -> dict[str, CythonSetuptoolsOptions]:
-    return from_toml(_PyProject, pyproject_content).cython_extensions
+    return _read_pyproject_from_string(pyproject_content).cython_extensions
 
 
 def read_cython_setuptools_option(pyproject_path: os.PathLike) -> dict[str, CythonSetuptoolsOptions]:
@@ -79,6 +174,21 @@ def read_cython_setuptools_option(pyproject_path: os.PathLike) -> dict[str, Cyth
     Returns:
         A dict where they key is the name of the extension and the value is the options
     """
+    return read_pyproject(pyproject_path)[0]
+
+
+def read_pyproject(pyproject_path: os.PathLike) -> tuple[dict[str, CythonSetuptoolsOptions], CythonSetuptoolsConfig]:
+    """
+    Read the pyproject.toml and return both the extensions options and the project wide options
+
+    Args:
+        pyproject_path: path to the pyproject.toml eg: 'toto/pyproject.toml'
+
+    Returns:
+        A tuple with the dict of extensions options (see ``read_cython_setuptools_option``)
+        and the options of the ``[tool.cython_setuptools]`` table
+    """
     with open(pyproject_path, encoding="utf-8") as f:
         toml = f.read()
-    return _read_cython_setuptools_option_from_string(toml)
+    pyproject = _read_pyproject_from_string(toml)
+    return pyproject.cython_extensions, pyproject.tool.cython_setuptools
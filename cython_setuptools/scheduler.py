@@ -0,0 +1,181 @@
+"""
+Limit the number of concurrent compilation jobs, cooperating with a GNU make jobserver when there is one,
+and their memory usage
+"""
+import contextlib
+import os
+import re
+import select
+import shlex
+import subprocess
+import sys
+import threading
+
+
+class JobServer:
+    """
+    Client of a GNU make jobserver (see https://www.gnu.org/software/make/manual/html_node/Job-Slots.html)
+
+    The process implicitly owns one job slot, a token has to be read from the jobserver
+    for every other concurrent job, and written back when the job is done.
+    """
+
+    def __init__(self, read_fd: int, write_fd: int, close_fds: bool = False):
+        self._read_fd = read_fd
+        self._write_fd = write_fd
+        self._close_fds = close_fds
+        self._lock = threading.Lock()
+        self._implicit_slot_free = True
+
+    @classmethod
+    def from_makeflags(cls, makeflags: str | None) -> "JobServer | None":
+        """
+        Connect to the jobserver advertised in ``MAKEFLAGS``
+
+        Args:
+            makeflags: the value of the ``MAKEFLAGS`` env variable
+
+        Returns:
+            The jobserver or None if there is none or if it is not reachable
+            (eg: the recipe has not been marked with ``+`` so the file descriptors are closed)
+        """
+        if not makeflags:
+            return None
+        auth = None
+        for flag in shlex.split(makeflags):
+            match = re.fullmatch(r"--jobserver-(?:auth|fds)=(.+)", flag)
+            if match:
+                auth = match.group(1)
+        if auth is None:
+            return None
+        try:
+            if auth.startswith("fifo:"):
+                read_fd = os.open(auth[len("fifo:"):], os.O_RDONLY | os.O_NONBLOCK)
+                os.set_blocking(read_fd, True)
+                write_fd = os.open(auth[len("fifo:"):], os.O_WRONLY)
+                return cls(read_fd, write_fd, close_fds=True)
+            read_fd, write_fd = (int(fd) for fd in auth.split(","))
+            os.fstat(read_fd)
+            os.fstat(write_fd)
+        except (OSError, ValueError):
+            return None
+        return cls(read_fd, write_fd)
+
+    @contextlib.contextmanager
+    def slot(self):
+        """
+        Context manager holding a job slot during a job
+        """
+        with self._lock:
+            implicit = self._implicit_slot_free
+            self._implicit_slot_free = False
+        if implicit:
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._implicit_slot_free = True
+            return
+        token = self._read_token()
+        try:
+            yield
+        finally:
+            os.write(self._write_fd, token)
+
+    def _read_token(self) -> bytes:
+        # The file descriptors inherited from make, or a fifo shared with other clients, may be non-blocking:
+        # wait until a token is available, another thread or process may take it first
+        while True:
+            try:
+                return os.read(self._read_fd, 1)
+            except BlockingIOError:
+                select.select([self._read_fd], [], [])
+
+    def close(self):
+        if self._close_fds:
+            os.close(self._read_fd)
+            os.close(self._write_fd)
+
+
+def get_makeflags_jobs(makeflags: str | None) -> int | None:
+    """
+    Returns:
+        The ``-j`` value of ``MAKEFLAGS`` or None if it is not set
+    """
+    for flag in shlex.split(makeflags or ""):
+        match = re.fullmatch(r"-j(\d+)|--jobs=(\d+)", flag)
+        if match:
+            return int(match.group(1) or match.group(2))
+    return None
+
+
+class MemoryBudget:
+    """
+    Limit the sum of the estimated peak memory of the concurrent jobs
+
+    The estimation of a job is its peak memory in previous builds, from ``history``.
+    Unknown jobs are estimated to a fair share of the budget: ``budget / jobs``.
+    A job is always started when no other job is running, even if it exceeds the budget.
+    """
+
+    def __init__(self, budget: int | None, history: dict[str, int], jobs: int):
+        """
+        Args:
+            budget: the memory budget in bytes, None means unlimited
+            history: the peak memory in bytes of the jobs of previous builds, updated by ``record``
+            jobs: the maximum number of concurrent jobs
+        """
+        self.budget = budget
+        self.history = history
+        self._default_estimate = 0 if budget is None else budget // max(jobs, 1)
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+    def estimate(self, key: str) -> int:
+        return self.history.get(key, self._default_estimate)
+
+    @contextlib.contextmanager
+    def reserve(self, key: str):
+        """
+        Context manager waiting until the job ``key`` fits in the budget, and holding its estimation during the job
+        """
+        if self.budget is None:
+            yield
+            return
+        estimate = self.estimate(key)
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_use == 0 or self._in_use + estimate <= self.budget)
+            self._in_use += estimate
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_use -= estimate
+                self._condition.notify_all()
+
+    def record(self, key: str, peak_memory: int):
+        """
+        Store the measured peak memory of the job ``key`` for the next builds
+        """
+        with self._condition:
+            self.history[key] = peak_memory
+
+
+def spawn_and_measure(cmd: list[str], env: dict[str, str] | None = None) -> tuple[int, int]:
+    """
+    Run a command and measure its peak resident memory, only available on POSIX platforms
+
+    Args:
+        cmd: the command
+        env: the environment of the command, default to ``os.environ``
+
+    Returns:
+        The exit code and the peak resident memory in bytes
+    """
+    process = subprocess.Popen(cmd, env=env)
+    _, status, rusage = os.wait4(process.pid, 0)
+    # Let Popen know the process has already been reaped
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in bytes on macOS and in KiB on the other platforms
+    peak_memory = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    return process.returncode, peak_memory
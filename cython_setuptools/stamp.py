@@ -0,0 +1,72 @@
+"""
+Records of the inputs and outputs of a build step, used to skip the step when nothing changed since its last run
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Any, Iterable
+
+from .common import DIGEST_SIZE, RACY_MTIME_DELAY_NS, read_json, write_json
+
+
+def get_key(content: Any) -> str:
+    """
+    Returns:
+        A digest of ``content``, which is serialized as JSON (objects that are not serializable are converted to str)
+    """
+    serialized = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.blake2b(serialized.encode("utf-8"), digest_size=DIGEST_SIZE).hexdigest()
+
+
+def get_file_signatures(paths: Iterable[str]) -> dict[str, list[int] | None]:
+    """
+    Returns:
+        The size, mtime and inode of each file, None for the missing files
+    """
+    signatures = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            signatures[path] = None
+        else:
+            signatures[path] = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+    return signatures
+
+
+def read_stamp(path: os.PathLike, key: str) -> dict | None:
+    """
+    Read the stamp written by ``write_stamp``
+
+    Returns:
+        The content of the stamp if it has been written with the same key and none of its files changed, else None
+    """
+    stamp = read_json(path)
+    if not isinstance(stamp, dict) or stamp.get("key") != key:
+        return None
+    if get_file_signatures(stamp["files"]) != stamp["files"]:
+        return None
+    return stamp["content"]
+
+
+def write_stamp(path: os.PathLike, key: str, inputs: Iterable[str], outputs: Iterable[str] = (), content: Any = None):
+    """
+    Record the inputs and outputs of a build step
+
+    Nothing is recorded if an input has been modified too recently for its mtime to be trusted:
+    the next run will not be skipped and will record it.
+
+    Args:
+        path: path of the stamp
+        key: digest of everything else the step depends on (see ``get_key``)
+        inputs: the files read by the step
+        outputs: the files written by the step
+        content: the result of the step, returned by ``read_stamp``
+    """
+    signatures = get_file_signatures(inputs)
+    now = time.time_ns()
+    if any(signature is not None and now - signature[1] <= RACY_MTIME_DELAY_NS for signature in signatures.values()):
+        return
+    signatures.update(get_file_signatures(outputs))
+    write_json(path, {"key": key, "files": signatures, "content": content})
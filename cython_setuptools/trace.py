@@ -0,0 +1,101 @@
+"""
+Record where the build time goes in the Chrome trace event format
+
+Set the ``CYTHON_SETUPTOOLS_TRACE`` env variable to the path of the trace file, which is written when the process exits.
+Open it with ``chrome://tracing`` or https://ui.perfetto.dev. The spans are:
+
+- ``config``: parsing of the ``pyproject.toml`` or ``setup.cfg``
+- ``pkg-config``: resolution of the pkg-config flags of an extension
+- ``staleness``: check of the generated files of an extension, its ``reason`` argument tells why it is cythonized
+- ``cythonize``: cythonization of an extension, in a worker process when several jobs are used
+- ``compile`` and ``link``: compilation of a translation unit and link of an extension by ``build_ext``
+- ``ninja``: build of the extensions by the ninja backend of ``build_ext``
+- ``pgo``: builds and training of the profile-guided optimization
+"""
+import atexit
+import contextlib
+import os
+import threading
+import time
+
+from .common import write_json
+
+
+class Tracer:
+    """
+    Collect the spans of a build and write them as Chrome trace events
+    """
+
+    def __init__(self, path: os.PathLike):
+        self.path = path
+        self.events = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, category: str, name: str, **args):
+        """
+        Context manager recording a span, the yielded dict can be updated to add arguments to the span
+        """
+        start_ns = time.perf_counter_ns()
+        try:
+            yield args
+        finally:
+            self.add_span(category, name, start_ns, time.perf_counter_ns(), **args)
+
+    def add_span(
+        self, category: str, name: str, start_ns: int, end_ns: int, pid: int | None = None, tid: int | None = None, **args
+    ):
+        """
+        Record a span measured with ``time.perf_counter_ns``, possibly in another process
+        """
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start_ns / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": self._pid if pid is None else pid,
+            "tid": threading.get_native_id() if tid is None else tid,
+            "args": args,
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def save(self):
+        # Forked worker processes inherit the tracer, only the main process writes the trace
+        if os.getpid() == self._pid:
+            with self._lock:
+                write_json(self.path, {"traceEvents": self.events, "displayTimeUnit": "ms"})
+
+
+class NullTracer:
+    """
+    Tracer used when tracing is disabled
+    """
+
+    @contextlib.contextmanager
+    def span(self, category: str, name: str, **args):
+        yield args
+
+    def add_span(self, *args, **kwargs):
+        pass
+
+
+_tracer = None
+
+
+def get_tracer() -> Tracer | NullTracer:
+    """
+    Returns:
+        The tracer of the process, a ``NullTracer`` if the ``CYTHON_SETUPTOOLS_TRACE`` env variable is not set
+    """
+    global _tracer
+    if _tracer is None:
+        path = os.environ.get("CYTHON_SETUPTOOLS_TRACE")
+        if path:
+            _tracer = Tracer(path)
+            atexit.register(_tracer.save)
+        else:
+            _tracer = NullTracer()
+    return _tracer
@@ -0,0 +1,87 @@
+"""
+Unity builds of the ``build_ext`` command
+
+The hand-written C/C++ sources of an extension with ``unity_build`` are compiled in batches: each batch is a generated
+translation unit including its sources, so their common headers are parsed once per batch instead of once per source.
+The sources generated by Cython and the ``unity_exclude`` ones, eg: defining conflicting static functions or macros,
+are compiled on their own.
+"""
+import fnmatch
+import os
+
+# The languages whose sources can be batched, with the extension of their generated translation units
+_UNITY_EXTENSIONS = {"c": ".c", "c++": ".cpp"}
+_CYTHON_HEADER = b"/* Generated by Cython"
+
+
+def get_unity_sources(
+    sources: list[str], unity_dir: str, batch_size: int, exclude: list[str], language_map: dict[str, str]
+) -> list[str]:
+    """
+    Replace the sources by the translation units of their batches, written in ``unity_dir``
+
+    Args:
+        sources: the sources of an extension
+        unity_dir: the directory of the generated translation units of the extension
+        batch_size: the maximum number of sources in a batch, 0 to batch all the sources of a language together
+        exclude: glob patterns of the sources that are not batched, matched against their path or their name
+        language_map: the language of each source extension (see ``CCompiler.language_map``)
+
+    Returns:
+        The sources that are not batched, followed by the translation units of the batches
+    """
+    if batch_size < 0:
+        raise ValueError(f"Invalid unity_batch_size {batch_size}, expected a positive number or 0")
+    kept = []
+    batched = {language: [] for language in _UNITY_EXTENSIONS}
+    for source in sources:
+        language = language_map.get(os.path.splitext(source)[1])
+        if language not in batched or _is_excluded(source, exclude) or is_cython_generated(source):
+            kept.append(source)
+        else:
+            batched[language].append(source)
+    unity_sources = []
+    for language, language_sources in batched.items():
+        size = batch_size or len(language_sources) or 1
+        for index in range(0, len(language_sources), size):
+            batch = language_sources[index:index + size]
+            if len(batch) == 1:
+                kept += batch
+                continue
+            # eg: unity_cpp_0.cpp, distinct from unity_c_0.c since their objects have the same directory
+            extension = _UNITY_EXTENSIONS[language]
+            unity_path = os.path.join(unity_dir, f"unity_{extension[1:]}_{index // size}{extension}")
+            _write_unity_source(unity_path, batch)
+            unity_sources.append(unity_path)
+    return kept + unity_sources
+
+
+def is_cython_generated(path: str) -> bool:
+    """
+    Returns:
+        Whether a C/C++ source has been generated by Cython, whose module initialization can not be batched
+    """
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(_CYTHON_HEADER)) == _CYTHON_HEADER
+    except OSError:
+        return False
+
+
+def _is_excluded(source: str, exclude: list[str]) -> bool:
+    return any(fnmatch.fnmatch(source, pattern) or fnmatch.fnmatch(os.path.basename(source), pattern) for pattern in exclude)
+
+
+def _write_unity_source(path: str, sources: list[str]):
+    lines = ["/* Generated by cython_setuptools: unity build of the sources below */"]
+    lines += [f'#include "{os.path.abspath(source)}"' for source in sources]
+    content = "\n".join(lines) + "\n"
+    try:
+        with open(path, encoding="utf-8") as f:
+            if f.read() == content:  # Keep its mtime, so that it is not compiled again
+                return
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
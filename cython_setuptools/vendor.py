@@ -1,19 +1,23 @@
 import argparse
 import configparser
+import functools
 import os
 import os.path as op
+from pathlib import Path
 import shlex
-import subprocess
 
 import setuptools
 
-from .common import C_EXT, CPP_EXT, CYTHON_EXT, convert_to_bool, get_cpp_std_flag
+from .common import C_EXT, CPP_EXT, CYTHON_EXT, convert_to_bool, get_cpp_std_flag, get_profile_flags
+from .ninja import is_ninja_enabled
+from .pkgconfig_wrapper import get_flags_from_env
+from .trace import get_tracer
 
 DEFAULTS_SECTION = "cython-defaults"
 MODULE_SECTION_PREFIX = "cython-module:"
 
 
-def setup(original_setup_file: str, cythonize: bool = True, **kwargs):
+def setup(original_setup_file: str, cythonize: bool = True, build_ext: bool = False, **kwargs):
     """
     Drop-in replacement for :func:`setuptools.setup`, adding Cython niceties.
 
@@ -22,6 +26,9 @@ def setup(original_setup_file: str, cythonize: bool = True, **kwargs):
         cythonize (bool): The *cythonize* argument controls the default mode of operation:
                           set it to ``True`` if you don't distribute C files with your
                           package (the default), and ``False`` if you do.
+        build_ext (bool): Set it to ``True`` to build the modules with the
+                          :class:`cython_setuptools.build_ext` command instead of the
+                          one of setuptools (unless ``cmdclass`` sets another one).
 
     Cython modules are described in setup.cfg, for example::
 
@@ -69,6 +76,21 @@ def setup(original_setup_file: str, cythonize: bool = True, **kwargs):
     cpp_std
         Typically "11", "14", "17" or "20".
 
+    profile
+        Optimization profile: "release" (optimized with LTO), "native"
+        (release for the CPU of the host), "size" (optimized for size, unused
+        sections removed) or "debug" (unoptimized with debug symbols). The
+        flags of the compiler are added before ``extra_compile_args`` and
+        ``extra_link_args``. The ``CYTHON_SETUPTOOLS_PROFILE`` environment
+        variable overrides the profile of all the modules.
+
+    lto
+        Link-time optimization: true, false or thin (ThinLTO of clang, gcc
+        uses its own parallel LTO), default to true with the release and
+        native profiles. The same mode is used to compile and to link. The
+        ``CYTHON_SETUPTOOLS_LTO`` environment variable overrides it for all
+        the modules.
+
     pkg_config_packages
         A list of ``pkg-config`` package names to link with the module.
 
@@ -145,34 +167,154 @@ def setup(original_setup_file: str, cythonize: bool = True, **kwargs):
 
         DEBUG=1 python setup.py build_ext --inplace
 
+    Cython modules are cythonized in parallel, by default using as many
+    processes as CPUs. The number of processes can be set with the
+    ``CYTHON_SETUPTOOLS_JOBS`` environment variable::
+
+        CYTHON_SETUPTOOLS_JOBS=4 python setup.py build_ext --inplace
+
+    Errors are reported for every failing module at the end of the
+    cythonization instead of stopping at the first one.
+
+    Only the modules whose generated files do not match their .pyx, the
+    .pxd/.pxi they cimport or include, the Cython version or the compiler
+    directives are cythonized, the fingerprints are stored in
+    ``.cython_setuptools_manifest.json`` next to the ``setup.py``.
+
+    The generated C/C++ files can be cached in a directory shared between
+    checkouts, with an optional maximum size (the least recently used files are
+    removed first)::
+
+        CYTHON_SETUPTOOLS_CACHE_DIR=~/.cache/cython_setuptools \\
+        CYTHON_SETUPTOOLS_CACHE_SIZE=2G python setup.py build_ext --inplace
+
+    With ``setup(build_ext=True)`` or the ``CYTHON_SETUPTOOLS_BUILD_EXT``
+    environment variable, the ``build_ext`` command is replaced by
+    :class:`cython_setuptools.build_ext`, which can reuse the object files
+    compiled by previous builds from a cache directory::
+
+        CYTHON_SETUPTOOLS_BUILD_EXT=1 \\
+        CYTHON_SETUPTOOLS_OBJECT_CACHE_DIR=~/.cache/cython_setuptools_objects \\
+        python setup.py build_ext --inplace
+
+    The time spent parsing the configuration, running ``pkg-config``,
+    cythonizing, compiling and linking each module can be traced in the Chrome
+    trace event format (see :mod:`cython_setuptools.trace`)::
+
+        CYTHON_SETUPTOOLS_TRACE=trace.json python setup.py build_ext --inplace
+
+    The ``pkg-config`` results are cached in
+    ``build/cython_setuptools/pkg_config.json`` until the ``.pc`` files
+    change, the ``CYTHON_SETUPTOOLS_PKG_CONFIG_CACHE`` environment variable
+    sets another path (eg: ``~/.cache/cython_setuptools/pkg_config.json`` to
+    share it between projects) or disables the cache when empty.
+    With ``CYTHON_SETUPTOOLS_PKG_CONFIG_BACKEND=python``, the ``.pc`` files are
+    parsed without running ``pkg-config``, which is still used if a package
+    can not be resolved.
+
+    With ``CYTHON_SETUPTOOLS_NINJA=1``, the ``build_ext`` command of
+    cython_setuptools writes a ``build.ninja`` and runs ninja, which
+    cythonizes, compiles and links only what changed according to the
+    dependencies reported by Cython and the compiler::
+
+        CYTHON_SETUPTOOLS_BUILD_EXT=1 CYTHON_SETUPTOOLS_NINJA=1 python setup.py build_ext --inplace
+
     """
     this_dir = op.dirname(original_setup_file)
     setup_cfg_file = op.join(this_dir, "setup.cfg")
     cythonize = convert_to_bool(os.environ.get("CYTHONIZE", cythonize))
+    build_ext = convert_to_bool(os.environ.get("CYTHON_SETUPTOOLS_BUILD_EXT", build_ext))
     profile_cython = convert_to_bool(os.environ.get("PROFILE_CYTHON", False))
     debug = convert_to_bool(os.environ.get("DEBUG", False))
     if op.exists(setup_cfg_file):
         # Create Cython Extension objects
-        with open(setup_cfg_file) as fp:
+        with get_tracer().span("config", "setup.cfg"), open(setup_cfg_file) as fp:
             parsed_setup_cfg = parse_setup_cfg(fp, cythonize=cythonize)
         cython_ext_modules = create_cython_ext_modules(
             parsed_setup_cfg, profile_cython=profile_cython, debug=debug
         )
 
-        if cythonize:
+        # The ninja backend of build_ext cythonizes the .pyx itself
+        if cythonize and not (build_ext and is_ninja_enabled()):
             try:
-                from Cython import Build
+                from Cython import Build  # noqa: F401
             except ImportError:
                 pass
             else:
-                cython_ext_modules = Build.cythonize(cython_ext_modules, force=True, compiler_directives={'profile': profile_cython})
+                cython_ext_modules = _cythonize(cython_ext_modules, profile_cython, this_dir)
 
         ext_modules = kwargs.setdefault("ext_modules", [])
         ext_modules.extend(cython_ext_modules)
+        if build_ext:
+            from .command import build_ext as build_ext_command
+
+            kwargs.setdefault("cmdclass", {}).setdefault("build_ext", build_ext_command)
 
     setuptools.setup(**kwargs)
 
 
+def _cythonize(cython_ext_modules, profile_cython, project_dir):
+    from .cache import get_file_cache
+    from .cythonize import cythonize_extensions
+    from .fingerprint import (
+        HASH_CACHE_NAME,
+        HashCache,
+        create_dependency_tree,
+        fingerprint_generated_files,
+        get_staleness_reason,
+        iter_cython_sources,
+    )
+    from .manifest import MANIFEST_NAME, Manifest
+
+    compiler_directives = {"profile": profile_cython}
+    manifest = Manifest(op.join(project_dir, MANIFEST_NAME))
+    hash_cache = HashCache(op.join(project_dir, HASH_CACHE_NAME))
+    # Like create_extensions, only the modules whose generated files are outdated are cythonized,
+    # the other ones are built from their generated files
+    directives = {ext.name: {**compiler_directives, **getattr(ext, "cython_directives", {})} for ext in cython_ext_modules}
+    stale = []
+    for ext in cython_ext_modules:
+        with get_tracer().span("staleness", ext.name) as args:
+            args["reason"] = get_staleness_reason(
+                ext.sources, ext.language, directives[ext.name], manifest, hash_cache, include_dirs=ext.include_dirs
+            )
+        if args["reason"] is None:
+            outputs = dict(iter_cython_sources(ext.sources, ext.language))
+            ext.sources = [os.fspath(outputs.get(Path(source), source)) for source in ext.sources]
+        else:
+            stale.append(ext)
+    if stale:
+        generated_files = {
+            ext.name: fingerprint_generated_files(
+                ext.sources,
+                ext.language,
+                directives[ext.name],
+                create_dependency_tree(ext.include_dirs),
+                hash_cache,
+                include_dirs=ext.include_dirs,
+            )
+            for ext in stale
+        }
+        cythonized = cythonize_extensions(
+            stale,
+            cache=get_file_cache(None, None),
+            generated_files=generated_files,
+            # The fingerprints already tell that these modules are outdated, whatever the mtimes of their files
+            force=True,
+            compiler_directives=compiler_directives,
+        )
+        for ext in cythonized:
+            for generated_file in generated_files[ext.name]:
+                manifest.update(
+                    generated_file.source, generated_file.output, generated_file.fingerprint, generated_file.dependencies
+                )
+        manifest.save()
+        cythonized_by_name = {ext.name: ext for ext in cythonized}
+        cython_ext_modules = [cythonized_by_name.get(ext.name, ext) for ext in cython_ext_modules]
+    hash_cache.save()
+    return cython_ext_modules
+
+
 def create_cython_ext_modules(cython_modules, profile_cython=False, debug=False):
     """
     Create :class:`~setuptools.extension.Extension` objects from
@@ -214,6 +356,10 @@ def create_cython_ext_modules(cython_modules, profile_cython=False, debug=False)
         # Remove custom cython_setuptools options
         if "cpp_std" in kwargs:
             del kwargs["cpp_std"]
+        if "profile" in kwargs:
+            del kwargs["profile"]
+        if "lto" in kwargs:
+            del kwargs["lto"]
         if "tags" in kwargs:
             del kwargs["tags"]
         ext = Extension(**kwargs)
@@ -256,9 +402,7 @@ def extract_args(args_str, args):
     *extracted_args* is a dict containing the extracted arguments, and
     *remaining_args_str* a string containing the remaining arguments.
     """
-    parser = argparse.ArgumentParser()
-    for arg in args:
-        parser.add_argument(arg, action=_StoreOrderedArgs)
+    parser = _get_args_parser(tuple(args))
     args_list = shlex.split(args_str)
     try:
         args_ns, other_args = parser.parse_known_args(args_list)
@@ -271,6 +415,14 @@ def extract_args(args_str, args):
     return extracted_args, " ".join(other_args)
 
 
+@functools.lru_cache
+def _get_args_parser(args):
+    parser = argparse.ArgumentParser()
+    for arg in args:
+        parser.add_argument(arg, action=_StoreOrderedArgs)
+    return parser
+
+
 def _expand_cython_modules(config, cythonize, pkg_config, base_dir):
     ret = {}
     for section in config.sections():
@@ -304,6 +456,11 @@ def _expand_one_cython_module(config, section, cythonize, pkg_config, base_dir):
     module["extra_link_args"] = (
         _get_config_list(config, section, "extra_link_args") + pc_extra_link_args
     )
+    profile = os.environ.get("CYTHON_SETUPTOOLS_PROFILE") or _get_config_opt(config, section, "profile", None)
+    lto = os.environ.get("CYTHON_SETUPTOOLS_LTO") or _get_config_opt(config, section, "lto", None)
+    compile_flags, link_flags = get_profile_flags(profile, lto)
+    module["extra_compile_args"] = compile_flags + module["extra_compile_args"]
+    module["extra_link_args"] = link_flags + module["extra_link_args"]
     module["sources"] = _expand_sources(config, section, module["language"], cythonize)
     include_dirs = _get_config_list(config, section, "include_dirs")
     include_dirs += pc_include_dirs
@@ -369,9 +526,11 @@ def _expand_pkg_config_pkgs(config, section, pkg_config):
 
 
 def _run_pkg_config(pkg_names, command, env):
-    return subprocess.check_output(["pkg-config", command] + pkg_names, env=env).decode(
-        "utf8"
-    )
+    # Memoized and persisted, both commands are resolved by the first call
+    build_flags = get_flags_from_env(pkg_names, env)
+    if command == "--cflags":
+        return shlex.join(build_flags.compile_flags)
+    return shlex.join(build_flags.link_flags)
 
 
 def _expand_sources(config, section, language, cythonize):
@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def _no_persistent_pkg_config_cache(monkeypatch):
+    # Do not read or write the pkg-config cache of the user
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_PKG_CONFIG_CACHE", "")
@@ -0,0 +1,93 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+from setuptools import Extension
+
+from cython_setuptools.bundle import bundle_extensions, get_stub_path
+from cython_setuptools.extentions import create_extensions
+
+PYPROJECT = """
+[cython_defaults]
+bundle = "pkg._native"
+cython_directives = { language_level = 3 }
+
+[cython_extensions.a]
+name = "pkg.a"
+sources = ["pkg/a.pyx"]
+
+[cython_extensions.b]
+name = "pkg.b"
+sources = ["pkg/b.pyx"]
+
+[cython_extensions.c]
+name = "pkg.c"
+sources = ["pkg/c.pyx"]
+extra_compile_args = ["-DC"]
+bundle = ""
+"""
+
+SETUP = """
+from setuptools import setup
+from cython_setuptools import build_ext, create_extensions
+
+setup(name="pkg", packages=["pkg"], ext_modules=create_extensions(__file__), cmdclass={"build_ext": build_ext})
+"""
+
+
+def test_bundle_extensions(tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    extensions = [
+        Extension("pkg.a", ["pkg/a.c"], extra_compile_args=["-O2"], libraries=["m"]),
+        Extension("pkg.b", ["pkg/b.c"], extra_compile_args=["-O2"], libraries=["m", "z"]),
+        Extension("pkg.c", ["pkg/c.c"]),
+    ]
+    extensions[0].unity_build = True
+    bundled = bundle_extensions(extensions, ["pkg._native", "pkg._native", None])
+    assert [extension.name for extension in bundled] == ["pkg._native", "pkg.c"]
+    assert bundled[0].sources == ["pkg/a.c", "pkg/b.c", get_stub_path("pkg._native")]
+    assert bundled[0].extra_compile_args == ["-O2"]
+    assert bundled[0].libraries == ["m", "z"]
+    assert bundled[0].export_symbols == ["PyInit_a", "PyInit_b"]
+    # Only the sources of the extensions with a unity build are batched
+    assert (bundled[0].unity_build, bundled[0].unity_exclude) == (True, ["pkg/b.c", get_stub_path("pkg._native")])
+    assert "('pkg.a', 'pkg.b')" in (tmp_path / "pkg" / "_native.bundle.c").read_text()
+
+
+def test_bundle_init_conflict(tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    extensions = [Extension("pkg.a", ["pkg/a.c"]), Extension("other.a", ["other/a.c"])]
+    with pytest.raises(ValueError, match="both define PyInit_a"):
+        bundle_extensions(extensions, ["pkg._native", "pkg._native"])
+
+
+def test_bundle_compile_options_conflict(tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    extensions = [
+        Extension("pkg.a", ["pkg/a.c"], define_macros=[("A", "1")]),
+        Extension("pkg.b", ["pkg/b.c"], define_macros=[("B", "1")]),
+    ]
+    with pytest.raises(ValueError, match="different define_macros"):
+        bundle_extensions(extensions, ["pkg._native", "pkg._native"])
+
+
+def test_bundle_build(tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    package_dir = tmp_path / "pkg"
+    package_dir.mkdir()
+    (package_dir / "__init__.py").write_text("from . import _native  # noqa: F401\n")
+    for name in "abc":
+        (package_dir / f"{name}.pyx").write_text(f"def {name}():\n    return {name!r}\n")
+    (tmp_path / "pyproject.toml").write_text(PYPROJECT)
+    (tmp_path / "setup.py").write_text(SETUP)
+    env = {**os.environ, "PYTHONPATH": str(Path(__file__).parents[1])}
+    subprocess.run([sys.executable, "setup.py", "-q", "build_ext", "--inplace"], check=True, env=env)
+    assert len(list(package_dir.glob("*.so")) + list(package_dir.glob("*.pyd"))) == 2
+
+    code = "import pkg.a, pkg.b, pkg.c; print(pkg.a.a() + pkg.b.b() + pkg.c.c(), pkg.a.__file__ == pkg._native.__file__)"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    assert output.split() == ["abc", "True"]
+    # The bundle is restored from the stamp of the extensions
+    assert [extension.name for extension in create_extensions(str(tmp_path / "setup.py"))] == ["pkg._native", "pkg.c"]
@@ -0,0 +1,39 @@
+import os
+from pathlib import Path
+
+from cython_setuptools.cache import FileCache, get_file_cache
+
+
+def test_store_and_restore(tmp_path: Path):
+    cache = FileCache(tmp_path / "cache")
+    source = tmp_path / "a.c"
+    source.write_text("int a;")
+    destination = tmp_path / "b.c"
+    assert not cache.restore("abcdef", destination)
+    cache.store("abcdef", source)
+    assert cache.restore("abcdef", destination)
+    assert destination.read_text() == "int a;"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_evict_least_recently_used(tmp_path: Path):
+    cache = FileCache(tmp_path / "cache", max_size=20)
+    source = tmp_path / "a.c"
+    source.write_text("0123456789")
+    for i, key in enumerate(("aa00", "bb00", "cc00")):
+        cache.store(key, source)
+        os.utime(cache._entry_path(key), (i, i))
+    assert cache.restore("aa00", tmp_path / "restored.c")
+    cache.evict()
+    assert cache.restore("aa00", tmp_path / "restored.c")
+    assert not cache.restore("bb00", tmp_path / "restored.c")
+    assert cache.restore("cc00", tmp_path / "restored.c")
+
+
+def test_get_file_cache(tmp_path: Path, monkeypatch):
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_CACHE_DIR", raising=False)
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_CACHE_SIZE", raising=False)
+    assert get_file_cache(None, None) is None
+    assert get_file_cache(str(tmp_path), "1K").max_size == 1024
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_CACHE_DIR", str(tmp_path / "env"))
+    assert get_file_cache(None, None).directory == str(tmp_path / "env")
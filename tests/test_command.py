@@ -0,0 +1,305 @@
+import json
+import os
+from pathlib import Path
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from setuptools import Distribution, Extension
+from setuptools._distutils.errors import DistutilsSetupError
+from setuptools.command.build_ext import build_ext as setuptools_build_ext
+from setuptools.extension import Library
+
+from cython_setuptools import command as command_module
+from cython_setuptools.command import build_ext
+from cython_setuptools.common import get_profile_flags
+from cython_setuptools.pgo import get_pgo_flags
+
+TESTS_DIR = Path(__file__).parent
+
+
+def _create_extension(name: str = "foo") -> Extension:
+    return Extension(
+        name,
+        sources=[str(TESTS_DIR / "pypkg" / "foo.c"), str(TESTS_DIR / "src" / "foo.c")],
+        include_dirs=[str(TESTS_DIR / "src")],
+    )
+
+
+def _run_build_ext(tmp_path: Path, extensions: list[Extension] | None = None, **options) -> build_ext:
+    extensions = [_create_extension()] if extensions is None else extensions
+    distribution = Distribution({"ext_modules": extensions, "cmdclass": {"build_ext": build_ext}})
+    command = distribution.get_command_obj("build_ext")
+    command.build_lib = str(tmp_path / "lib")
+    command.build_temp = str(tmp_path / "temp")
+    command.force = True
+    for name, value in options.items():
+        setattr(command, name, value)
+    distribution.run_command("build_ext")
+    return command
+
+
+def test_build_without_object_cache(tmp_path: Path, monkeypatch):
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_OBJECT_CACHE_DIR", raising=False)
+    command = _run_build_ext(tmp_path)
+    assert command._object_cache is None
+    assert len(list((tmp_path / "lib").iterdir())) == 1
+
+
+@pytest.mark.skipif(platform.system() == "Windows", reason="The object cache needs a preprocessor")
+def test_object_cache(tmp_path: Path):
+    cache_dir = str(tmp_path / "cache")
+    command = _run_build_ext(tmp_path / "first", object_cache_dir=cache_dir)
+    assert (command._object_cache.hits, command._object_cache.misses) == (0, 2)
+    command = _run_build_ext(tmp_path / "second", object_cache_dir=cache_dir)
+    assert (command._object_cache.hits, command._object_cache.misses) == (2, 0)
+    assert len(list((tmp_path / "second" / "lib").iterdir())) == 1
+
+
+def test_parallel_build(tmp_path: Path):
+    _run_build_ext(tmp_path, [_create_extension("first.foo"), _create_extension("second.foo")], parallel=4)
+    assert len(list((tmp_path / "lib" / "first").iterdir())) == 1
+    assert len(list((tmp_path / "lib" / "second").iterdir())) == 1
+
+
+def test_parallel_build_optional_failure(tmp_path: Path):
+    broken = Extension("broken", sources=[str(tmp_path / "missing.c")], optional=True)
+    _run_build_ext(tmp_path, [broken, _create_extension()], parallel=2)
+    assert [path.name.split(".")[0] for path in (tmp_path / "lib").iterdir()] == ["foo"]
+
+
+def test_parallel_build_library(tmp_path: Path, monkeypatch):
+    # setuptools swaps its compiler to build the libraries, it must not run while other extensions are compiled
+    threads = []
+    build_extension = setuptools_build_ext.build_extension
+
+    def _record(self, ext):
+        threads.append(threading.current_thread())
+        build_extension(self, ext)
+
+    monkeypatch.setattr(setuptools_build_ext, "build_extension", _record)
+    library = Library("libfoo", sources=[str(TESTS_DIR / "src" / "foo.c")], include_dirs=[str(TESTS_DIR / "src")])
+    _run_build_ext(tmp_path, [_create_extension("first.foo"), library, _create_extension("second.foo")], parallel=4)
+    assert threads == [threading.main_thread()]
+    assert len(list((tmp_path / "lib" / "first").iterdir())) == 1
+    assert len(list((tmp_path / "lib" / "second").iterdir())) == 1
+
+
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason="The memory is only measured on POSIX platforms")
+def test_memory_history(tmp_path: Path, monkeypatch):
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_MEMORY_HISTORY", raising=False)
+    _run_build_ext(tmp_path, memory_budget="1G")
+    history = json.loads((tmp_path / "temp" / "memory_history.json").read_text())
+    assert set(history) == {
+        str(TESTS_DIR / "pypkg" / "foo.c"),
+        str(TESTS_DIR / "src" / "foo.c"),
+        "link:foo",
+    }
+    assert all(peak_memory > 0 for peak_memory in history.values())
+
+
+def test_skip_unchanged_build(tmp_path: Path, monkeypatch):
+    sources_dir = tmp_path / "sources"
+    shutil.copytree(TESTS_DIR / "src", sources_dir)
+    shutil.copy(TESTS_DIR / "pypkg" / "foo.c", sources_dir / "foo_module.c")
+    old = time.time() - 10
+    for path in sources_dir.iterdir():
+        os.utime(path, (old, old))
+
+    def create_extension():
+        # build_ext modifies the extensions, the stamp is computed from the extensions given to setup
+        return Extension(
+            "foo", sources=[str(sources_dir / "foo_module.c"), str(sources_dir / "foo.c")], include_dirs=[str(sources_dir)]
+        )
+
+    built = []
+    build_extensions = build_ext.build_extensions
+
+    def _record(self):
+        built.append(self)
+        build_extensions(self)
+
+    monkeypatch.setattr(build_ext, "build_extensions", _record)
+    _run_build_ext(tmp_path, [create_extension()], force=False)
+    _run_build_ext(tmp_path, [create_extension()], force=False)
+    assert len(built) == 1
+
+    _run_build_ext(tmp_path, [create_extension()], force=False, define="NEW_MACRO")
+    assert len(built) == 2
+
+    (sources_dir / "foo.c").write_text((sources_dir / "foo.c").read_text() + "\n")
+    os.utime(sources_dir / "foo.c", (old, old))
+    _run_build_ext(tmp_path, [create_extension()], force=False)
+    assert len(built) == 3
+
+
+def _create_pyx_extension(tmp_path: Path) -> Extension:
+    sources_dir = tmp_path / "sources"
+    shutil.copytree(TESTS_DIR / "src", sources_dir)
+    shutil.copy(TESTS_DIR / "pypkg" / "foo.pyx", sources_dir / "foo_module.pyx")
+    return Extension(
+        "foo", sources=[str(sources_dir / "foo_module.pyx"), str(sources_dir / "foo.c")], include_dirs=[str(sources_dir)]
+    )
+
+
+@pytest.mark.skipif(shutil.which("ninja") is None, reason="ninja is not installed")
+def test_ninja_build(tmp_path: Path, monkeypatch):
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_NINJA", raising=False)
+    extension = _create_pyx_extension(tmp_path)
+    _run_build_ext(tmp_path, [extension], force=False, ninja=True)
+    assert (tmp_path / "temp" / "build.ninja").exists()
+    assert (tmp_path / "sources" / "foo_module.c").exists()
+    (ext_path,) = (tmp_path / "lib").iterdir()
+    built = ext_path.stat().st_mtime_ns
+
+    _run_build_ext(tmp_path, [extension], force=False, ninja=True)
+    assert ext_path.stat().st_mtime_ns == built
+
+    # The header is only known from the depfiles
+    time.sleep(0.01)
+    (tmp_path / "sources" / "foo.h").write_text((tmp_path / "sources" / "foo.h").read_text() + "\n")
+    _run_build_ext(tmp_path, [extension], force=False, ninja=True)
+    assert ext_path.stat().st_mtime_ns > built
+
+
+def test_ninja_fallback(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_NINJA", "1")
+    monkeypatch.setattr(command_module, "find_ninja", lambda: None)
+    _run_build_ext(tmp_path, [_create_pyx_extension(tmp_path)])
+    assert not (tmp_path / "temp" / "build.ninja").exists()
+    assert len(list((tmp_path / "lib").iterdir())) == 1
+
+
+@pytest.mark.skipif(shutil.which("gcc") is None, reason="The test uses the profile-guided optimization of gcc")
+def test_pgo_build(tmp_path: Path, monkeypatch, capfd):
+    monkeypatch.setenv("CC", "gcc")
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_OBJECT_CACHE_DIR", raising=False)
+    extension = _create_extension()
+    _run_build_ext(tmp_path, [extension], pgo=True, pgo_command=f"{shlex.quote(sys.executable)} -c 'import foo; foo.bar()'")
+    assert capfd.readouterr().out.splitlines().count("2") == 1
+    # The instrumented extension has been run by the training
+    assert list((tmp_path / "temp" / "pgo" / "foo").rglob("*.gcda"))
+    assert len(list((tmp_path / "lib").iterdir())) == 1
+    # The flags of the extension are restored
+    assert extension.extra_compile_args == []
+
+
+def test_pgo_use_without_clang_profile(tmp_path: Path):
+    # The training did not load the extension, clang would fail without the merged profile
+    assert get_pgo_flags("use", str(tmp_path / "foo"), "clang") == []
+    (tmp_path / "foo").mkdir()
+    (tmp_path / "foo" / "default.profdata").touch()
+    assert get_pgo_flags("use", str(tmp_path / "foo"), "clang")[0] == f"-fprofile-use={tmp_path / 'foo' / 'default.profdata'}"
+
+
+@pytest.mark.skipif(shutil.which("clang") is None, reason="The test uses the profile-guided optimization of clang")
+def test_pgo_build_clang_partial_training(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("CC", "clang")
+    monkeypatch.setenv("LDSHARED", "clang -shared")
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_OBJECT_CACHE_DIR", raising=False)
+    extensions = [_create_extension("first.foo"), _create_extension("second.foo")]
+    # Only the first extension is imported by the training
+    _run_build_ext(tmp_path, extensions, pgo=True, pgo_command=f"{shlex.quote(sys.executable)} -c 'import first.foo'")
+    assert (tmp_path / "temp" / "pgo" / "first.foo" / "default.profdata").exists()
+    assert not (tmp_path / "temp" / "pgo" / "second.foo").exists()
+    assert len(list((tmp_path / "lib" / "second").iterdir())) == 1
+
+
+def test_pgo_without_training_command(tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(DistutilsSetupError, match="training command"):
+        _run_build_ext(tmp_path, pgo=True)
+
+
+@pytest.mark.skipif(shutil.which("gcc-ar") is None, reason="The test uses the link-time optimization of gcc")
+def test_lto_build(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("CC", "gcc")
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_OBJECT_CACHE_DIR", raising=False)
+    extension = _create_extension()
+    extension.extra_compile_args, extension.extra_link_args = get_profile_flags(None, True)
+    command = _run_build_ext(tmp_path, [extension])
+    assert len(list((tmp_path / "lib").iterdir())) == 1
+    assert os.path.basename(command.compiler.archiver[0]) == "gcc-ar"
+
+
+def test_lto_mismatch(tmp_path: Path):
+    extension = _create_extension()
+    extension.extra_compile_args = ["-flto=thin"]
+    extension.extra_link_args = ["-flto"]
+    with pytest.raises(DistutilsSetupError, match="compiled with thin LTO but linked with full LTO"):
+        _run_build_ext(tmp_path, [extension])
+    extension.extra_link_args = []
+    with pytest.raises(DistutilsSetupError, match="linked with no LTO"):
+        _run_build_ext(tmp_path, [extension])
+
+
+@pytest.mark.skipif(platform.system() == "Windows", reason="Precompiled headers need a Unix compiler")
+@pytest.mark.parametrize("ninja", [False, True])
+def test_precompiled_headers(tmp_path: Path, monkeypatch, ninja: bool):
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_NINJA", raising=False)
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_OBJECT_CACHE_DIR", raising=False)
+    if ninja and shutil.which("ninja") is None:
+        pytest.skip("ninja is not installed")
+    extensions = []
+    for name in ("first", "second", "third"):
+        # The extensions compiling the same sources would write the same objects
+        sources_dir = tmp_path / "sources" / name
+        sources_dir.mkdir(parents=True)
+        shutil.copy(TESTS_DIR / "pypkg" / "foo.c", sources_dir / "foo_module.c")
+        shutil.copy(TESTS_DIR / "src" / "foo.c", sources_dir / "foo.c")
+        sources = [str(sources_dir / "foo_module.c"), str(sources_dir / "foo.c")]
+        extensions.append(Extension(f"{name}.foo", sources=sources, include_dirs=[str(TESTS_DIR / "src")]))
+        extensions[-1].precompiled_headers = ["foo.h"]
+    extensions[2].define_macros = [("THIRD", "1")]
+    _run_build_ext(tmp_path, extensions, parallel=4, ninja=ninja)
+    assert len(list((tmp_path / "lib").rglob("foo.*"))) == 3
+    # The extensions with identical flags share their precompiled header
+    (first, second) = sorted((tmp_path / "temp" / "pch").glob("*/precompiled.h.gch"), key=lambda path: path.stat().st_mtime_ns)
+    # Python.h is included first, before the standard headers of the translation units
+    assert (first.parent / "precompiled.h").read_text().splitlines()[1:] == ["#include <Python.h>", "#include <foo.h>"]
+    precompiled = first.stat().st_mtime_ns
+
+    # The extensions are rebuilt, not their up-to-date precompiled headers
+    for ext_path in (tmp_path / "lib").rglob("foo.*"):
+        ext_path.unlink()
+    _run_build_ext(tmp_path, extensions, force=False, parallel=4, ninja=ninja)
+    assert len(list((tmp_path / "lib").rglob("foo.*"))) == 3
+    assert first.stat().st_mtime_ns == precompiled
+
+
+@pytest.mark.parametrize("ninja", [False, True])
+def test_unity_build(tmp_path: Path, monkeypatch, ninja: bool):
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_NINJA", raising=False)
+    if ninja and shutil.which("ninja") is None:
+        pytest.skip("ninja is not installed")
+    sources_dir = tmp_path / "sources"
+    sources_dir.mkdir()
+    shutil.copy(TESTS_DIR / "pypkg" / "foo.c", sources_dir / "foo_module.c")
+    # foo() returns the sum of the functions of the other sources, which define the same static function
+    (sources_dir / "foo.c").write_text(
+        "int one(void);\nint two(void);\nint three(void);\nint foo(void) { return one() + two() + three(); }\n"
+    )
+    for name, value in (("one", 1), ("two", 2), ("three", 3)):
+        (sources_dir / f"{name}.c").write_text(f"static int value(void) {{ return {value}; }}\nint {name}(void) {{ return value(); }}\n")
+    extension = Extension(
+        "foo",
+        sources=[str(sources_dir / name) for name in ("foo_module.c", "foo.c", "one.c", "two.c", "three.c")],
+        include_dirs=[str(TESTS_DIR / "src")],
+    )
+    extension.unity_build = True
+    extension.unity_batch_size = 2
+    extension.unity_exclude = ["th*.c"]
+    _run_build_ext(tmp_path, [extension], ninja=ninja)
+    unity_sources = sorted((tmp_path / "temp" / "unity" / "foo").iterdir())
+    assert [path.name for path in unity_sources] == ["unity_c_0.c"]
+    # The module generated by Cython, the excluded sources and the last source are compiled on their own
+    assert unity_sources[0].read_text().splitlines()[1:] == [f'#include "{sources_dir / name}"' for name in ("foo.c", "one.c")]
+    output = subprocess.run(
+        [sys.executable, "-c", "import foo; foo.bar()"], cwd=tmp_path / "lib", check=True, capture_output=True, text=True
+    ).stdout
+    assert output.split() == ["6"]
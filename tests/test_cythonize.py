@@ -0,0 +1,66 @@
+from pathlib import Path
+
+import pytest
+from setuptools.extension import Extension
+
+from cython_setuptools.cythonize import CythonizeError, cythonize_extensions, get_jobs
+
+
+def _write_pyx(tmp_path: Path, name: str, content: str) -> str:
+    pyx_path = tmp_path / f"{name}.pyx"
+    pyx_path.write_text(content)
+    return str(pyx_path)
+
+
+def test_get_jobs(monkeypatch):
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_JOBS", raising=False)
+    assert get_jobs(3) == 3
+    assert get_jobs(0) == 1
+    assert get_jobs(None) >= 1
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_JOBS", "5")
+    assert get_jobs(3) == 5
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_cythonize_extensions(tmp_path: Path, jobs: int):
+    extensions = [Extension(name, [_write_pyx(tmp_path, name, "def f():\n    return 1\n")]) for name in ("a", "b", "c")]
+    cythonized = cythonize_extensions(extensions, jobs=jobs, quiet=True)
+    assert [extension.name for extension in cythonized] == ["a", "b", "c"]
+    for name in ("a", "b", "c"):
+        assert (tmp_path / f"{name}.c").exists()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_cythonize_extensions_collect_errors(tmp_path: Path, jobs: int):
+    extensions = [
+        Extension("good", [_write_pyx(tmp_path, "good", "def f():\n    return 1\n")]),
+        Extension("bad1", [_write_pyx(tmp_path, "bad1", "def f(:\n")]),
+        Extension("bad2", [_write_pyx(tmp_path, "bad2", "class :\n    pass\n")]),
+    ]
+    with pytest.raises(CythonizeError) as excinfo:
+        cythonize_extensions(extensions, jobs=jobs, quiet=True)
+    assert set(excinfo.value.failures) == {"bad1", "bad2"}
+    assert (tmp_path / "good.c").exists()
+
+
+def test_cythonize_extension_directives(tmp_path: Path):
+    from Cython.Distutils import Extension as CythonExtension
+
+    extension = CythonExtension(
+        "a", [_write_pyx(tmp_path, "a", "def f():\n    return 1\n")], cython_directives={"emit_code_comments": False}
+    )
+    cythonize_extensions([extension], quiet=True)
+    assert '"a.pyx":' not in (tmp_path / "a.c").read_text()
+
+
+def test_cythonize_extensions_one_after_another(tmp_path: Path, monkeypatch):
+    import Cython.Build.Dependencies
+
+    # The memoized dependency tree and options of cythonize are reset for each extension (see the upper bound of Cython)
+    assert hasattr(Cython.Build.Dependencies, "_dep_tree")
+    monkeypatch.chdir(tmp_path)
+    _write_pyx(tmp_path, "mod", "def f():\n    return 1\n")
+    for index in range(5):
+        extension = Extension("mod", ["mod.pyx"], include_dirs=[f"include{index}"], libraries=[f"lib{index}"])
+        cythonized = cythonize_extensions([extension], jobs=1, force=True, quiet=True)[0]
+        assert (cythonized.include_dirs, cythonized.libraries) == ([f"include{index}"], [f"lib{index}"])
@@ -0,0 +1,315 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import Cython
+import pytest
+from setuptools.command.build_ext import get_abi3_suffix
+
+from cython_setuptools import cythonize, extentions, pyproject, trace
+from cython_setuptools.extentions import EXTENSIONS_STAMP_NAME, create_extensions
+from cython_setuptools.limited_api import LimitedApiError
+from cython_setuptools.manifest import MANIFEST_NAME
+
+CYTHON_VERSION = tuple(map(int, Cython.__version__.split(".")[:2]))
+SHARED_UTILITY_SUPPORTED = CYTHON_VERSION >= cythonize.SHARED_UTILITY_CYTHON_VERSION
+LIMITED_API_SUPPORTED = CYTHON_VERSION >= cythonize.LIMITED_API_CYTHON_VERSION
+PYPROJECT = """
+[cython_extensions.a]
+sources = ["a.pyx"]
+
+[cython_extensions.b]
+sources = ["b.pyx"]
+"""
+
+
+@pytest.fixture
+def project(tmp_path: Path, monkeypatch) -> Path:
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("CYTHONIZE", raising=False)
+    (tmp_path / "pyproject.toml").write_text(PYPROJECT)
+    (tmp_path / "a.pyx").write_text("def a():\n    return 1\n")
+    (tmp_path / "b.pyx").write_text("def b():\n    return 2\n")
+    return tmp_path
+
+
+@pytest.fixture
+def cythonized_names(monkeypatch) -> list[str]:
+    names = []
+    cythonize_extensions = extentions.cythonize_extensions
+
+    def _record(extensions, **kwargs):
+        names.extend(extension.name for extension in extensions)
+        return cythonize_extensions(extensions, quiet=True, **kwargs)
+
+    monkeypatch.setattr(extentions, "cythonize_extensions", _record)
+    return names
+
+
+def test_cythonize_only_stale_extensions(project: Path, cythonized_names: list[str]):
+    extensions = create_extensions(str(project / "setup.py"))
+    assert cythonized_names == ["a", "b"]
+    assert [extension.sources for extension in extensions] == [["a.c"], ["b.c"]]
+
+    cythonized_names.clear()
+    extensions = create_extensions(str(project / "setup.py"))
+    assert cythonized_names == []
+    assert [extension.sources for extension in extensions] == [["a.c"], ["b.c"]]
+
+    (project / "b.pyx").write_text("def b():\n    return 3\n")
+    extensions = create_extensions(str(project / "setup.py"))
+    assert cythonized_names == ["b"]
+    assert [extension.name for extension in extensions] == ["a", "b"]
+
+
+def test_cythonize_forced(project: Path, cythonized_names: list[str], monkeypatch):
+    create_extensions(str(project / "setup.py"), cythonize=True)
+    create_extensions(str(project / "setup.py"), cythonize=True)
+    assert cythonized_names == ["a", "b", "a", "b"]
+
+    cythonized_names.clear()
+    monkeypatch.setenv("CYTHONIZE", "0")
+    create_extensions(str(project / "setup.py"), cythonize=True)
+    assert cythonized_names == []
+
+
+def test_cythonize_when_dependencies_change(project: Path, cythonized_names: list[str], monkeypatch):
+    (project / "shared.pxd").write_text("cdef int VALUE\n")
+    (project / "a.pyx").write_text("cimport shared\n\ndef a():\n    return 1\n")
+    create_extensions(str(project / "setup.py"))
+    cythonized_names.clear()
+
+    (project / "shared.pxd").write_text("cdef long VALUE\n")
+    create_extensions(str(project / "setup.py"))
+    assert cythonized_names == ["a"]
+
+    cythonized_names.clear()
+    monkeypatch.setenv("PROFILE_CYTHON", "1")
+    create_extensions(str(project / "setup.py"))
+    assert cythonized_names == ["a", "b"]
+
+
+def test_cythonize_when_included_dependencies_change(project: Path, cythonized_names: list[str]):
+    # The .pxd found in the include_dirs of the extension are dependencies too
+    (project / "include").mkdir()
+    (project / "include" / "shared.pxd").write_text("cdef int VALUE\n")
+    (project / "pyproject.toml").write_text(PYPROJECT.replace('sources = ["a.pyx"]', 'sources = ["a.pyx"]\ninclude_dirs = ["include"]'))
+    (project / "a.pyx").write_text("cimport shared\n\ndef a():\n    return 1\n")
+    create_extensions(str(project / "setup.py"))
+    cythonized_names.clear()
+
+    (project / "include" / "shared.pxd").write_text("cdef long VALUE\n")
+    create_extensions(str(project / "setup.py"))
+    assert cythonized_names == ["a"]
+
+
+def test_cythonize_when_output_is_missing(project: Path, cythonized_names: list[str]):
+    create_extensions(str(project / "setup.py"))
+    assert "input_hash" not in (project / "a.c").read_text()
+    cythonized_names.clear()
+
+    (project / "a.c").unlink()
+    create_extensions(str(project / "setup.py"))
+    assert cythonized_names == ["a"]
+
+
+def test_restore_from_cache(project: Path, monkeypatch, tmp_path_factory):
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_CACHE_DIR", str(tmp_path_factory.mktemp("cache")))
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_JOBS", "1")
+    cythonized = []
+    cythonize_one = cythonize._cythonize_one
+
+    def _record(extension, cythonize_kwargs):
+        cythonized.append(extension.name)
+        return cythonize_one(extension, {**cythonize_kwargs, "quiet": True})
+
+    monkeypatch.setattr(cythonize, "_cythonize_one", _record)
+    create_extensions(str(project / "setup.py"))
+    assert cythonized == ["a", "b"]
+    generated = (project / "a.c").read_text()
+
+    (project / "a.c").unlink()
+    (project / MANIFEST_NAME).unlink()
+    extensions = create_extensions(str(project / "setup.py"))
+    assert cythonized == ["a", "b"]
+    assert [extension.sources for extension in extensions] == [["a.c"], ["b.c"]]
+    assert (project / "a.c").read_text() == generated
+
+
+def _make_old(directory: Path):
+    # Files modified in the last seconds are not trusted to be unchanged by the stamps
+    old = time.time() - 10
+    for path in directory.iterdir():
+        os.utime(path, (old, old))
+
+
+def test_reuse_extensions_when_nothing_changed(project: Path, cythonized_names: list[str], monkeypatch):
+    create_extensions(str(project / "setup.py"))
+    _make_old(project)
+    create_extensions(str(project / "setup.py"))
+    assert (project / EXTENSIONS_STAMP_NAME).exists()
+
+    def read_pyproject(path):
+        raise AssertionError("the pyproject.toml should not be parsed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(pyproject, "read_pyproject", read_pyproject)
+        extensions = create_extensions(str(project / "setup.py"))
+    assert [(extension.name, extension.sources) for extension in extensions] == [("a", ["a.c"]), ("b", ["b.c"])]
+
+    cythonized_names.clear()
+    (project / "a.pyx").write_text("def a():\n    return 10\n")
+    old = time.time() - 5
+    os.utime(project / "a.pyx", (old, old))
+    create_extensions(str(project / "setup.py"))
+    assert cythonized_names == ["a"]
+
+
+def test_trace_staleness_reasons(project: Path, cythonized_names: list[str], monkeypatch):
+    tracer = trace.Tracer(project / "trace.json")
+    monkeypatch.setattr(trace, "_tracer", tracer)
+    create_extensions(str(project / "setup.py"))
+    (project / "b.pyx").write_text("def b():\n    return 3\n")
+    create_extensions(str(project / "setup.py"))
+    monkeypatch.setenv("CYTHONIZE", "1")
+    create_extensions(str(project / "setup.py"))
+
+    reasons = [(event["name"], event["args"]["reason"]) for event in tracer.events if event["cat"] == "staleness"]
+    assert reasons == [
+        ("a", "missing output a.c"),
+        ("b", "missing output b.c"),
+        ("a", None),
+        ("b", "b.pyx or its dependencies changed"),
+        ("a", "forced by CYTHONIZE"),
+        ("b", "forced by CYTHONIZE"),
+    ]
+    assert {event["cat"] for event in tracer.events} >= {"config", "staleness", "cythonize"}
+
+
+def test_cythonization_left_to_ninja(project: Path, cythonized_names: list[str], monkeypatch):
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_NINJA", "1")
+    extensions = create_extensions(str(project / "setup.py"))
+    assert cythonized_names == []
+    assert [(extension.name, extension.sources) for extension in extensions] == [("a", ["a.pyx"]), ("b", ["b.pyx"])]
+    assert not (project / MANIFEST_NAME).exists()
+
+
+def test_extension_directives(project: Path, cythonized_names: list[str], monkeypatch):
+    (project / "pyproject.toml").write_text(PYPROJECT + "cython_directives = { emit_code_comments = false }\n")
+    create_extensions(str(project / "setup.py"))
+    assert '"a.pyx":' in (project / "a.c").read_text()
+    assert '"b.pyx":' not in (project / "b.c").read_text()
+
+    # The directives are part of the fingerprints of the generated files
+    (project / "pyproject.toml").write_text(PYPROJECT + "cython_directives = { emit_code_comments = true }\n")
+    cythonized_names.clear()
+    create_extensions(str(project / "setup.py"))
+    assert cythonized_names == ["b"]
+    assert '"b.pyx":' in (project / "b.c").read_text()
+
+
+def test_extension_profile(project: Path, monkeypatch):
+    monkeypatch.setenv("CC", "clang")
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_PROFILE", raising=False)
+    (project / "pyproject.toml").write_text(PYPROJECT + 'profile = "debug"\nextra_compile_args = ["-O1"]\n')
+    extensions = create_extensions(str(project / "setup.py"))
+    assert [extension.extra_compile_args for extension in extensions] == [[], ["-O0", "-g", "-O1"]]
+
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_PROFILE", "native")
+    extensions = create_extensions(str(project / "setup.py"))
+    assert [extension.extra_compile_args for extension in extensions] == [
+        ["-O3", "-march=native", "-flto"],
+        ["-O3", "-march=native", "-flto", "-O1"],
+    ]
+
+
+def test_extension_lto(project: Path, monkeypatch):
+    monkeypatch.setenv("CC", "clang")
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_PROFILE", raising=False)
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_LTO", raising=False)
+    (project / "pyproject.toml").write_text(PYPROJECT + 'profile = "release"\nlto = "thin"\n')
+    extensions = create_extensions(str(project / "setup.py"))
+    assert extensions[1].extra_compile_args == ["-O3", "-flto=thin"]
+    # The link uses the same mode, and lld when the GNU linker could not read the LLVM objects
+    assert extensions[1].extra_link_args[:2] == ["-O3", "-flto=thin"]
+
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_LTO", "false")
+    extensions = create_extensions(str(project / "setup.py"))
+    assert extensions[1].extra_compile_args == ["-O3"]
+
+
+@pytest.mark.skipif(SHARED_UTILITY_SUPPORTED, reason="The installed Cython supports shared utility modules")
+def test_shared_utility_unsupported(project: Path):
+    (project / "pyproject.toml").write_text(PYPROJECT + '[tool.cython_setuptools]\nshared_utility_module = "_cyutility"\n')
+    with pytest.raises(RuntimeError, match="shared utility module requires Cython >= 3.1"):
+        create_extensions(str(project / "setup.py"))
+    assert not (project / "a.c").exists()
+
+
+@pytest.mark.skipif(not SHARED_UTILITY_SUPPORTED, reason="Shared utility modules require Cython >= 3.1")
+def test_shared_utility(project: Path):
+    (project / "pyproject.toml").write_text(PYPROJECT + '[tool.cython_setuptools]\nshared_utility_module = "_cyutility"\n')
+    extensions = create_extensions(str(project / "setup.py"))
+    assert [(extension.name, extension.sources) for extension in extensions][-1] == ("_cyutility", ["_cyutility.c"])
+    assert (project / "_cyutility.c").exists()
+    # The shared utility module is recorded in the stamp of the extensions
+    assert [extension.name for extension in create_extensions(str(project / "setup.py"))] == ["a", "b", "_cyutility"]
+
+
+@pytest.mark.skipif(not LIMITED_API_SUPPORTED, reason="The limited API requires Cython >= 3.1")
+def test_extension_abi3(project: Path):
+    (project / "pyproject.toml").write_text(PYPROJECT + 'abi3 = "3.10"\n')
+    extensions = create_extensions(str(project / "setup.py"))
+    assert [(extension.py_limited_api, extension.define_macros) for extension in extensions] == [
+        (False, []),
+        (True, [("CYTHON_LIMITED_API", "1"), ("Py_LIMITED_API", "0x030A0000")]),
+    ]
+    # The macros are restored from the stamp of the extensions as tuples
+    assert create_extensions(str(project / "setup.py"))[1].define_macros == extensions[1].define_macros
+
+    (project / "b.pyx").write_text("from cpython cimport array\n\ndef b():\n    return 2\n")
+    with pytest.raises(LimitedApiError, match="b: b.pyx:1: cimport cpython.array"):
+        create_extensions(str(project / "setup.py"))
+
+
+@pytest.mark.skipif(not LIMITED_API_SUPPORTED, reason="The limited API requires Cython >= 3.1")
+def test_build_abi3(project: Path):
+    (project / "pyproject.toml").write_text(PYPROJECT + 'abi3 = "3.10"\n')
+    (project / "setup.py").write_text(
+        "from setuptools import setup\n"
+        "from cython_setuptools import build_ext, create_extensions\n"
+        "setup(name='abi3', ext_modules=create_extensions(__file__), cmdclass={'build_ext': build_ext})\n"
+    )
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(Path(__file__).parents[1]), os.environ.get("PYTHONPATH", "")])}
+    subprocess.run([sys.executable, "setup.py", "-q", "build_ext", "--inplace"], check=True, env=env, cwd=project)
+    assert (project / f"b{get_abi3_suffix()}").exists()
+    code = "import a, b; print(a.a() + b.b(), b.__file__)"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True, cwd=project, env=env).stdout
+    assert output.split() == ["3", str(project / f"b{get_abi3_suffix()}")]
+
+
+@pytest.mark.skipif(LIMITED_API_SUPPORTED, reason="The installed Cython supports the limited API")
+def test_extension_abi3_unsupported(project: Path):
+    (project / "pyproject.toml").write_text(PYPROJECT + 'abi3 = "3.10"\n')
+    with pytest.raises(RuntimeError, match="building for the limited API requires Cython >= 3.1"):
+        create_extensions(str(project / "setup.py"))
+
+
+def test_extension_build_ext_options(project: Path):
+    (project / "pyproject.toml").write_text(
+        PYPROJECT + 'precompiled_headers = ["numpy/arrayobject.h"]\nunity_build = true\nunity_exclude = ["legacy.cpp"]\n'
+    )
+    expected = [([], False, 8, []), (["numpy/arrayobject.h"], True, 8, ["legacy.cpp"])]
+    extensions = create_extensions(str(project / "setup.py"))
+    assert [
+        (extension.precompiled_headers, extension.unity_build, extension.unity_batch_size, extension.unity_exclude)
+        for extension in extensions
+    ] == expected
+    # They are restored from the stamp of the extensions
+    extensions = create_extensions(str(project / "setup.py"))
+    assert [
+        (extension.precompiled_headers, extension.unity_build, extension.unity_batch_size, extension.unity_exclude)
+        for extension in extensions
+    ] == expected
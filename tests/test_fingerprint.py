@@ -0,0 +1,111 @@
+import json
+import os
+from pathlib import Path
+
+from cython_setuptools import fingerprint
+from cython_setuptools.fingerprint import (
+    HashCache,
+    compute_fingerprint,
+    create_dependency_tree,
+    file_digest,
+    get_dependencies,
+)
+
+
+def test_get_dependencies(tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path("lib.pxd").write_text("cdef int f()\n")
+    Path("inc.pxi").write_text("cdef int x = 1\n")
+    Path("mod.pyx").write_text("cimport lib\ninclude 'inc.pxi'\n")
+    dependencies = get_dependencies("mod.pyx", create_dependency_tree())
+    assert [Path(dependency).name for dependency in dependencies] == ["inc.pxi", "lib.pxd", "mod.pyx"]
+
+
+def test_compute_fingerprint(tmp_path: Path):
+    pyx = tmp_path / "mod.pyx"
+    pyx.write_text("def f():\n    pass\n")
+    reference = compute_fingerprint(pyx, [str(pyx)], {}, "c")
+    assert compute_fingerprint(pyx, [str(pyx)], {}, "c") == reference
+    assert compute_fingerprint(pyx, [str(pyx)], {"boundscheck": False}, "c") != reference
+    assert compute_fingerprint(pyx, [str(pyx)], {}, "c++") != reference
+    assert compute_fingerprint(pyx, [str(pyx)], {}, "c", shared_utility="pkg._cyutility") != reference
+    pyx.write_text("def f():\n    return 1\n")
+    assert compute_fingerprint(pyx, [str(pyx)], {}, "c") != reference
+
+
+def test_fingerprint_independent_of_include_root(tmp_path: Path):
+    # The same .pxd installed in two different environments
+    pyx = tmp_path / "project" / "mod.pyx"
+    pyx.parent.mkdir()
+    pyx.write_text("cimport lib\n")
+    fingerprints = []
+    for env_dir in ("env", "other/venv"):
+        include_dir = tmp_path / env_dir / "include"
+        include_dir.mkdir(parents=True)
+        (include_dir / "lib.pxd").write_text("cdef int f()\n")
+        dependencies = [str(include_dir / "lib.pxd"), str(pyx)]
+        fingerprints.append(compute_fingerprint(pyx, dependencies, {}, "c", include_dirs=[str(include_dir)]))
+    assert fingerprints[0] == fingerprints[1]
+
+    # The .pxd of Cython are identified relative to its Includes, not to the project
+    pyx.write_text("from libc.stdlib cimport malloc\n")
+    dependencies = get_dependencies(pyx, create_dependency_tree())
+    libc_stdlib = next(dependency for dependency in dependencies if dependency.endswith("stdlib.pxd"))
+    include_roots = fingerprint._get_include_roots([])
+    assert fingerprint._get_dependency_key(libc_stdlib, str(pyx.parent), include_roots) == "libc/stdlib.pxd"
+
+
+def test_file_digest(tmp_path: Path):
+    empty = tmp_path / "empty.pyx"
+    empty.write_text("")
+    content = tmp_path / "content.pyx"
+    content.write_text("def f():\n    pass\n")
+    assert file_digest(empty) != file_digest(content)
+    assert file_digest(content) == file_digest(content)
+
+
+def test_hash_cache(tmp_path: Path, monkeypatch):
+    hashed = []
+
+    def _file_digest(filename):
+        hashed.append(filename)
+        return file_digest(filename)
+
+    monkeypatch.setattr(fingerprint, "file_digest", _file_digest)
+    pyx = tmp_path / "mod.pyx"
+    pyx.write_text("def f():\n    pass\n")
+    os.utime(pyx, (1, 1))
+    cache_path = tmp_path / "hashes.json"
+    reference = HashCache(cache_path).digest(pyx)
+    cache = HashCache(cache_path)
+    assert cache.digest(pyx) == reference
+    cache.save()
+
+    cache = HashCache(cache_path)
+    assert cache.digest(pyx) == reference
+    assert len(hashed) == 2
+
+    pyx.write_text("def f():\n    return 1\n")
+    os.utime(pyx, (1, 1))
+    assert cache.digest(pyx) != reference
+    assert len(hashed) == 3
+
+
+def test_hash_cache_pruning(tmp_path: Path):
+    cache_path = tmp_path / "hashes.json"
+    paths = [tmp_path / "kept.pyx", tmp_path / "removed.pyx"]
+    for path in paths:
+        path.write_text("def f():\n    pass\n")
+        os.utime(path, (1, 1))
+    cache = HashCache(cache_path)
+    for path in paths:
+        cache.digest(path)
+    cache.save()
+    assert set(json.loads(cache_path.read_text())) == {str(path) for path in paths}
+
+    # The entries that are not looked up are dropped
+    paths[1].unlink()
+    cache = HashCache(cache_path)
+    cache.digest(paths[0])
+    cache.save()
+    assert set(json.loads(cache_path.read_text())) == {str(paths[0])}
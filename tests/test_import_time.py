@@ -0,0 +1,69 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT_DIR = Path(__file__).parent.parent
+# Modules that are slow to import and not needed before compiling
+HEAVY_MODULES = ("Cython.Build", "Cython.Compiler", "Cython.Distutils", "serde", "setuptools")
+
+
+def _get_imported_modules(code: str, cwd: Path | None = None) -> list[str]:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(ROOT_DIR), os.environ.get("PYTHONPATH")]))}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=cwd, env=env, capture_output=True, text=True, check=True
+    )
+    # Lines are formatted like "import time: self [us] | cumulative | imported package"
+    return [
+        line.split("|")[-1].strip() for line in result.stderr.splitlines() if line.startswith("import time:")
+    ]
+
+
+def _get_heavy_modules(imported_modules: list[str], heavy_modules: tuple[str, ...]) -> list[str]:
+    return [
+        module for module in imported_modules
+        if any(module == heavy or module.startswith(f"{heavy}.") for heavy in heavy_modules)
+    ]
+
+
+def test_import_package():
+    imported_modules = _get_imported_modules("import cython_setuptools; cython_setuptools.__version__")
+    assert "cython_setuptools" in imported_modules
+    assert _get_heavy_modules(imported_modules, HEAVY_MODULES) == []
+
+
+@pytest.mark.parametrize("name", ["create_extensions", "setup", "build_ext"])
+def test_lazy_attributes(name: str):
+    import cython_setuptools
+
+    assert name in dir(cython_setuptools)
+    assert callable(getattr(cython_setuptools, name))
+    with pytest.raises(AttributeError):
+        cython_setuptools.missing_attribute
+
+
+def test_create_extensions_without_cythonize(tmp_path: Path):
+    (tmp_path / "pyproject.toml").write_text('[cython_extensions.foo]\nsources = ["foo.pyx"]\n')
+    (tmp_path / "foo.c").touch()
+    code = "from cython_setuptools import create_extensions; create_extensions('setup.py', cythonize=False)"
+    imported_modules = _get_imported_modules(code, cwd=tmp_path)
+    assert _get_heavy_modules(imported_modules, ("Cython.Build", "Cython.Compiler", "Cython.Distutils")) == []
+
+
+def test_restore_extensions_from_stamp(tmp_path: Path):
+    (tmp_path / "pyproject.toml").write_text('[cython_extensions.foo]\nsources = ["foo.pyx"]\n')
+    (tmp_path / "foo.c").touch()
+    # Files modified in the last seconds are not trusted to be unchanged by the stamps
+    old = time.time() - 10
+    for path in tmp_path.iterdir():
+        os.utime(path, (old, old))
+    code = "from cython_setuptools import create_extensions; create_extensions('setup.py', cythonize=False)"
+    _get_imported_modules(code, cwd=tmp_path)
+    assert (tmp_path / ".cython_setuptools_extensions.json").exists()
+    imported_modules = _get_imported_modules(code, cwd=tmp_path)
+    # The extensions are restored without the compiler helpers of distutils nor the parser of the pyproject.toml
+    heavy_modules = ("Cython.Build", "Cython.Compiler", "serde", "setuptools._distutils.ccompiler", "distutils.ccompiler")
+    assert _get_heavy_modules(imported_modules, heavy_modules) == []
@@ -0,0 +1,46 @@
+from pathlib import Path
+
+import pytest
+
+from cython_setuptools.limited_api import (
+    LimitedApiError,
+    LimitedApiViolation,
+    find_limited_api_violations,
+    get_limited_api_macros,
+    parse_abi3,
+)
+
+
+def test_limited_api_macros():
+    assert get_limited_api_macros("3.10") == [("CYTHON_LIMITED_API", "1"), ("Py_LIMITED_API", "0x030A0000")]
+    assert parse_abi3("3.12") == (3, 12)
+    for version in ("3", "2.7", "3.1", "abc"):
+        with pytest.raises(ValueError, match="Invalid abi3"):
+            parse_abi3(version)
+
+
+def test_find_limited_api_violations(tmp_path: Path):
+    path = tmp_path / "a.pyx"
+    path.write_text(
+        "from cpython cimport array\n"
+        "from cpython.buffer cimport PyObject_GetBuffer\n"
+        "cimport numpy as np, cython\n"
+        "from cpython.object cimport PyObject  # PyList_GET_ITEM in a comment\n"
+        "x = PyList_GET_ITEM(l, 0)\n"
+        "_PyObject_Init(x)\n"
+    )
+    name = str(path)
+    assert find_limited_api_violations([path], "3.10") == [
+        LimitedApiViolation(name, 1, "cimport cpython.array"),
+        LimitedApiViolation(name, 2, "cimport cpython.buffer"),
+        LimitedApiViolation(name, 3, "cimport numpy"),
+        LimitedApiViolation(name, 5, "PyList_GET_ITEM"),
+        LimitedApiViolation(name, 6, "_PyObject_Init"),
+    ]
+    # The buffer protocol is part of the limited API from Python 3.11
+    assert LimitedApiViolation(name, 2, "cimport cpython.buffer") not in find_limited_api_violations([path], "3.11")
+
+
+def test_limited_api_error():
+    error = LimitedApiError({"a": [LimitedApiViolation("a.pyx", 5, "PyList_GET_ITEM")]})
+    assert str(error) == "1 extension(s) built for abi3 use the full API of Python:\n  a: a.pyx:5: PyList_GET_ITEM"
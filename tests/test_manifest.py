@@ -0,0 +1,26 @@
+from pathlib import Path
+
+from cython_setuptools.manifest import Manifest
+
+
+def test_manifest(tmp_path: Path):
+    manifest_path = tmp_path / "manifest.json"
+    output = tmp_path / "a.c"
+    output.write_text("")
+    manifest = Manifest(manifest_path)
+    assert manifest.get_dependencies("a.pyx", output) is None
+    manifest.update("a.pyx", output, "1234", ["a.pyx", "a.pxd"])
+    manifest.save()
+
+    manifest = Manifest(manifest_path)
+    assert manifest.get_dependencies("a.pyx", output) == ["a.pyx", "a.pxd"]
+    assert manifest.get_fingerprint("a.pyx") == "1234"
+    assert manifest.get_dependencies("a.pyx", tmp_path / "a.cpp") is None
+    output.unlink()
+    assert manifest.get_dependencies("a.pyx", output) is None
+
+
+def test_corrupted_manifest(tmp_path: Path):
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text("{")
+    assert Manifest(manifest_path).get_fingerprint("a.pyx") is None
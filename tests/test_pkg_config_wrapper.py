@@ -1,8 +1,12 @@
+import os
 from pathlib import Path
 import platform
+import shutil
+import subprocess
 
 import pytest
 
+from cython_setuptools import pkgconfig_wrapper
 from cython_setuptools.pkgconfig_wrapper import _extend_pkg_config_path, get_flags
 
 DATA_DIR = Path(__file__).parent / "data"
@@ -10,7 +14,7 @@ DATA_DIR = Path(__file__).parent / "data"
 
 def test_extend_pkg_config_path():
     dirs = ["toto", "foo"]
-    expected = "toto:foo"
+    expected = os.pathsep.join(["toto", "foo"])
     empty_path = {"PKG_CONFIG_PATH": ""}
     _extend_pkg_config_path(dirs, empty_path)
     assert empty_path["PKG_CONFIG_PATH"] == expected
@@ -19,12 +23,12 @@ def test_extend_pkg_config_path():
     _extend_pkg_config_path(dirs, path_not_defined)
     assert path_not_defined["PKG_CONFIG_PATH"] == expected
 
-    expected = "/lol/toto:toto:foo"
+    expected = os.pathsep.join(["/lol/toto", "toto", "foo"])
     path_not_terminator = {"PKG_CONFIG_PATH": "/lol/toto"}
     _extend_pkg_config_path(dirs, path_not_terminator)
     assert path_not_terminator["PKG_CONFIG_PATH"] == expected
 
-    path_with_terminator = {"PKG_CONFIG_PATH": "/lol/toto:"}
+    path_with_terminator = {"PKG_CONFIG_PATH": "/lol/toto" + os.pathsep}
     _extend_pkg_config_path(dirs, path_with_terminator)
     assert path_with_terminator["PKG_CONFIG_PATH"] == expected
 
@@ -34,3 +38,99 @@ def test_get_flags():
     build_flags = get_flags(["my_fake_lib"], [str(DATA_DIR)])
     assert build_flags.link_flags == ["-L/tmp/lib", "-lmy_fake_lib"]
     assert build_flags.compile_flags == ["-I/tmp/include"]
+
+
+@pytest.fixture
+def pkg_config_calls(tmp_path: Path, monkeypatch) -> list[list[str]]:
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_PKG_CONFIG_CACHE", str(tmp_path / "pkg_config.json"))
+    monkeypatch.setattr(pkgconfig_wrapper, "_memo", {})
+    calls = []
+    original_check_output = pkgconfig_wrapper._check_output
+
+    def check_output(cmd, env):
+        calls.append(cmd)
+        return original_check_output(cmd, env)
+
+    monkeypatch.setattr(pkgconfig_wrapper, "_check_output", check_output)
+    return calls
+
+
+@pytest.mark.skipif(platform.system() == 'Windows', reason='Having pkg-config on windows is not trivial')
+def test_get_flags_memoized(pkg_config_calls: list[list[str]]):
+    first = get_flags(["my_fake_lib"], [str(DATA_DIR)])
+    calls_count = len(pkg_config_calls)
+    first.compile_flags.append("-DMODIFIED")
+    second = get_flags(["my_fake_lib"], [str(DATA_DIR)])
+    assert len(pkg_config_calls) == calls_count
+    assert second.compile_flags == ["-I/tmp/include"]
+
+
+@pytest.mark.skipif(platform.system() == 'Windows', reason='Having pkg-config on windows is not trivial')
+def test_get_flags_persisted(tmp_path: Path, pkg_config_calls: list[list[str]], monkeypatch):
+    pc_dir = tmp_path / "pkgconfig"
+    pc_dir.mkdir()
+    pc_file = pc_dir / "my_fake_lib.pc"
+    shutil.copy(DATA_DIR / "my_fake_lib.pc", pc_file)
+    get_flags(["my_fake_lib"], [str(pc_dir)])
+    assert pkg_config_calls
+
+    # A new process: only the persisted cache is available
+    monkeypatch.setattr(pkgconfig_wrapper, "_memo", {})
+    pkg_config_calls.clear()
+    assert get_flags(["my_fake_lib"], [str(pc_dir)]).link_flags == ["-L/tmp/lib", "-lmy_fake_lib"]
+    assert pkg_config_calls == []
+
+    # The .pc file changed
+    monkeypatch.setattr(pkgconfig_wrapper, "_memo", {})
+    pc_file.write_text(pc_file.read_text().replace("prefix=/tmp", "prefix=/opt"))
+    os.utime(pc_file, ns=(0, 0))
+    assert get_flags(["my_fake_lib"], [str(pc_dir)]).link_flags == ["-L/opt/lib", "-lmy_fake_lib"]
+    assert pkg_config_calls
+
+
+def test_get_cache_path(monkeypatch):
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_PKG_CONFIG_CACHE")
+    # Not shared between projects unless opted in
+    assert pkgconfig_wrapper.get_cache_path() == os.path.join("build", "cython_setuptools", "pkg_config.json")
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_PKG_CONFIG_CACHE", "~/pkg_config.json")
+    assert pkgconfig_wrapper.get_cache_path() == os.path.join(os.path.expanduser("~"), "pkg_config.json")
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_PKG_CONFIG_CACHE", "")
+    assert pkgconfig_wrapper.get_cache_path() is None
+
+
+@pytest.mark.skipif(platform.system() == 'Windows', reason='Having pkg-config on windows is not trivial')
+def test_get_flags_persisted_requirements(tmp_path: Path, pkg_config_calls: list[list[str]], monkeypatch):
+    pc_dir = tmp_path / "pkgconfig"
+    pc_dir.mkdir()
+    for name in ("a", "b", "c"):
+        (pc_dir / f"{name}.pc").write_text(f"Name: {name}\nVersion: 1\nDescription: {name}\nLibs: -l{name}\n")
+    (pc_dir / "a.pc").write_text((pc_dir / "a.pc").read_text() + "Requires: b >= 1\nRequires.private: c\n")
+    for path in pc_dir.iterdir():
+        os.utime(path, ns=(0, 0))
+    assert get_flags(["a"], [str(pc_dir)]).link_flags == ["-la", "-lb"]
+    # --cflags, --libs and the default search path, whatever the number of requirements
+    assert len(pkg_config_calls) == 3
+
+    # A private requirement changed
+    monkeypatch.setattr(pkgconfig_wrapper, "_memo", {})
+    pkg_config_calls.clear()
+    (pc_dir / "c.pc").write_text((pc_dir / "c.pc").read_text() + "Cflags: -DC\n")
+    assert get_flags(["a"], [str(pc_dir)]).compile_flags == ["-DC"]
+    assert pkg_config_calls
+
+
+def test_get_flags_python_backend(pkg_config_calls: list[list[str]], monkeypatch):
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_PKG_CONFIG_BACKEND", "python")
+    build_flags = get_flags(["my_fake_lib"], [str(DATA_DIR)])
+    assert build_flags.link_flags == ["-L/tmp/lib", "-lmy_fake_lib"]
+    assert build_flags.compile_flags == ["-I/tmp/include"]
+    assert pkg_config_calls == []
+
+
+def test_get_flags_python_backend_fallback(pkg_config_calls: list[list[str]], monkeypatch):
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_PKG_CONFIG_BACKEND", "python")
+    monkeypatch.setenv("PKG_CONFIG_PATH", "")
+    monkeypatch.setenv("PKG_CONFIG_LIBDIR", "")
+    with pytest.raises(subprocess.CalledProcessError):
+        get_flags(["my_missing_lib"])
+    assert pkg_config_calls
@@ -0,0 +1,152 @@
+from pathlib import Path
+import platform
+import shutil
+import subprocess
+import sysconfig
+
+import pytest
+
+from cython_setuptools import pkgconfig_resolver
+from cython_setuptools.pkgconfig_resolver import PkgConfigError, parse_requires, resolve_flags
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def pc_dir(tmp_path: Path) -> Path:
+    (tmp_path / "app.pc").write_text(
+        "prefix=/opt/app\n"
+        "includedir=${prefix}/include  # comment\n"
+        "\n"
+        "Name: app\n"
+        "Version: 1.0\n"
+        "Description: An application\n"
+        "Requires: base >= 1.0, other\n"
+        "Requires.private: private\n"
+        "Cflags: -I${includedir} -DAPP_NAME=$${name}\n"
+        "Libs: -L${prefix}/lib -lapp -lbase\n"
+    )
+    (tmp_path / "base.pc").write_text("Name: base\nVersion: 1.2\nDescription: Base\nCflags: -I/usr/include\nLibs: -lbase\n")
+    (tmp_path / "other.pc").write_text(
+        "Name: other\nVersion: 1\nDescription: Other\nRequires: base\nCflags: -I${pcfiledir}/include\nLibs: -lother\n"
+    )
+    (tmp_path / "private.pc").write_text("Name: private\nVersion: 1\nDescription: Private\nCflags: -DPRIVATE\n")
+    return tmp_path
+
+
+def test_parse_requires():
+    assert parse_requires("") == []
+    assert parse_requires("foo >= 1.0, bar,baz<2 qux") == ["foo", "bar", "baz", "qux"]
+    assert parse_requires("gtk+-3.0") == ["gtk+-3.0"]
+
+
+def test_resolve_flags(pc_dir: Path):
+    build_flags = resolve_flags(["app"], {"PKG_CONFIG_PATH": str(pc_dir), "PKG_CONFIG_LIBDIR": ""})
+    assert build_flags.compile_flags == ["-I/opt/app/include", "-DAPP_NAME=${name}", f"-I{pc_dir}/include", "-DPRIVATE"]
+    assert build_flags.link_flags == ["-L/opt/app/lib", "-lapp", "-lother", "-lbase"]
+
+
+def test_resolve_flags_sysroot(pc_dir: Path):
+    build_flags = resolve_flags(
+        ["base", "app"],
+        {"PKG_CONFIG_PATH": str(pc_dir), "PKG_CONFIG_LIBDIR": "", "PKG_CONFIG_SYSROOT_DIR": "/sysroot",
+         "PKG_CONFIG_ALLOW_SYSTEM_CFLAGS": "1"},
+    )
+    assert build_flags.compile_flags[:2] == ["-I/sysroot/usr/include", "-I/sysroot/opt/app/include"]
+    assert build_flags.link_flags == ["-L/sysroot/opt/app/lib", "-lapp", "-lother", "-lbase"]
+
+
+def test_resolve_flags_not_found(pc_dir: Path):
+    (pc_dir / "broken.pc").write_text("Name: broken\nRequires: missing\n")
+    with pytest.raises(PkgConfigError, match="missing"):
+        resolve_flags(["broken"], {"PKG_CONFIG_PATH": str(pc_dir), "PKG_CONFIG_LIBDIR": ""})
+    (pc_dir / "undefined.pc").write_text("Name: undefined\nCflags: -I${includedir}\n")
+    with pytest.raises(PkgConfigError, match="includedir"):
+        resolve_flags(["undefined"], {"PKG_CONFIG_PATH": str(pc_dir), "PKG_CONFIG_LIBDIR": ""})
+
+
+@pytest.mark.skipif(platform.system() == 'Windows', reason='Having pkg-config on windows is not trivial')
+@pytest.mark.skipif(shutil.which("pkg-config") is None, reason="pkg-config is not installed")
+def test_same_flags_as_pkg_config(tmp_path: Path):
+    shutil.copy(DATA_DIR / "my_fake_lib.pc", tmp_path)
+    env = {"PKG_CONFIG_PATH": str(tmp_path)}
+    build_flags = resolve_flags(["my_fake_lib"], env)
+    for option, flags in (("--cflags", build_flags.compile_flags), ("--libs", build_flags.link_flags)):
+        assert subprocess.check_output(["pkg-config", option, "my_fake_lib"], env=env).decode().split() == flags
+
+
+@pytest.mark.skipif(platform.system() == 'Windows', reason='Having pkg-config on windows is not trivial')
+@pytest.mark.skipif(shutil.which("pkg-config") is None, reason="pkg-config is not installed")
+def test_same_order_as_pkg_config(tmp_path: Path):
+    libdir = f"/usr/lib/{sysconfig.get_config_var('MULTIARCH') or ''}"
+    (tmp_path / "top.pc").write_text(
+        "Name: top\nVersion: 1\nDescription: Top\nRequires: left, right\n"
+        "Cflags: -isystem /opt/top -DTOP -include top.h\n"
+        f"Libs: -L{libdir} -L/opt/top/lib -ltop -Wl,--push-state,--as-needed -latomic -Wl,--pop-state -lleft\n"
+    )
+    (tmp_path / "left.pc").write_text(
+        "Name: left\nVersion: 1\nDescription: Left\nRequires: base\n"
+        "Cflags: -isystem /opt/left -include top.h -DLEFT\nLibs: -L/opt/top/lib -lleft -pthread\n"
+    )
+    (tmp_path / "right.pc").write_text(
+        "Name: right\nVersion: 1\nDescription: Right\nRequires: base\n"
+        "Cflags: -DTOP -isystem /opt/top\nLibs: -framework Foo -lright -pthread\n"
+    )
+    (tmp_path / "base.pc").write_text(
+        "Name: base\nVersion: 1\nDescription: Base\n"
+        "Cflags: -I/opt/base/include\nLibs: -lbase -Wl,--push-state,--as-needed -latomic -Wl,--pop-state -lrt\n"
+    )
+    env = {"PKG_CONFIG_PATH": str(tmp_path), "PKG_CONFIG_LIBDIR": ""}
+    for pkg_names in (["top"], ["right", "top"], ["base", "left"]):
+        build_flags = resolve_flags(pkg_names, env)
+        for option, flags in (("--cflags", build_flags.compile_flags), ("--libs", build_flags.link_flags)):
+            assert subprocess.check_output(["pkg-config", option, *pkg_names], env=env).decode().split() == flags
+
+
+@pytest.mark.skipif(platform.system() == 'Windows', reason='Having pkg-config on windows is not trivial')
+@pytest.mark.skipif(shutil.which("pkg-config") is None, reason="pkg-config is not installed")
+def test_same_system_dirs_as_pkg_config(tmp_path: Path):
+    # The default directories of pkg-config depend on the distribution, eg: lib64 or lib/x86_64-linux-gnu
+    libs = " ".join(f"-L{directory}" for directory in ("/usr/lib64", "/lib64", "/usr/lib", "/usr/lib32", "/opt/lib"))
+    (tmp_path / "system.pc").write_text(
+        f"Name: system\nVersion: 1\nDescription: System\nCflags: -I/usr/include -I/opt/include\nLibs: {libs} -lsystem\n"
+    )
+    env = {"PKG_CONFIG_PATH": str(tmp_path)}
+    build_flags = resolve_flags(["system"], env)
+    for option, flags in (("--cflags", build_flags.compile_flags), ("--libs", build_flags.link_flags)):
+        assert subprocess.check_output(["pkg-config", option, "system"], env=env).decode().split() == flags
+
+
+@pytest.mark.skipif(platform.system() == 'Windows', reason='Having pkg-config on windows is not trivial')
+@pytest.mark.skipif(shutil.which("pkg-config") is None, reason="pkg-config is not installed")
+def test_same_flags_as_pkg_config_lib64(tmp_path: Path, monkeypatch):
+    # A Fedora like layout: the .pc files and the libraries are in lib64
+    pc_dir = tmp_path / "usr" / "lib64" / "pkgconfig"
+    pc_dir.mkdir(parents=True)
+    (pc_dir / "foo.pc").write_text(
+        "prefix=/usr\nlibdir=${prefix}/lib64\n"
+        "Name: foo\nVersion: 1\nDescription: Foo\nCflags: -I${prefix}/include\nLibs: -L${libdir} -L/opt/lib64 -lfoo\n"
+    )
+    env = {"PKG_CONFIG_LIBDIR": str(pc_dir), "PKG_CONFIG_SYSTEM_LIBRARY_PATH": "/usr/lib64:/lib64"}
+    build_flags = resolve_flags(["foo"], env)
+    assert build_flags.link_flags == ["-L/opt/lib64", "-lfoo"]
+    for option, flags in (("--cflags", build_flags.compile_flags), ("--libs", build_flags.link_flags)):
+        assert subprocess.check_output(["pkg-config", option, "foo"], env=env).decode().split() == flags
+
+    # The defaults of a pkg-config built for this layout
+    fedora_defaults = {
+        "pc_path": [str(pc_dir), "/usr/share/pkgconfig"],
+        "pc_system_libdirs": ["/usr/lib64", "/lib64"],
+        "pc_system_includedirs": ["/usr/include"],
+    }
+    monkeypatch.setattr(pkgconfig_resolver, "_get_default_dirs", fedora_defaults.__getitem__)
+    assert resolve_flags(["foo"], {}) == build_flags
+
+
+def test_fallback_dirs_lib64(monkeypatch):
+    monkeypatch.setattr(sysconfig, "get_config_var", lambda name: None)
+    assert pkgconfig_resolver._get_fallback_dirs("pc_path") == [
+        "/usr/local/lib64/pkgconfig", "/usr/local/lib/pkgconfig", "/usr/local/share/pkgconfig",
+        "/usr/lib64/pkgconfig", "/usr/lib/pkgconfig", "/usr/share/pkgconfig",
+    ]
+    assert pkgconfig_resolver._get_fallback_dirs("pc_system_libdirs") == ["/usr/lib64", "/usr/lib", "/lib64", "/lib"]
@@ -1,6 +1,6 @@
 from pathlib import Path
 
-from cython_setuptools.pyproject import CythonSetuptoolsOptions, read_cython_setuptools_option
+from cython_setuptools.pyproject import CythonSetuptoolsOptions, _read_pyproject_from_string, read_cython_setuptools_option
 
 DATA_DIR = Path(__file__).parent / "data"
 
@@ -36,3 +36,39 @@ def test_multiples():
     extensions = read_cython_setuptools_option(pyproject)
     assert extensions["reblochon"].sources == ["reblochon.pyx"]
     assert extensions["croissant"].sources == ["croissant.pyx"]
+
+
+def test_cython_defaults():
+    pyproject = _read_pyproject_from_string("""
+[cython_defaults]
+include_dirs = ["include"]
+language = "c++"
+cython_directives = { language_level = 3, boundscheck = false }
+
+[cython_extensions.hot]
+sources = ["hot.pyx"]
+include_dirs = ["hot/include"]
+cython_directives = { boundscheck = true, wraparound = false }
+
+[cython_extensions.plain]
+sources = ["plain.pyx"]
+language = "c"
+""")
+    hot = pyproject.cython_extensions["hot"]
+    assert hot.include_dirs == ["include", "hot/include"]
+    assert hot.language == "c++"
+    assert hot.cython_directives == {"language_level": 3, "boundscheck": True, "wraparound": False}
+    plain = pyproject.cython_extensions["plain"]
+    assert plain.include_dirs == ["include"]
+    assert plain.language == "c"
+    assert plain.cython_directives == {"language_level": 3, "boundscheck": False}
+
+
+def test_pgo_config():
+    pyproject = _read_pyproject_from_string("""
+[tool.cython_setuptools.pgo]
+training_command = ["python", "-m", "pytest", "benchmarks"]
+""")
+    assert pyproject.cython_extensions == {}
+    assert pyproject.tool.cython_setuptools.pgo.training_command == ["python", "-m", "pytest", "benchmarks"]
+    assert pyproject.tool.cython_setuptools.pgo.profile_dir is None
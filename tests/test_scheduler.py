@@ -0,0 +1,106 @@
+import os
+import platform
+import sys
+import threading
+
+import pytest
+
+from cython_setuptools.scheduler import JobServer, MemoryBudget, get_makeflags_jobs, spawn_and_measure
+
+
+def test_get_makeflags_jobs():
+    assert get_makeflags_jobs(None) is None
+    assert get_makeflags_jobs("s --jobserver-auth=3,4") is None
+    assert get_makeflags_jobs(" -j8 --jobserver-auth=3,4") == 8
+    assert get_makeflags_jobs("--jobs=3") == 3
+
+
+@pytest.mark.skipif(platform.system() == "Windows", reason="The jobserver uses a pipe")
+def test_jobserver():
+    read_fd, write_fd = os.pipe()
+    try:
+        assert JobServer.from_makeflags("-j2") is None
+        assert JobServer.from_makeflags("-j2 --jobserver-auth=1000,1001") is None
+        jobserver = JobServer.from_makeflags(f"-j2 --jobserver-auth={read_fd},{write_fd}")
+        os.write(write_fd, b"+")
+        with jobserver.slot():
+            # The implicit slot is used, the token is still available
+            with jobserver.slot():
+                os.set_blocking(read_fd, False)
+                with pytest.raises(BlockingIOError):
+                    os.read(read_fd, 1)
+                os.set_blocking(read_fd, True)
+        assert os.read(read_fd, 1) == b"+"
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+@pytest.mark.skipif(platform.system() == "Windows", reason="The jobserver uses a pipe")
+def test_jobserver_non_blocking():
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    try:
+        jobserver = JobServer(read_fd, write_fd)
+        acquired = threading.Event()
+
+        def job():
+            with jobserver.slot():
+                acquired.set()
+
+        with jobserver.slot():
+            # No token is available yet, the job waits for it instead of failing
+            thread = threading.Thread(target=job)
+            thread.start()
+            assert not acquired.wait(0.2)
+            os.write(write_fd, b"+")
+            thread.join(5)
+            assert acquired.is_set()
+        assert os.read(read_fd, 1) == b"+"
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def test_memory_budget_estimate():
+    budget = MemoryBudget(8000, {"heavy.cpp": 6000}, jobs=4)
+    assert budget.estimate("heavy.cpp") == 6000
+    assert budget.estimate("unknown.cpp") == 2000
+    budget.record("unknown.cpp", 1000)
+    assert budget.history == {"heavy.cpp": 6000, "unknown.cpp": 1000}
+
+
+def test_memory_budget_reserve():
+    budget = MemoryBudget(8000, {"heavy.cpp": 6000, "light.cpp": 1000}, jobs=4)
+
+    def run(key):
+        with budget.reserve(key):
+            pass
+
+    with budget.reserve("heavy.cpp"):
+        light = threading.Thread(target=run, args=("light.cpp",))
+        light.start()
+        light.join(5)
+        assert not light.is_alive()
+        # A second heavy job does not fit in the budget and waits for the first one
+        second_heavy = threading.Thread(target=run, args=("heavy.cpp",))
+        second_heavy.start()
+        second_heavy.join(0.1)
+        assert second_heavy.is_alive()
+    second_heavy.join(5)
+    assert not second_heavy.is_alive()
+
+
+def test_memory_budget_unlimited():
+    budget = MemoryBudget(None, {}, jobs=2)
+    with budget.reserve("a.c"), budget.reserve("b.c"):
+        pass
+
+
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason="Needs os.wait4")
+def test_spawn_and_measure():
+    exit_code, peak_memory = spawn_and_measure([sys.executable, "-c", "x = bytearray(64 * 1024 * 1024)"])
+    assert exit_code == 0
+    assert peak_memory >= 64 * 1024 * 1024
+    exit_code, _ = spawn_and_measure([sys.executable, "-c", "raise SystemExit(3)"])
+    assert exit_code == 3
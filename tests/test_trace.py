@@ -0,0 +1,38 @@
+import json
+import os
+from pathlib import Path
+import time
+
+from cython_setuptools import trace
+from cython_setuptools.trace import NullTracer, Tracer, get_tracer
+
+
+def test_tracer(tmp_path: Path):
+    tracer = Tracer(tmp_path / "trace.json")
+    with tracer.span("compile", "foo.c", extension="foo") as args:
+        args["cache"] = "miss"
+    start_ns = time.perf_counter_ns()
+    tracer.add_span("cythonize", "foo", start_ns, start_ns + 2000, pid=1234)
+    tracer.save()
+
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert [(event["cat"], event["name"], event["ph"]) for event in events] == [
+        ("compile", "foo.c", "X"),
+        ("cythonize", "foo", "X"),
+    ]
+    assert events[0]["args"] == {"extension": "foo", "cache": "miss"}
+    assert events[0]["pid"] == os.getpid()
+    assert events[1]["pid"] == 1234
+    assert events[1]["dur"] == 2
+
+
+def test_get_tracer(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(trace, "_tracer", None)
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_TRACE", raising=False)
+    assert isinstance(get_tracer(), NullTracer)
+
+    monkeypatch.setattr(trace, "_tracer", None)
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_TRACE", str(tmp_path / "trace.json"))
+    tracer = get_tracer()
+    assert isinstance(tracer, Tracer)
+    assert get_tracer() is tracer
@@ -1,3 +1,4 @@
+import pytest
 from six import StringIO
 
 from cython_setuptools import vendor
@@ -71,3 +72,117 @@ def test_extract_missing_args():
     args, rest = vendor.extract_args("-a a", ["-b"])
     assert args == {}
     assert rest == "-a a"
+
+
+def test_parse_profile(monkeypatch):
+    monkeypatch.setenv("CC", "gcc")
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_PROFILE", raising=False)
+    config = """
+[cython-defaults]
+profile = release
+
+[cython-module: one]
+extra_compile_args = -O2
+
+[cython-module: two]
+profile = size
+"""
+    parsed = vendor.parse_setup_cfg(StringIO(config))
+    assert parsed["one"]["extra_compile_args"] == ["-O3", "-flto", "-O2"]
+    assert parsed["one"]["extra_link_args"] == ["-O3", "-flto=auto", "-fuse-linker-plugin"]
+    assert parsed["two"]["extra_compile_args"] == ["-Os", "-ffunction-sections", "-fdata-sections"]
+    assert "profile" not in vars(vendor.create_cython_ext_modules(parsed)[0])
+
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_PROFILE", "debug")
+    parsed = vendor.parse_setup_cfg(StringIO(config))
+    assert parsed["one"]["extra_compile_args"] == ["-O0", "-g", "-O2"]
+    assert parsed["two"]["extra_compile_args"] == ["-O0", "-g"]
+
+
+def test_parse_unknown_profile(monkeypatch):
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_PROFILE", raising=False)
+    with pytest.raises(ValueError, match="Unknown profile 'fast'"):
+        vendor.parse_setup_cfg(StringIO("[cython-module: one]\nprofile = fast\n"))
+
+
+def test_parse_lto(monkeypatch):
+    monkeypatch.setenv("CC", "gcc")
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_PROFILE", raising=False)
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_LTO", raising=False)
+    config = """
+[cython-module: one]
+lto = true
+
+[cython-module: two]
+profile = release
+lto = false
+"""
+    parsed = vendor.parse_setup_cfg(StringIO(config))
+    assert parsed["one"]["extra_compile_args"] == ["-flto"]
+    assert parsed["one"]["extra_link_args"] == ["-flto=auto", "-fuse-linker-plugin"]
+    assert parsed["two"]["extra_compile_args"] == ["-O3"]
+    assert "lto" not in vars(vendor.create_cython_ext_modules(parsed)[0])
+
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_LTO", "0")
+    assert vendor.parse_setup_cfg(StringIO(config))["one"]["extra_compile_args"] == []
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_LTO")
+    with pytest.raises(ValueError, match="Invalid lto 'fat'"):
+        vendor.parse_setup_cfg(StringIO("[cython-module: one]\nlto = fat\n"))
+
+
+def test_cythonize_only_stale_modules(tmp_path, monkeypatch):
+    from setuptools import Extension
+
+    from cython_setuptools import cythonize
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.pyx").write_text("def a():\n    return 1\n")
+    (tmp_path / "b.pyx").write_text("def b():\n    return 2\n")
+    cythonized_names = []
+    cythonize_extensions = cythonize.cythonize_extensions
+
+    def _record(extensions, **kwargs):
+        cythonized_names.extend(extension.name for extension in extensions)
+        return cythonize_extensions(extensions, **kwargs)
+
+    monkeypatch.setattr(cythonize, "cythonize_extensions", _record)
+
+    def create_extensions():
+        return [Extension("a", ["a.pyx"]), Extension("b", ["b.pyx"])]
+
+    extensions = vendor._cythonize(create_extensions(), False, str(tmp_path))
+    assert cythonized_names == ["a", "b"]
+    assert [extension.sources for extension in extensions] == [["a.c"], ["b.c"]]
+
+    # The unchanged modules are built from their generated files
+    cythonized_names.clear()
+    (tmp_path / "b.pyx").write_text("def b():\n    return 3\n")
+    extensions = vendor._cythonize(create_extensions(), False, str(tmp_path))
+    assert cythonized_names == ["b"]
+    assert [extension.sources for extension in extensions] == [["a.c"], ["b.c"]]
+
+    cythonized_names.clear()
+    vendor._cythonize(create_extensions(), False, str(tmp_path))
+    assert cythonized_names == []
+
+
+def test_setup_build_ext(tmp_path, monkeypatch):
+    from cython_setuptools.command import build_ext
+
+    monkeypatch.delenv("CYTHON_SETUPTOOLS_BUILD_EXT", raising=False)
+    (tmp_path / "setup.cfg").write_text("[cython-module: one]\nsources = one.c\n")
+    setup_kwargs = []
+    monkeypatch.setattr(vendor.setuptools, "setup", lambda **kwargs: setup_kwargs.append(kwargs))
+    setup_file = str(tmp_path / "setup.py")
+
+    # The build_ext command of setuptools is kept unless asked otherwise
+    vendor.setup(setup_file, cythonize=False)
+    assert "cmdclass" not in setup_kwargs[-1]
+    vendor.setup(setup_file, cythonize=False, build_ext=True)
+    assert setup_kwargs[-1]["cmdclass"] == {"build_ext": build_ext}
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_BUILD_EXT", "1")
+    vendor.setup(setup_file, cythonize=False)
+    assert setup_kwargs[-1]["cmdclass"] == {"build_ext": build_ext}
+    monkeypatch.setenv("CYTHON_SETUPTOOLS_BUILD_EXT", "0")
+    vendor.setup(setup_file, cythonize=False, build_ext=True)
+    assert "cmdclass" not in setup_kwargs[-1]